@@ -1,17 +1,31 @@
 """
     Exposes the app to be run by gunicorn via WSGI.
     Flask Migrate is linked here by creating a migrate instance.
+    The application's flask commands, e.g. flask seed, are registered here.
     Seeding the database occurs when the file is run from the command line.
 """
 
 from flask_migrate import Migrate
 
 from hello.app import app
+from hello.commands import register_commands
 from hello.database import db
+from hello.partitions import is_partition
 from hello.utils import seed_db
 
+
+def include_object(obj, name, type_, reflected, compare_to) -> bool:
+    """
+        Keeps the monthly visitor partitions, which have no model, out of flask db migrate.
+    """
+    return not (type_ == 'table' and reflected and is_partition(name))
+
+
 # attach Flask Migrate to the Flask application
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, include_object=include_object)
+
+# add the application's commands to the flask command line
+register_commands(app)
 
 # when app is run from the command line seed the database
 if __name__ == '__main__':
@@ -0,0 +1,4 @@
+"""
+    Benchmarks for the sample application's hot paths.
+    Each module can be run from the repository root, e.g. python -m benchmarks.geoip_benchmark
+"""
@@ -0,0 +1,72 @@
+"""
+    End to end load test of hello.app:app booted in this process with the fakes in benchmarks/fakes.py.
+    The application is served by a threaded werkzeug server on a free local port and loaded with
+    signed in requests to / at a fixed concurrency, like benchmarks/load_benchmark.py does for deployed servers.
+    Reports throughput, latency percentiles and the memory allocated while under load, and saves them as JSON.
+    Usage: python -m benchmarks.app_load_benchmark [--database-url postgresql://...] [--concurrency 16]
+               [--duration 10] [--graph-latency-ms 0] [--trace-allocations] [--output results/load.json]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import tracemalloc
+
+from werkzeug.serving import make_server
+
+from benchmarks.fakes import boot_app, sign_in, signed_in_sessions
+from benchmarks.harness import save_results
+from benchmarks.load_benchmark import run_load
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''),
+                        help='a migrated PostgreSQL database, SQLite is used when empty')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--graph-latency-ms', type=float, default=0)
+    parser.add_argument('--trace-allocations', action='store_true',
+                        help='trace allocations under load, which slows every request down')
+    parser.add_argument('--output', default='', help='JSON file the results are saved to')
+    args = parser.parse_args()
+
+    flask_app = boot_app(args.database_url, args.graph_latency_ms)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    cookies = sign_in(flask_app, signed_in_sessions(args.users))
+
+    # a short warm up fills the catalog, GeoIP and Graph profile caches
+    asyncio.run(run_load(url, cookies, min(args.concurrency, 4), 1))
+
+    if args.trace_allocations:
+        tracemalloc.start()
+    result = asyncio.run(run_load(url, cookies, args.concurrency, args.duration))
+    if args.trace_allocations:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['alloc_retained_bytes_per_request'] = current / max(result['requests'], 1)
+        result['alloc_peak_bytes'] = peak
+    server.shutdown()
+
+    result.update({'name': 'GET /', 'concurrency': args.concurrency, 'duration': args.duration,
+                   'database': 'postgresql' if args.database_url else 'sqlite'})
+    print(f"{'requests':>9}  {'errors':>6}  {'req/sec':>9}  {'p50 ms':>8}  {'p90 ms':>8}  {'p99 ms':>8}")
+    print(f"{result['requests']:>9,}  {result['errors']:>6,}  {result['requests_per_second']:>9,.1f}  "
+          f"{result['p50']:>8.2f}  {result['p90']:>8.2f}  {result['p99']:>8.2f}")
+    if args.trace_allocations:
+        print(f"peak traced memory {result['alloc_peak_bytes'] / 1024:,.0f} KiB, "
+              f"{result['alloc_retained_bytes_per_request']:,.0f} bytes retained per request")
+
+    if args.output:
+        save_results(args.output, 'load', [result])
+
+
+if __name__ == '__main__':
+    main()
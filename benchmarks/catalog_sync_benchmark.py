@@ -0,0 +1,99 @@
+"""
+    Measures the catalog sync in hello/catalog_sync.py on synthetic gzip compressed catalogs.
+    Without a database it times the streaming part of the pipeline (read, validate, escape,
+    batch and dedupe) on catalogs of growing size and reports its peak traced memory, which
+    should stay the same whatever the file size.
+    With --database-url it also syncs a catalog into an emptied azure_document table, syncs it
+    again unchanged, and syncs a catalog with a tenth of the documents changed and a tenth removed.
+    The database needs the migrations applied.
+    Usage: python -m benchmarks.catalog_sync_benchmark [--database-url postgresql://...] [--rows 1000000]
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks.harness import measure, report
+from hello.catalog_sync import dedupe_batch, read_rows, sync_documents, validate_rows
+from hello.seeding import batched
+
+
+def write_catalog(path: str, rows: int, changed_every: int = 0, removed_every: int = 0) -> None:
+    """
+        Writes a synthetic gzip compressed catalog, optionally retitling and leaving out every nth document.
+    """
+    categories = ['Azure Best Practices', 'Azure Whitepapers', 'Azure Technical Overviews']
+    with gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=1) as csvfile:
+        writer = csv.writer(csvfile)
+        for number in range(rows):
+            if removed_every and number % removed_every == 1:
+                continue
+            title = f"Azure security document {number}"
+            if changed_every and number % changed_every == 0:
+                title += ' (revised)'
+            writer.writerow([title, f"https://docs.microsoft.com/en-us/azure/security/document-{number}",
+                             categories[number % len(categories)]])
+
+
+def stream(path: str, batch_size: int) -> int:
+    """
+        Runs the file through the pipeline up to the database lookup, returning the rows kept.
+    """
+    counts = {'rows': 0, 'rejected': {}, 'rejected_lines': [], 'duplicates': 0}
+    return sum(len(dedupe_batch(batch, counts))
+               for batch in batched(validate_rows(read_rows(path), counts), batch_size))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''))
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in (args.rows // 10, args.rows):
+            path = os.path.join(directory, f"catalog-{rows}.csv.gz")
+            write_catalog(path, rows)
+
+            results.append(measure(f'stream + validate {rows:,} rows', lambda: stream(path, args.batch_size), rows))
+            tracemalloc.start()
+            stream(path, args.batch_size)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{rows:>12,} rows: peak traced memory {peak / 1024 / 1024:.1f} MiB")
+
+        if args.database_url:
+            import psycopg2
+
+            path = os.path.join(directory, f"catalog-{args.rows}.csv.gz")
+            changed_path = os.path.join(directory, 'catalog-changed.csv.gz')
+            write_catalog(changed_path, args.rows, changed_every=10, removed_every=10)
+
+            connection = psycopg2.connect(args.database_url)
+            cursor = connection.cursor()
+            cursor.execute("TRUNCATE azure_document")
+            connection.commit()
+
+            def sync(catalog_path):
+                counts = sync_documents(cursor, read_rows(catalog_path), args.batch_size)
+                connection.commit()
+                print(f"inserted {counts['inserted']:,}, updated {counts['updated']:,}, "
+                      f"unchanged {counts['unchanged']:,}, deleted {counts['deleted']:,}")
+
+            results.append(measure('sync into empty table', lambda: sync(path), args.rows))
+            results.append(measure('sync unchanged', lambda: sync(path), args.rows))
+            results.append(measure('sync 10% changed, 10% removed', lambda: sync(changed_path), args.rows))
+            cursor.execute("TRUNCATE azure_document")
+            connection.commit()
+            connection.close()
+
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+    Compares two saved benchmark result files, e.g. from the commits before and after a change.
+    Prints the throughput of every benchmark in both files and the relative change.
+    Usage: python -m benchmarks.compare results/before.json results/after.json
+"""
+
+import argparse
+import json
+
+
+def load(path: str) -> dict:
+    """
+        Reads a results file, returning its results keyed by benchmark name.
+    """
+    with open(path, encoding='utf-8') as results_file:
+        data = json.load(results_file)
+    return data['metadata'], {result['name']: result for result in data['results']}
+
+
+def throughput(result: dict) -> float:
+    """
+        Returns the operations or requests per second of a result.
+    """
+    return result.get('ops_per_second', result.get('requests_per_second', 0.0))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args()
+
+    baseline_metadata, baseline = load(args.baseline)
+    candidate_metadata, candidate = load(args.candidate)
+    print(f"baseline {baseline_metadata.get('commit')}  candidate {candidate_metadata.get('commit')}")
+
+    names = [name for name in baseline if name in candidate]
+    width = max([len(name) for name in names] + [9])
+    print(f"{'benchmark':<{width}}  {'baseline/s':>12}  {'candidate/s':>12}  {'change':>8}")
+    for name in names:
+        before, after = throughput(baseline[name]), throughput(candidate[name])
+        change = (after - before) / before * 100 if before else float('inf')
+        print(f"{name:<{width}}  {before:>12,.1f}  {after:>12,.1f}  {change:>+7.1f}%")
+
+    for name in sorted(set(baseline) ^ set(candidate)):
+        print(f"{name:<{width}}  only in {'baseline' if name in baseline else 'candidate'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+    In-process fakes for the services the application depends on, so hello.app can be booted
+    and benchmarked on a laptop:
+        Key Vault           secrets are served from a dictionary by FakeKeyVaultClient
+        Microsoft Graph     profiles are answered by FakeGraphAdapter without a network round trip
+        Application Insights telemetry goes to the in-memory sink
+        Sessions            are kept by the memory backend, or in PostgreSQL when a database url is given
+    The database is a local PostgreSQL with the migrations and scripts/functions.sql applied,
+    or a SQLite file created from the models when no database url is given.
+"""
+
+import itertools
+import json
+import os
+import tempfile
+import time
+import types
+from secrets import token_urlsafe
+
+import requests
+from requests.adapters import BaseAdapter
+
+# The session signing key of the booted application, also used to sign the load test cookies
+SECRET_KEY = 'benchmark-secret-key'
+
+
+class FakeKeyVaultClient:
+    """
+        Stands in for the Key Vault client, serving secrets from a dictionary.
+    """
+
+    def __init__(self, secrets: dict) -> None:
+        self.secrets = secrets
+
+    def get_secret(self, vault_uri, name, version):
+        """ Returns a key bundle like object holding the secret value """
+        if name not in self.secrets:
+            raise KeyError(name)
+        return types.SimpleNamespace(value=self.secrets[name])
+
+
+class FakeGraphAdapter(BaseAdapter):
+    """
+        A requests transport adapter answering Graph profile requests in-process after latency_ms.
+    """
+
+    def __init__(self, latency_ms: float = 0) -> None:
+        super().__init__()
+        self.latency = latency_ms / 1000
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        """ Returns a profile named after the bearer token """
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        token = request.headers.get('Authorization', '')[len('Bearer '):]
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps({'displayName': token[:32], 'mail': 'user@example.com'}).encode('utf-8')
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        """ Nothing to release """
+
+
+def boot_app(database_url: str = '', graph_latency_ms: float = 0, session_backend: str = ''):
+    """
+        Imports hello.app with the fakes installed and returns the Flask application.
+        session_backend defaults to postgres with a database url and to memory without,
+        as does the catalog search backend.
+        Must be called before anything reads a secret from the application's configuration.
+    """
+    sqlite_path = ''
+    if not database_url:
+        sqlite_path = os.path.join(tempfile.mkdtemp(prefix='hello-benchmark-'), 'benchmark.db')
+        database_url = f"sqlite:///{sqlite_path}"
+
+    os.environ.setdefault('TELEMETRY_SINK', 'memory')
+    os.environ.setdefault('GRAPH_RESOURCE_ENDPOINT', 'http://graph.invalid/v1.0/me/')
+    os.environ.setdefault('SESSION_BACKEND', session_backend or ('memory' if sqlite_path else 'postgres'))
+    os.environ.setdefault('CATALOG_SEARCH_BACKEND', 'memory' if sqlite_path else 'postgres')
+
+    from hello.secrets import secret_store
+    vault = FakeKeyVaultClient({
+        'PGCONNECTIONSTRING': database_url,
+        'FLASKSECRETKEY': SECRET_KEY,
+        'TENANT': 'benchmark-tenant',
+        'CLIENTID': 'benchmark-client',
+        'CLIENTSECRET': 'benchmark-client-secret',
+        'REDIRECTURI': 'http://127.0.0.1/token',
+        # an empty key leaves application insights disabled
+        'APPINSIGHTSKEY': '',
+    })
+    secret_store.client_factory = lambda: vault
+
+    from hello.app import app
+    from hello.graph import graph_client
+
+    adapter = FakeGraphAdapter(graph_latency_ms)
+    graph_client.session().mount('http://', adapter)
+    graph_client.session().mount('https://', adapter)
+
+    if sqlite_path:
+        prepare_sqlite(app)
+    else:
+        prepare_postgres(app)
+    return app
+
+
+def sign_in(flask_app, sessions: list) -> list:
+    """
+        Stores session data for signed in users the way the application's session interface does
+        and returns the value of each user's session cookie.
+    """
+    from hello.sessions import ServerSideSessionInterface, session_key, utcnow
+
+    interface = flask_app.session_interface
+    if not isinstance(interface, ServerSideSessionInterface):
+        serializer = interface.get_signing_serializer(flask_app)
+        return [serializer.dumps(data) for data in sessions]
+
+    cookies = []
+    with flask_app.app_context():
+        for data in sessions:
+            sid = token_urlsafe(32)
+            interface.backend.save(session_key(sid), data, utcnow() + interface.lifetime)
+            cookies.append(sid)
+    return cookies
+
+
+def signed_in_sessions(users: int, token_length: int = 0) -> list:
+    """
+        Returns the session data of distinct signed in users, with access tokens padded to token_length
+        with random characters, which compress no better than a real token.
+    """
+    expires_at = time.time() + 3600
+    sessions = []
+    for user in range(users):
+        token = f"benchmark-user-{user}-"
+        token += token_urlsafe(token_length)[:max(token_length - len(token), 0)]
+        sessions.append({'access_token': token, 'token_expires_at': expires_at})
+    return sessions
+
+
+def prepare_sqlite(flask_app) -> None:
+    """
+        Creates the tables from the models in the SQLite file, loads the seed documents
+        and writes visitors and their dimensions through the ORM, as the insert_visitor_ids function,
+        the dimension lookups and execute_values are PostgreSQL only.
+    """
+    from hello.database import db
+    from hello.models import AzureDocument, Visitor, VisitorBrowser, VisitorCountry, VisitorOperatingSystem
+    from hello.seeding import SEED_FILE, read_documents
+    from hello.visitor_queue import visitor_queue
+
+    # SQLite file databases are not pooled, so the pool options do not apply
+    flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+
+    with flask_app.app_context():
+        db.create_all()
+        db.session.bulk_insert_mappings(AzureDocument, [
+            {'title': title, 'url': url, 'category': category}
+            for title, url, category in read_documents(SEED_FILE)])
+        db.session.commit()
+
+    # SQLite only generates keys for a single column primary key, visitor's includes date_visited,
+    # and the dimensions' small integer keys are not generated either
+    keys = itertools.count(1)
+    dimension_ids = {VisitorCountry: {}, VisitorBrowser: {}, VisitorOperatingSystem: {}}
+
+    def dimension_id(model, name):
+        ids = dimension_ids[model]
+        if name not in ids:
+            ids[name] = len(ids) + 1
+            db.session.add(model(id=ids[name], name=name))
+        return ids[name]
+
+    def write_visitors(visitors):
+        with flask_app.app_context():
+            db.session.bulk_insert_mappings(Visitor, [
+                {'pk': next(keys), 'country_id': dimension_id(VisitorCountry, visitor.country),
+                 'browser_id': dimension_id(VisitorBrowser, visitor.browser),
+                 'operating_system_id': dimension_id(VisitorOperatingSystem, visitor.operating_system),
+                 'date_visited': visitor.date_visited}
+                for visitor in visitors])
+            db.session.commit()
+
+    visitor_queue.writer = write_visitors
+
+
+def prepare_postgres(_) -> None:
+    """
+        Seeds the document catalog when it is empty. The migrations must already be applied.
+    """
+    from hello.utils import seed_db
+
+    seed_db()
@@ -0,0 +1,68 @@
+"""
+    Compares the ways of resolving visitor countries on a synthetic list of ip addresses:
+        reopen          opens the GeoLite2 database for every lookup
+        shared reader   one memory-mapped reader shared by every lookup, no cache
+        cached          the shared reader behind the per address LRU cache
+        cached prefix   the shared reader behind the per /24 network LRU cache
+
+    Reopening is so slow that it only runs on the first --reopen-count addresses.
+    Usage: python -m benchmarks.geoip_benchmark [--count 1000000] [--reopen-count 10000]
+"""
+
+import argparse
+import random
+
+import maxminddb
+
+from benchmarks.harness import measure, report
+from hello.geoip import GeoIPLookup
+
+
+def synthetic_ips(count: int, distinct: int, seed: int) -> list:
+    """
+        Builds a list of IPv4 addresses where a few visitors account for most page views.
+    """
+    rng = random.Random(seed)
+    pool = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+            for _ in range(distinct)]
+    return [pool[min(int(rng.paretovariate(1.2)) - 1, distinct - 1)] if rng.random() < 0.8
+            else rng.choice(pool) for _ in range(count)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--distinct', type=int, default=100000)
+    parser.add_argument('--reopen-count', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    ips = synthetic_ips(args.count, args.distinct, args.seed)
+    uncached = GeoIPLookup(cache_size=0)
+    cached = GeoIPLookup()
+    cached_prefix = GeoIPLookup(cache_by_prefix=True)
+
+    def reopen():
+        for ip_address in ips[:args.reopen_count]:
+            reader = maxminddb.open_database(uncached.database_path)
+            reader.get(ip_address)
+            reader.close()
+
+    # open the shared readers before timing so that only lookups are measured
+    for lookup in (uncached, cached, cached_prefix):
+        lookup.reader()
+
+    results = [
+        measure('reopen', reopen, min(args.reopen_count, len(ips))),
+        measure('shared reader', lambda: [uncached.lookup(ip) for ip in ips], len(ips)),
+        measure('cached', lambda: [cached.lookup(ip) for ip in ips], len(ips)),
+        measure('cached prefix', lambda: [cached_prefix.lookup(ip) for ip in ips], len(ips)),
+        measure('lookup_many', lambda: GeoIPLookup().lookup_many(ips), len(ips)),
+    ]
+    report(results)
+    print(f"cached: {cached.cache_info()}")
+    print(f"cached prefix: {cached_prefix.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+    Shared helpers for the benchmark modules: timing a callable, latency percentiles, allocations,
+    printing a result table and saving results as JSON to compare them across commits.
+"""
+
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import tracemalloc
+from timeit import default_timer
+
+
+def measure(name: str, func, operations: int) -> dict:
+    """
+        Runs func once and returns its wall time, throughput and time per operation.
+        func is expected to perform the given number of operations.
+    """
+    start = default_timer()
+    func()
+    seconds = default_timer() - start
+
+    return {
+        'name': name,
+        'operations': operations,
+        'seconds': seconds,
+        'ops_per_second': operations / seconds if seconds else float('inf'),
+        'microseconds_per_op': seconds * 1e6 / operations if operations else 0.0,
+    }
+
+
+def percentiles(samples: list, fractions=(0.5, 0.9, 0.99)) -> dict:
+    """
+        Returns nearest-rank percentiles of the samples keyed p50, p90, p99.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{round(fraction * 100)}": 0.0 for fraction in fractions}
+    return {f"p{round(fraction * 100)}": ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+            for fraction in fractions}
+
+
+def report(results: list) -> None:
+    """
+        Prints benchmark results as an aligned table.
+    """
+    width = max(len(result['name']) for result in results)
+    print(f"{'benchmark':<{width}}  {'operations':>12}  {'seconds':>9}  {'ops/sec':>14}  {'us/op':>9}")
+    for result in results:
+        print(f"{result['name']:<{width}}  {result['operations']:>12,}  {result['seconds']:>9.3f}  "
+              f"{result['ops_per_second']:>14,.0f}  {result['microseconds_per_op']:>9.2f}")
+
+
+def profile(name: str, func, operations: int, rounds: int = 5) -> dict:
+    """
+        Runs func for several timed rounds and one traced round.
+        func is expected to perform the given number of operations per call.
+        Returns the throughput of the fastest round, percentiles of the per operation time
+        across rounds and the memory allocated by one round.
+    """
+    func()  # warm caches and lazy initialisation
+
+    seconds = []
+    for _ in range(rounds):
+        start = default_timer()
+        func()
+        seconds.append(default_timer() - start)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    func()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'name': name,
+        'operations': operations,
+        'rounds': rounds,
+        'seconds': min(seconds),
+        'ops_per_second': operations / min(seconds) if min(seconds) else float('inf'),
+        'microseconds_per_op': min(seconds) * 1e6 / operations if operations else 0.0,
+        'alloc_peak_bytes': peak - before,
+        'alloc_retained_bytes_per_op': (after - before) / operations if operations else 0.0,
+    }
+    result.update({f"{key}_us": value * 1e6 / operations
+                   for key, value in percentiles(seconds).items()})
+    return result
+
+
+def run_metadata() -> dict:
+    """
+        Describes the commit and interpreter a benchmark ran on.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def save_results(path: str, suite: str, results: list) -> None:
+    """
+        Writes benchmark results and the run's metadata as JSON, see benchmarks/compare.py.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as results_file:
+        json.dump({'suite': suite, 'metadata': run_metadata(), 'results': results}, results_file, indent=2)
+    print(f"Saved results to {path}")
@@ -0,0 +1,71 @@
+"""
+    Measures how fast a worker answers health probes, calling hello.app's WSGI callable directly
+    with the fakes in benchmarks/fakes.py installed:
+        flask /hello    the probe served by a Flask view, as it was before hello/health.py
+        liveness        /hello answered by the health middleware
+        readiness       /ready answered from the cached readiness check results
+    Usage: python -m benchmarks.health_benchmark [--database-url postgresql://...] [--requests 10000]
+"""
+
+import argparse
+import os
+
+from werkzeug.test import EnvironBuilder
+
+from benchmarks.fakes import boot_app
+from benchmarks.harness import profile, save_results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''),
+                        help='a migrated PostgreSQL database, SQLite is used when empty')
+    parser.add_argument('--requests', type=int, default=10000, help='probes per round')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--output', default='', help='JSON file the results are saved to')
+    args = parser.parse_args()
+
+    flask_app = boot_app(args.database_url)
+
+    # imported after boot_app, which installs the fakes before the application is created
+    from hello.health import health
+
+    # the probe as it was served before the middleware, through dispatch, sessions and every hook
+    flask_app.add_url_rule('/flask-hello', 'flask_hello', lambda: "Hello World Security App")
+    results = health.monitor.run_checks()
+    ready, summary = health.monitor.report()
+    print(f"readiness: {summary['status']}, " + ', '.join(
+        f"{name} {result.detail}" for name, result in results.items()))
+
+    def start_response(status, headers, exc_info=None):
+        assert status.startswith('200'), status
+
+    def probe(path):
+        environ = EnvironBuilder(path=path, environ_base={'REMOTE_ADDR': '10.0.0.4'}).get_environ()
+
+        def requests():
+            for _ in range(args.requests):
+                response = flask_app(dict(environ), start_response)
+                b''.join(response)
+                if hasattr(response, 'close'):
+                    response.close()
+        return requests
+
+    results = [
+        profile('flask /hello', probe('/flask-hello'), args.requests, args.rounds),
+        profile('liveness /hello', probe('/hello'), args.requests, args.rounds),
+        profile('readiness /ready', probe(flask_app.config['HEALTH_READINESS_PATH']), args.requests, args.rounds),
+    ]
+
+    width = max(len(result['name']) for result in results)
+    print(f"{'benchmark':<{width}}  {'probes/sec':>12}  {'p50 us':>9}  {'p90 us':>9}  {'p99 us':>9}")
+    for result in results:
+        print(f"{result['name']:<{width}}  {result['ops_per_second']:>12,.0f}  {result['p50_us']:>9.2f}  "
+              f"{result['p90_us']:>9.2f}  {result['p99_us']:>9.2f}")
+
+    if args.output:
+        save_results(args.output, 'health', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+    Load test comparing the Flask (WSGI) and async (ASGI) entry points at a fixed concurrency.
+    Sends signed-in requests to / and reports requests/sec and latency percentiles per target.
+
+    Start a stub Graph endpoint and both servers against a local PostgreSQL first, e.g.
+        python -m benchmarks.stub_graph --port 8400 &
+        export GRAPH_RESOURCE_ENDPOINT=http://127.0.0.1:8400/v1.0/me/
+        export SESSION_BACKEND=cookie
+        gunicorn -w 4 -b 127.0.0.1:8001 app:app &
+        gunicorn -w 4 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8002 hello.asgi:application &
+
+    Usage: python -m benchmarks.load_benchmark --secret-key KEY
+               --target wsgi=http://127.0.0.1:8001 --target asgi=http://127.0.0.1:8002
+               [--concurrency 32] [--duration 30] [--users 100]
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from benchmarks.harness import percentiles
+
+
+def session_cookies(secret_key: str, users: int) -> list:
+    """
+        Returns signed Flask session cookies for distinct signed in users.
+    """
+    flask_app = Flask(__name__)
+    flask_app.secret_key = secret_key
+    serializer = SecureCookieSessionInterface().get_signing_serializer(flask_app)
+    expires_at = time.time() + 3600
+    return [serializer.dumps({'access_token': f"benchmark-user-{user}", 'token_expires_at': expires_at})
+            for user in range(users)]
+
+
+async def run_load(url: str, cookies: list, concurrency: int, duration: float) -> dict:
+    """
+        Sends requests from concurrency workers for duration seconds and collects latencies.
+    """
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency), timeout=30) as client:
+
+        async def worker(number):
+            nonlocal errors
+            request = 0
+            while time.monotonic() < deadline:
+                cookie = cookies[(number + request * concurrency) % len(cookies)]
+                request += 1
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url, cookies={'session': cookie})
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker(number) for number in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    result = {'requests': len(latencies), 'errors': errors, 'requests_per_second': len(latencies) / elapsed}
+    result.update(percentiles([latency * 1000 for latency in latencies]))
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--target', action='append', required=True, help='name=base url')
+    parser.add_argument('--secret-key', required=True, help="the FLASKSECRETKEY the servers sign sessions with")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+
+    cookies = session_cookies(args.secret_key, args.users)
+    print(f"{'target':<10}  {'requests':>9}  {'errors':>6}  {'req/sec':>9}  {'p50 ms':>8}  {'p90 ms':>8}  {'p99 ms':>8}")
+    for target in args.target:
+        name, url = target.split('=', 1)
+        result = asyncio.run(run_load(url.rstrip('/') + '/', cookies, args.concurrency, args.duration))
+        print(f"{name:<10}  {result['requests']:>9,}  {result['errors']:>6,}  {result['requests_per_second']:>9,.1f}  "
+              f"{result['p50']:>8.2f}  {result['p90']:>8.2f}  {result['p99']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+    Microbenchmarks of the application's hot functions, run in-process against the fakes in benchmarks/fakes.py:
+        index               a signed in GET / through the Flask test client
+        api documents       GET /api/documents, serialized and answered 304 Not Modified from its ETag
+        get_country_from_ip cached and uncached GeoIP lookups
+        user agents         cached and uncached User-Agent parsing
+        HeaderValidator     single headers and a request's header block
+        seeding             parsing and COPY encoding of the seed file, the CPU part of seed_db
+        rendering           index.html per request and the fragment cache
+    Reports throughput, per operation time percentiles across rounds and allocations, and saves them as JSON.
+    Usage: python -m benchmarks.micro_benchmark [--database-url postgresql://...] [--output results/micro.json]
+"""
+
+import argparse
+import os
+import random
+from random import shuffle
+
+from benchmarks.fakes import boot_app, sign_in, signed_in_sessions
+from benchmarks.harness import profile, save_results
+
+HEADER_BLOCK = (
+    "Host: sample-linux-python-app.azurewebsites.net\r\n"
+    "User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/76.0 Safari/537.36\r\n"
+    "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+    "Accept-Encoding: gzip, deflate, br\r\n"
+    "Accept-Language: en-US,en;q=0.9\r\n"
+    "Cookie: session=eyJhY2Nlc3NfdG9rZW4iOiJ0b2tlbiJ9\r\n")
+
+
+def report(results: list) -> None:
+    """
+        Prints the results with their percentiles and allocations.
+    """
+    width = max(len(result['name']) for result in results)
+    print(f"{'benchmark':<{width}}  {'ops/sec':>12}  {'p50 us':>9}  {'p90 us':>9}  {'p99 us':>9}  "
+          f"{'peak KiB':>9}  {'kept B/op':>9}")
+    for result in results:
+        print(f"{result['name']:<{width}}  {result['ops_per_second']:>12,.0f}  {result['p50_us']:>9.2f}  "
+              f"{result['p90_us']:>9.2f}  {result['p99_us']:>9.2f}  {result['alloc_peak_bytes'] / 1024:>9.1f}  "
+              f"{result['alloc_retained_bytes_per_op']:>9.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''),
+                        help='a migrated PostgreSQL database, SQLite is used when empty')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--output', default='', help='JSON file the results are saved to')
+    args = parser.parse_args()
+
+    flask_app = boot_app(args.database_url)
+
+    # imported after boot_app, which installs the fakes before the application is created
+    from flask import render_template
+    from hello.app import get_country_from_ip
+    from hello.catalog import document_catalog
+    from hello.geoip import GeoIPLookup
+    from hello.useragents import UserAgentParser
+    from hello.rendering import IndexPageRenderer
+    from hello.seeding import SEED_FILE, copy_buffer, read_documents
+    from hello.validator import HeaderValidator
+
+    client = flask_app.test_client()
+    client.set_cookie('localhost', 'session', sign_in(flask_app, signed_in_sessions(1))[0])
+
+    addresses = [f"{random.randrange(1, 224)}.{random.randrange(256)}.{random.randrange(256)}.1"
+                 for _ in range(1000)]
+    uncached = GeoIPLookup(cache_size=0)
+    user_agent = HEADER_BLOCK.split('User-Agent: ')[1].split('\r\n')[0]
+    cached_parser, uncached_parser = UserAgentParser(), UserAgentParser(cache_size=0)
+    validator = HeaderValidator()
+    header_lines = HEADER_BLOCK.strip().split('\r\n')
+
+    with flask_app.test_request_context('/'):
+        snapshot = document_catalog.snapshot()
+    renderer = IndexPageRenderer(gzip=True)
+
+    class BenchmarkUser:
+        displayName = 'Benchmark User'
+
+    def index():
+        for _ in range(100):
+            response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+            assert response.status_code == 200, response.status_code
+
+    etag = client.get('/api/documents').headers['ETag']
+
+    def api_documents(headers):
+        def requests():
+            for _ in range(1000):
+                response = client.get('/api/documents', headers=headers)
+                assert response.status_code in (200, 304), response.status_code
+        return requests
+
+    def country_cached():
+        for _ in range(10000):
+            get_country_from_ip('40.112.72.205')
+
+    def country_uncached():
+        for address in addresses:
+            uncached.lookup(address)
+
+    def user_agent_cached():
+        for _ in range(10000):
+            cached_parser.parse(user_agent)
+
+    def user_agent_uncached():
+        for _ in range(1000):
+            uncached_parser.parse(user_agent)
+
+    def header():
+        for _ in range(1000):
+            for line in header_lines:
+                validator.is_valid(line)
+
+    def header_block():
+        for _ in range(1000):
+            validator.validate_many(HEADER_BLOCK)
+
+    def seeding():
+        for _ in range(10):
+            copy_buffer(list(read_documents(SEED_FILE)))
+
+    def render_template_per_request():
+        with flask_app.test_request_context('/'):
+            for _ in range(100):
+                documents = list(snapshot.documents)
+                shuffle(documents)
+                render_template("index.html", documents=documents, user=BenchmarkUser())
+
+    def render_fragments():
+        with flask_app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+            for _ in range(100):
+                renderer.render(snapshot, BenchmarkUser())
+
+    documents = len(snapshot.documents)
+    results = [
+        profile('index (GET /)', index, 100, args.rounds),
+        profile('GET /api/documents (200)', api_documents({}), 1000, args.rounds),
+        profile('GET /api/documents (304)', api_documents({'If-None-Match': etag}), 1000, args.rounds),
+        profile('get_country_from_ip (cached)', country_cached, 10000, args.rounds),
+        profile('geoip lookup (uncached)', country_uncached, len(addresses), args.rounds),
+        profile('user agent parse (cached)', user_agent_cached, 10000, args.rounds),
+        profile('user agent parse (uncached)', user_agent_uncached, 1000, args.rounds),
+        profile('HeaderValidator.is_valid', header, 1000 * len(header_lines), args.rounds),
+        profile('HeaderValidator.validate_many', header_block, 1000, args.rounds),
+        profile(f'seed file parse + COPY encode ({documents} rows)', seeding, 10, args.rounds),
+        profile('render index.html', render_template_per_request, 100, args.rounds),
+        profile('render fragments + gzip', render_fragments, 100, args.rounds),
+    ]
+
+    report(results)
+    if args.output:
+        save_results(args.output, 'micro', results)
+
+
+if __name__ == '__main__':
+    main()
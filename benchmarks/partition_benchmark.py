@@ -0,0 +1,176 @@
+"""
+    Runs the visitor partitioning migration against millions of synthetic visits and compares
+    inserts, date range queries and retention before and after it.
+    Needs a scratch PostgreSQL 12+ database: the visitor and azure_document tables are dropped and recreated.
+    Usage: python -m benchmarks.partition_benchmark --database-url postgresql://... [--rows 5000000]
+"""
+
+import argparse
+import datetime
+import importlib.util
+import io
+import os
+import random
+
+import sqlalchemy
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from psycopg2.extras import execute_values
+
+from benchmarks.harness import measure, report
+from hello.partitions import add_months, apply_retention, ensure_partitions, month_start
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS = os.path.join(ROOT, 'migrations', 'versions')
+FUNCTIONS = os.path.join(ROOT, 'scripts', 'functions.sql')
+
+COUNTRIES = ['United States', 'Germany', 'Japan', 'Brazil', 'India', 'N/A']
+BROWSERS = ['chrome', 'firefox', 'safari', 'edge']
+SYSTEMS = ['windows', 'macos', 'linux', 'android', 'iphone']
+
+
+def load_migration(name: str):
+    """
+        Imports a migration module from migrations/versions.
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(MIGRATIONS, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_migration(engine, module) -> None:
+    """
+        Runs the upgrade of a migration module in its own transaction.
+    """
+    with engine.begin() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            module.upgrade()
+
+
+def visits_buffer(rows: int, months: int, today: datetime.date) -> io.StringIO:
+    """
+        Encodes rows visits spread evenly over the last months, oldest first, in COPY text format.
+    """
+    start = datetime.datetime.combine(add_months(month_start(today), -months + 1), datetime.time())
+    step = (datetime.datetime.combine(today, datetime.time()) - start) / rows
+    buffer = io.StringIO()
+    for number in range(rows):
+        buffer.write(f"{random.choice(COUNTRIES)}\t{random.choice(BROWSERS)}\t{random.choice(SYSTEMS)}\t"
+                     f"{(start + step * number).isoformat(' ')}\n")
+    buffer.seek(0)
+    return buffer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'), required=False)
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--months', type=int, default=12, help='months the synthetic visits are spread over')
+    parser.add_argument('--single-inserts', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+
+    engine = sqlalchemy.create_engine(args.database_url)
+    raw = engine.raw_connection()
+    cursor = raw.cursor()
+    today = datetime.date.today()
+
+    def execute(statement, params=None):
+        cursor.execute(statement, params)
+        raw.commit()
+
+    def single_inserts():
+        for _ in range(args.single_inserts):
+            execute("SELECT insert_visitor(%s, %s, %s)",
+                    [random.choice(COUNTRIES), random.choice(BROWSERS), random.choice(SYSTEMS)])
+
+    def batch_inserts():
+        rows = [(random.choice(COUNTRIES), random.choice(BROWSERS), random.choice(SYSTEMS), None)
+                for _ in range(args.single_inserts)]
+        for offset in range(0, len(rows), 500):
+            execute_values(cursor, "INSERT INTO visitor (country, browser, operating_system, date_visited) VALUES %s",
+                           rows[offset:offset + 500], template="(%s, %s, %s, COALESCE(%s, NOW()))", page_size=500)
+            raw.commit()
+
+    def day_queries():
+        for _ in range(args.queries):
+            day = today - datetime.timedelta(days=random.randrange(28 * args.months))
+            cursor.execute("SELECT COUNT(*) FROM visitor WHERE date_visited >= %s AND date_visited < %s",
+                           [day, day + datetime.timedelta(days=1)])
+            cursor.fetchone()
+        raw.commit()
+
+    def week_queries():
+        for _ in range(args.queries // 10):
+            day = today - datetime.timedelta(days=random.randrange(28 * args.months))
+            cursor.execute("SELECT country, COUNT(*) FROM visitor WHERE date_visited >= %s AND date_visited < %s "
+                           "GROUP BY country", [day, day + datetime.timedelta(days=7)])
+            cursor.fetchall()
+        raw.commit()
+
+    cutoff = add_months(month_start(today), -(args.months // 2))
+
+    def delete_retention():
+        # rolled back so the same visits are partitioned afterwards
+        cursor.execute("DELETE FROM visitor WHERE date_visited < %s", [cutoff])
+        raw.rollback()
+
+    def partition_retention():
+        apply_retention(cursor, args.months // 2, 'drop', today)
+        raw.commit()
+
+    results = []
+
+    # the schema before partitioning, with the visits loaded in date order
+    execute("DROP TABLE IF EXISTS visitor, azure_document, alembic_version CASCADE")
+    execute("DROP SEQUENCE IF EXISTS visitor_pk_seq")
+    run_migration(engine, load_migration('60b1a64591b6_'))
+    with open(FUNCTIONS, encoding='utf-8') as functions:
+        execute(functions.read())
+
+    buffer = visits_buffer(args.rows, args.months, today)
+    results.append(measure('copy visits (unpartitioned)', lambda: (cursor.copy_expert(
+        "COPY visitor (country, browser, operating_system, date_visited) FROM STDIN", buffer), raw.commit()),
+        args.rows))
+    execute("ANALYZE visitor")
+    results.append(measure('insert_visitor (unpartitioned)', single_inserts, args.single_inserts))
+    results.append(measure('batched insert (unpartitioned)', batch_inserts, args.single_inserts))
+    results.append(measure('one day count (unpartitioned)', day_queries, args.queries))
+    results.append(measure('one week by country (unpartitioned)', week_queries, args.queries // 10))
+    cursor.execute("SELECT COUNT(*) FROM visitor WHERE date_visited < %s", [cutoff])
+    expired = cursor.fetchone()[0]
+    results.append(measure('retention by delete (unpartitioned)', delete_retention, expired))
+    cursor.execute("SELECT COUNT(*), MAX(pk) FROM visitor")
+    before = cursor.fetchone()
+    raw.commit()
+
+    raw.close()
+    results.append(measure('partition migration', lambda: run_migration(
+        engine, load_migration('8b21d6e5c0f4_partition_visitor')), before[0]))
+    raw = engine.raw_connection()
+    cursor = raw.cursor()
+
+    cursor.execute("SELECT COUNT(*), MAX(pk) FROM visitor")
+    after = cursor.fetchone()
+    assert after == before, f"the migration changed the visitors from {before} to {after}"
+    execute("ANALYZE visitor")
+
+    results.append(measure('insert_visitor (partitioned)', single_inserts, args.single_inserts))
+    results.append(measure('batched insert (partitioned)', batch_inserts, args.single_inserts))
+    results.append(measure('one day count (partitioned)', day_queries, args.queries))
+    results.append(measure('one week by country (partitioned)', week_queries, args.queries // 10))
+    results.append(measure('ensure partitions', lambda: (ensure_partitions(cursor, 3, today), raw.commit()), 1))
+
+    # retention: dropping whole partitions instead of deleting the same rows
+    results.append(measure('retention by detach and drop', partition_retention, expired))
+
+    report(results)
+    raw.close()
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+    Compares the CPU cost of rendering the index page per request with the fragment cache:
+        template            shuffles the documents and renders index.html
+        template + gzip     the above, compressed per request
+        fragments           shuffles pre-rendered card fragments and splices in the user
+        fragments + gzip    the above, assembled from pre-compressed fragments
+
+    Runs on a standalone Flask application using the application's templates, no services needed.
+    Usage: python -m benchmarks.render_benchmark [--documents 47] [--requests 2000]
+"""
+
+import argparse
+import gzip
+import os
+from random import shuffle
+
+from flask import Flask, render_template
+
+from benchmarks.harness import measure, report
+from hello.caching import CachePolicies
+from hello.catalog import CatalogSnapshot, DocumentRecord, catalog_version
+from hello.rendering import IndexPageRenderer
+from hello.seeding import SEED_FILE, read_documents
+
+
+class BenchmarkUser:
+    """
+        A signed in graph user.
+    """
+    displayName = 'Benchmark <User>'
+
+
+def create_benchmark_app() -> Flask:
+    """
+        Creates a Flask application serving the application's templates and static files.
+    """
+    package = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hello')
+    flask_app = Flask(__name__, template_folder=os.path.join(package, 'templates'),
+                      static_folder=os.path.join(package, 'static'), static_url_path='/static')
+    flask_app.add_url_rule('/logout', 'logout', lambda: '')
+    CachePolicies().init_app(flask_app)
+    return flask_app
+
+
+def build_snapshot(count: int) -> CatalogSnapshot:
+    """
+        Repeats the seed documents until the catalog holds count documents.
+    """
+    seed = list(read_documents(SEED_FILE))
+    documents = tuple(DocumentRecord(number, *seed[number % len(seed)]) for number in range(count))
+    return CatalogSnapshot(documents, catalog_version(documents))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--documents', type=int, default=47)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    flask_app = create_benchmark_app()
+    snapshot = build_snapshot(args.documents)
+    user = BenchmarkUser()
+    renderer = IndexPageRenderer(gzip=True)
+    requests = range(args.requests)
+
+    def template(compress=False):
+        for _ in requests:
+            documents = list(snapshot.documents)
+            shuffle(documents)
+            page = render_template("index.html", documents=documents, user=user).encode('utf-8')
+            if compress:
+                gzip.compress(page)
+
+    def fragments():
+        for _ in requests:
+            renderer.render(snapshot, user).get_data()
+
+    with flask_app.test_request_context('/'):
+        plain = renderer.render(snapshot, user).get_data()
+    with flask_app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+        compressed = renderer.render(snapshot, user).get_data()
+        # the fragment response must be a valid gzip stream of a complete page
+        assert len(gzip.decompress(compressed)) == len(plain)
+
+    results = []
+    with flask_app.test_request_context('/'):
+        results.append(measure('template', template, args.requests))
+        results.append(measure('template + gzip', lambda: template(compress=True), args.requests))
+        results.append(measure('fragments', fragments, args.requests))
+    with flask_app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+        results.append(measure('fragments + gzip', fragments, args.requests))
+
+    report(results)
+    print(f"page size: {len(plain):,} bytes, gzip: {len(compressed):,} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+    Measures catalog reads routed to read replicas by hello/database.py against reads on the primary alone,
+    while writer threads insert visitors into the primary, the mix of the index page.
+    Needs a migrated and seeded primary and at least one replica holding the same documents. Two local
+    PostgreSQL servers do, a replica that is not a standby reports no lag. Prints how the reads were spread
+    and the lag each replica reported.
+    Usage: python -m benchmarks.replica_benchmark --database-url postgresql://... --replica-url postgresql://...
+           [--replica-url ...] [--selection round_robin] [--readers 8] [--writers 4] [--reads 200]
+"""
+
+import argparse
+import os
+import threading
+
+from benchmarks.fakes import boot_app
+from benchmarks.harness import measure, report
+
+
+def run_mix(flask_app, readers: int, writers: int, reads: int) -> None:
+    """
+        Runs reader threads loading the catalog and writer threads inserting visitors until the readers finish.
+    """
+    from hello.models import AzureDocument, Visitor
+
+    done = threading.Event()
+
+    def read():
+        with flask_app.app_context():
+            for _ in range(reads):
+                AzureDocument.load_rows()
+
+    def write():
+        with flask_app.app_context():
+            while not done.is_set():
+                Visitor.save_(Visitor.create_('Local', 'benchmark', 'Linux'))
+
+    writer_threads = [threading.Thread(target=write) for _ in range(writers)]
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in writer_threads + reader_threads:
+        thread.start()
+    for thread in reader_threads:
+        thread.join()
+    done.set()
+    for thread in writer_threads:
+        thread.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--replica-url', action='append', required=True)
+    parser.add_argument('--selection', default='round_robin')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--reads', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_REPLICA_URLS'] = ','.join(args.replica_url)
+    os.environ['DATABASE_REPLICA_SELECTION'] = args.selection
+    flask_app = boot_app(args.database_url)
+
+    from hello.database import replica_router
+
+    operations = args.readers * args.reads
+    replicas = replica_router.replicas
+    replica_router.check_lag()
+
+    replica_router.replicas = []
+    results = [measure('catalog loads, primary only', lambda: run_mix(
+        flask_app, args.readers, args.writers, args.reads), operations)]
+    replica_router.replicas = replicas
+    primary_reads = replica_router.stats()['primary_reads']
+    results.append(measure(f"catalog loads, {len(replicas)} replicas ({args.selection})", lambda: run_mix(
+        flask_app, args.readers, args.writers, args.reads), operations))
+    report(results)
+
+    stats = replica_router.stats()
+    print(f"reads on replicas {stats['replica_reads']}, on the primary {stats['primary_reads'] - primary_reads}, "
+          f"replica errors {stats['replica_errors']}")
+    for replica in stats['replicas']:
+        print(f"  {replica['url']}: {replica['reads']} reads, lag {replica['lag_seconds']} s, "
+              f"{'available' if replica['available'] else 'unavailable'}")
+
+
+if __name__ == '__main__':
+    main()
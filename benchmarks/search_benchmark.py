@@ -0,0 +1,72 @@
+"""
+    Compares catalog queries answered by scanning the cached catalog with the inverted index in hello/search.py,
+    on a catalog of repeated seed documents. Each query fetches a page far into the catalog:
+        category page       the documents of one category after a pk
+        search page         the documents whose titles hold two words, after a pk
+    Runs in-process without services, the postgres backend needs a migrated database and is not measured here.
+    Usage: python -m benchmarks.search_benchmark [--documents 50000] [--requests 2000]
+"""
+
+import argparse
+
+from benchmarks.harness import measure, report
+from hello.catalog import CatalogSnapshot, DocumentRecord, catalog_version
+from hello.search import InvertedIndex, page_of, search_words
+from hello.seeding import SEED_FILE, read_documents
+
+
+def scan(documents, category: str, search: str, after: int, limit: int):
+    """
+        Filters every cached document, the cost of a query without an index.
+    """
+    words = search_words(search)
+    found = []
+    for document in documents:
+        if document.pk <= after or (category and document.category != category):
+            continue
+        if all(word in search_words(document.title) for word in words):
+            found.append(document)
+            if len(found) > limit:
+                break
+    return page_of(found, limit)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--documents', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    seed = list(read_documents(SEED_FILE))
+    documents = tuple(DocumentRecord(number, *seed[number % len(seed)]) for number in range(1, args.documents + 1))
+    snapshot = CatalogSnapshot(documents, catalog_version(documents))
+    category = seed[0][2]
+    after = args.documents * 9 // 10
+
+    results = [measure('build inverted index', lambda: InvertedIndex(snapshot.documents), 1)]
+    index = InvertedIndex(snapshot.documents)
+    queries = {
+        'category page': (category, ''),
+        'search page': ('', 'security practices'),
+    }
+    for name, (query_category, search) in queries.items():
+        assert scan(documents, query_category, search, after, args.limit) == \
+            index.query(query_category, search, after, args.limit)
+
+        def scanned():
+            for _ in range(args.requests // 100):
+                scan(documents, query_category, search, after, args.limit)
+
+        def indexed():
+            for _ in range(args.requests):
+                index.query(query_category, search, after, args.limit)
+
+        results.append(measure(f"{name} (scan)", scanned, args.requests // 100))
+        results.append(measure(f"{name} (inverted index)", indexed, args.requests))
+
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
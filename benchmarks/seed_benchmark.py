@@ -0,0 +1,85 @@
+"""
+    Compares seeding the document catalog row by row, the way seed_db used to through
+    AzureDocument.save_, with the COPY based bulk loader in hello/seeding.py.
+    Needs a PostgreSQL database with the migrations applied and the functions in scripts/functions.sql,
+    the azure_document table is emptied before each run.
+    Usage: python -m benchmarks.seed_benchmark --database-url postgresql://... [--rows 100000]
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+
+import psycopg2
+
+from benchmarks.harness import measure, report
+from hello.seeding import load_documents, read_documents
+
+
+def write_catalog(path: str, rows: int) -> None:
+    """
+        Writes a synthetic catalog CSV file in the format of seed-data/asis-content.csv.
+    """
+    categories = ['Azure Best Practices', 'Azure Whitepapers', 'Azure Technical Overviews']
+    with open(path, 'w', encoding='utf-8', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        for number in range(rows):
+            writer.writerow([f"Azure security document {number}",
+                             f"https://docs.microsoft.com/en-us/azure/security/document-{number}",
+                             categories[number % len(categories)]])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'), required=False)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--row-by-row-rows', type=int, default=5000,
+                        help='the row by row path is slow, so it only loads this many rows')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+
+    connection = psycopg2.connect(args.database_url)
+    cursor = connection.cursor()
+
+    def truncate():
+        cursor.execute("TRUNCATE azure_document")
+        connection.commit()
+
+    def row_by_row():
+        for number, row in enumerate(read_documents(path)):
+            if number == args.row_by_row_rows:
+                break
+            cursor.callproc("insert_azure_document", list(row))
+            connection.commit()
+
+    def bulk():
+        load_documents(cursor, read_documents(path), args.batch_size)
+        connection.commit()
+
+    def bulk_upsert():
+        load_documents(cursor, read_documents(path), args.batch_size, upsert=True)
+        connection.commit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'catalog.csv')
+        write_catalog(path, args.rows)
+
+        results = []
+        truncate()
+        results.append(measure('row by row', row_by_row, min(args.rows, args.row_by_row_rows)))
+        truncate()
+        results.append(measure('copy', bulk, args.rows))
+        results.append(measure('copy upsert (unchanged)', bulk_upsert, args.rows))
+        truncate()
+        results.append(measure('copy upsert (empty table)', bulk_upsert, args.rows))
+        truncate()
+
+    report(results)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
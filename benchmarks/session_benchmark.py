@@ -0,0 +1,76 @@
+"""
+    Compares Flask's signed cookie sessions with the server-side sessions in hello/sessions.py,
+    in-process against the fakes in benchmarks/fakes.py. Each user's session holds an access token
+    the size of an Azure AD one. For every mode it reports the bytes of the Cookie request header
+    and the handling time of a signed in GET / and of the GET /hello health probe.
+    The postgres mode needs a migrated database given with --database-url.
+    Usage: python -m benchmarks.session_benchmark [--database-url postgresql://...] [--token-length 2000]
+"""
+
+import argparse
+import os
+
+from flask.sessions import SecureCookieSessionInterface
+
+from benchmarks.fakes import boot_app, sign_in, signed_in_sessions
+from benchmarks.harness import profile, save_results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''),
+                        help='a migrated PostgreSQL database, SQLite without the postgres mode when empty')
+    parser.add_argument('--token-length', type=int, default=2000, help='characters in each access token')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=200, help='requests per round')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--output', default='', help='JSON file the results are saved to')
+    args = parser.parse_args()
+
+    flask_app = boot_app(args.database_url)
+
+    # imported after boot_app, which installs the fakes before the application is created
+    from hello.sessions import MemorySessionBackend, PostgresSessionBackend, ServerSideSessionInterface
+
+    modes = {
+        'cookie': SecureCookieSessionInterface(),
+        'memory': ServerSideSessionInterface(MemorySessionBackend(args.users)),
+    }
+    if args.database_url:
+        modes['postgres'] = ServerSideSessionInterface(PostgresSessionBackend())
+
+    sessions = signed_in_sessions(args.users, args.token_length)
+    client = flask_app.test_client()
+    results = []
+    for mode, interface in modes.items():
+        flask_app.session_interface = interface
+        cookies = sign_in(flask_app, sessions)
+        cookie_bytes = max(len(f"{flask_app.session_cookie_name}={cookie}") for cookie in cookies)
+
+        def get(path):
+            def requests():
+                for number in range(args.requests):
+                    client.set_cookie('localhost', flask_app.session_cookie_name, cookies[number % len(cookies)])
+                    response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+                    assert response.status_code == 200, response.status_code
+            return requests
+
+        # fills the Graph profile cache of every user
+        get('/')()
+        for path in ('/', '/hello'):
+            result = profile(f"{mode} GET {path}", get(path), args.requests, args.rounds)
+            result['cookie_bytes'] = cookie_bytes
+            results.append(result)
+
+    width = max(len(result['name']) for result in results)
+    print(f"{'benchmark':<{width}}  {'cookie B':>9}  {'req/sec':>9}  {'p50 us':>9}  {'p90 us':>9}  {'p99 us':>9}")
+    for result in results:
+        print(f"{result['name']:<{width}}  {result['cookie_bytes']:>9,}  {result['ops_per_second']:>9,.0f}  "
+              f"{result['p50_us']:>9.1f}  {result['p90_us']:>9.1f}  {result['p99_us']:>9.1f}")
+
+    if args.output:
+        save_results(args.output, 'sessions', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+    Measures how long a worker takes to boot: a fresh interpreter imports hello.app with stubbed
+    Key Vault secrets and serves its first request, several times over. Prints the median timings,
+    the number of secrets fetched while importing (expected to be 0) and, with --profile, the
+    slowest imports reported by python -X importtime.
+    Usage: python -m benchmarks.startup_benchmark [--runs 5] [--profile] [--top 25] [--output results/startup.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import save_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter, prints its timings as JSON on the last line
+BOOT = """
+import json, time, types
+started = time.perf_counter()
+
+from hello.secrets import secret_store
+
+class StubKeyVaultClient:
+    fetched = 0
+
+    def get_secret(self, vault_uri, name, version):
+        StubKeyVaultClient.fetched += 1
+        secrets = {'PGCONNECTIONSTRING': 'sqlite://', 'FLASKSECRETKEY': 'startup-benchmark',
+                   'REDIRECTURI': 'http://127.0.0.1/token'}
+        return types.SimpleNamespace(value=secrets.get(name, 'startup-benchmark'))
+
+secret_store.client_factory = StubKeyVaultClient
+
+from hello.app import app
+imported = time.perf_counter()
+fetched_on_import = StubKeyVaultClient.fetched
+
+response = app.test_client().get('/hello')
+served = time.perf_counter()
+
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_request_ms': (served - imported) * 1000,
+                  'secrets_fetched_on_import': fetched_on_import, 'status': response.status_code}))
+"""
+
+
+def boot(importtime: bool = False) -> tuple:
+    """
+        Boots the application in a fresh interpreter, returning its timings and stderr.
+    """
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', BOOT]
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True,
+                               env=dict(os.environ, TELEMETRY_SINK='none'))
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_ms'] = (time.perf_counter() - started) * 1000
+    return result, completed.stderr
+
+
+def slowest_imports(importtime_output: str, top: int) -> list:
+    """
+        Returns the (cumulative microseconds, module) pairs of the slowest imports.
+    """
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--profile', action='store_true', help='print the slowest imports')
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--output', default='', help='JSON file the results are saved to')
+    args = parser.parse_args()
+
+    runs = [boot()[0] for _ in range(args.runs)]
+    result = {'name': 'worker boot', 'runs': args.runs}
+    for key in ('process_ms', 'import_ms', 'first_request_ms'):
+        result[key] = statistics.median(run[key] for run in runs)
+    result['secrets_fetched_on_import'] = max(run['secrets_fetched_on_import'] for run in runs)
+
+    print(f"median of {args.runs} boots: process {result['process_ms']:.0f} ms, "
+          f"import hello.app {result['import_ms']:.0f} ms, first request {result['first_request_ms']:.0f} ms")
+    print(f"secrets fetched while importing: {result['secrets_fetched_on_import']}")
+
+    if args.profile:
+        _, importtime_output = boot(importtime=True)
+        print(f"\n{'cumulative ms':>13}  module")
+        for cumulative, module in slowest_imports(importtime_output, args.top):
+            print(f"{cumulative / 1000:>13.1f}  {module}")
+
+    if args.output:
+        save_results(args.output, 'startup', [result])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+    A local stand in for the Microsoft Graph /me/ endpoint used by the load benchmarks.
+    Every request is answered after --latency-ms with a profile named after the bearer token.
+    Usage: python -m benchmarks.stub_graph [--port 8400] [--latency-ms 50]
+"""
+
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def create_server(port: int, latency_ms: float) -> ThreadingHTTPServer:
+    """
+        Creates a threaded HTTP server answering profile requests.
+    """
+
+    class GraphHandler(BaseHTTPRequestHandler):
+        """
+            Answers every GET with a Graph user profile.
+        """
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            """ Returns a profile for the bearer token """
+            time.sleep(latency_ms / 1000)
+            token = self.headers.get('Authorization', '')[len('Bearer '):]
+            body = json.dumps({'displayName': token[:32], 'mail': 'user@example.com'}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            """ Keeps the benchmark output quiet """
+
+    return ThreadingHTTPServer(('127.0.0.1', port), GraphHandler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--port', type=int, default=8400)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    server = create_server(args.port, args.latency_ms)
+    print(f"Stub Graph listening on http://127.0.0.1:{args.port}/v1.0/me/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
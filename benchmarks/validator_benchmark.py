@@ -0,0 +1,102 @@
+"""
+    Compares the regular expression based HeaderValidator with the original
+    list based implementation on realistic request header sets.
+    Usage: python -m benchmarks.validator_benchmark [--requests 20000]
+"""
+
+import argparse
+
+from benchmarks.harness import measure, report
+from hello.validator import HeaderValidator
+
+# Headers sent by a browser loading the index page after signing in
+BROWSER_HEADERS = [
+    'Host: sample-linux-python-app.azurewebsites.net',
+    'Connection: keep-alive',
+    'Cache-Control: max-age=0',
+    'Upgrade-Insecure-Requests: 1',
+    'User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/72.0.3626.109 Safari/537.36',
+    'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+    'Referer: https://login.microsoftonline.com/',
+    'Accept-Encoding: gzip, deflate, br',
+    'Accept-Language: en-US,en;q=0.9',
+    'Cookie: session=' + 'eyJhY2Nlc3NfdG9rZW4iOiJleUowZVhBaU9pSktWMVFpTENKaGJHY2lPaUpTVXpJMU5pSjkifQ' * 20,
+    'X-Forwarded-For: 17.0.0.1:53422',
+    'X-ARR-SSL: 2048|256|C=US, S=Washington, L=Redmond, O=Microsoft Corporation, CN=Microsoft IT TLS CA 4',
+]
+
+
+class LegacyHeaderValidator:
+    """
+        The original implementation, keeping allowed name characters in a list.
+    """
+
+    def __init__(self):
+        self.allowed_header_name_chars = []
+        self.allowed_header_name_chars.extend(list(range(48, 58)))
+        self.allowed_header_name_chars.extend(list(range(65, 91)))
+        self.allowed_header_name_chars.extend(list(range(97, 123)))
+        self.allowed_header_name_chars.extend([94, 95, 96, 124, 126])
+        self.allowed_header_name_chars.extend([33, 35, 36, 37, 38, 39, 42, 43, 45, 46])
+
+    def is_valid_value_character(self, char):
+        """ Checks whether a header value character is valid """
+        return char == 9 or (31 < char <= 255 and char != 127)
+
+    def is_valid_header_value(self, value):
+        """ Checks whether a header value is valid """
+        characters = [ord(char) for char in value]
+        for char in characters:
+            if not self.is_valid_value_character(char):
+                return False
+        return True
+
+    def is_valid_header_name(self, name):
+        """ Checks whether a header name is valid """
+        characters = [ord(char) for char in name]
+        for char in characters:
+            if char not in self.allowed_header_name_chars:
+                return False
+        return True
+
+    def is_valid(self, header):
+        """ Validates a header string """
+        try:
+            name, value = header.split(':', 1)
+            name, value = name.strip(), value.strip()
+            if name and value:
+                return self.is_valid_header_name(name) and self.is_valid_header_value(value)
+        except ValueError:
+            pass
+        return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    legacy = LegacyHeaderValidator()
+    validator = HeaderValidator()
+    requests = range(args.requests)
+    block = '\r\n'.join(BROWSER_HEADERS)
+    block_bytes = block.encode('latin-1')
+    headers = args.requests * len(BROWSER_HEADERS)
+
+    assert [legacy.is_valid(header) for header in BROWSER_HEADERS] == validator.validate_many(block)
+
+    report([
+        measure('legacy is_valid', lambda: [
+            [legacy.is_valid(header) for header in BROWSER_HEADERS] for _ in requests], headers),
+        measure('is_valid', lambda: [
+            [validator.is_valid(header) for header in BROWSER_HEADERS] for _ in requests], headers),
+        measure('validate_many (str block)', lambda: [
+            validator.validate_many(block) for _ in requests], headers),
+        measure('validate_many (bytes block)', lambda: [
+            validator.validate_many(block_bytes) for _ in requests], headers),
+    ])
+
+
+if __name__ == '__main__':
+    main()
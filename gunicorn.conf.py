@@ -0,0 +1,20 @@
+"""
+    Gunicorn settings shared by the WSGI and ASGI servers started in init.sh.
+    With GUNICORN_PRELOAD (the default) the application is imported once in the master process
+    and warmed up by hello.preload before the workers are forked, see hello/preload.py.
+"""
+
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def when_ready(server):
+    """
+        Warms up the preloaded application before the first worker is forked.
+    """
+    if preload_app:
+        from hello.app import app
+        from hello.preload import warm_up
+
+        server.log.info("Preloaded the application in %.3f seconds", warm_up(app))
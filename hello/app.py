@@ -6,17 +6,27 @@
 
 import html
 import uuid
-from timeit import default_timer
 from random import shuffle
 
-import adal
-import requests
-from flask import  Flask, Response, render_template, request, url_for, session, redirect
-from geolite2 import geolite2
-
-from hello.database import db
-from hello.models import Visitor, AzureDocument
-from hello.insights import get_telemetry_client
+from flask import  Flask, Response, abort, jsonify, render_template, request, url_for, session, redirect
+
+from hello.auth import authenticator
+from hello.caching import REVALIDATE, cache_policies, cache_policy
+from hello.catalog import document_catalog
+from hello.database import db, replica_router
+from hello.dimensions import visitor_dimensions
+from hello.geoip import geoip
+from hello.graph import graph_client
+from hello.health import health
+from hello.instrumentation import instrumentation, span
+from hello.lazy import LazyConfig
+from hello.models import Visitor
+from hello.rendering import index_page
+from hello.search import document_search
+from hello.sessions import session_store
+from hello.insights import telemetry
+from hello.useragents import user_agents
+from hello.visitor_queue import visitor_queue
 import hello.config as config
 
 class User:
@@ -31,49 +41,81 @@ class User:
 
 
 
-def graphcall():
+def graphcall(token):
     """
         Fetch the users profile after successful authentication via Azure AD
-        Receives the token from the session and hits the graph resource endpoint
+        Receives the user's tokens from the token cache and hits the graph resource endpoint
+        The profile is cached per token by the graph client until the token expires.
     """
-    http_headers = {'Authorization': 'Bearer ' + session.get('access_token'),
-                    'User-Agent': 'adal-python-sample',
-                    'Accept': 'application/json',
-                    'Content-Type': 'application/json',
-                    'client-request-id': str(uuid.uuid4())}
-
-    graph_data = requests.get(config.RESOURCE_ENDPOINT, headers=http_headers, stream=False).json()
-    return graph_data
+    return graph_client.get_profile(token.access_token, token.expires_at)
 
 
 def get_country_from_ip(ip_address: str) -> str:
     """
         Gets a visitors country name from their ip address.
-        Looks up the country using geolite2's API.
+        Looks up the country using the shared, cached GeoLite2 reader in geoip.py.
     """
-    reader = geolite2.reader()
-    country_data = reader.get(ip_address)
-    country = "N/A"
-    if country_data:
-        country = country_data.get('country', {}).get('names', {}).get('en', '')
-    return country
+    return geoip.lookup(ip_address)
+
+
+def describe_visitor(ip_address: str, user_agent: str) -> tuple:
+    """
+        Returns the escaped country, browser and operating system of a visitor,
+        given their ip address and User-Agent header.
+        Both lookups are cached, see geoip.py and useragents.py.
+    """
+    # get the request origin country
+    country = get_country_from_ip(ip_address)
+
+    # get the operating system and browser version
+    browser, operating_system = user_agents.parse(user_agent)
+
+    # escape data going to be stored in the database
+    return html.escape(country), browser, operating_system
 
 
 def register_extensions(flask_app):
     """
         Initializes all extensions the application depends on.
         Add more extension initialization calls here.
-        SQLAlchemy is initialized here.
+        SQLAlchemy and its read replica routing, the visitor write-behind queue and dimension id cache,
+        the document catalog cache, the GeoIP lookup service, the User-Agent parser, the telemetry pipeline,
+        the index page renderer, the catalog search, the Microsoft Graph client, the request instrumentation,
+        the server-side sessions, the Azure AD token cache, the HTTP cache policies
+        and the health probes are initialized here.
     """
     db.init_app(flask_app)
+    replica_router.init_app(flask_app)
+    visitor_queue.init_app(flask_app)
+    visitor_dimensions.init_app(flask_app)
+    document_catalog.init_app(flask_app)
+    document_search.init_app(flask_app)
+    geoip.init_app(flask_app)
+    user_agents.init_app(flask_app)
+    telemetry.init_app(flask_app)
+    index_page.init_app(flask_app)
+    graph_client.init_app(flask_app)
+    instrumentation.init_app(flask_app)
+    session_store.init_app(flask_app)
+    authenticator.init_app(flask_app)
+    cache_policies.init_app(flask_app)
+    health.init_app(flask_app)
+
+
+class Application(Flask):
+    """
+        Flask application whose configuration resolves deferred settings, e.g. Key Vault secrets, on first use.
+    """
+    config_class = LazyConfig
 
 
 def create_app(config_file):
     """
         Creates a default app and configure's it using the object in the config.py file.
         Registers any external extensions the app uses.
+        Creating the app makes no network calls, secrets are fetched when a setting first needs them.
     """
-    flask_app = Flask(__name__, static_folder=config.STATIC_FOLDER)
+    flask_app = Application(__name__, static_folder=config.STATIC_FOLDER)
     flask_app.config.from_object(config_file)
     register_extensions(flask_app)
     return flask_app
@@ -88,8 +130,8 @@ app = create_app(config)
 def add_headers(response):
     """
         This function adds headers to outbound requests to increase the security posture in the browser
+        The Cache-Control header is set per route by the cache policies, see caching.py.
     """
-    response.headers["Cache-Control"] = "public, max-age=31536000"
     response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
     response.headers["X-Frame-Options"] = "DENY"
     response.headers["X-XSS-Protection"] = "1; mode=block"
@@ -98,86 +140,86 @@ def add_headers(response):
 
 
 @app.route("/", methods=['GET'])
+@span('index', metric='Request Response Time')
 def index():
     """
         The index route of the application.
         Serves the home page with the documentation articles that are fetched from the database.
         Errors and metrics are tracked using application insights.
+        Each phase is timed as a span, see instrumentation.py.
     """
-    if not session.get('access_token'):
+    token = authenticator.session_token(session)
+    if token is None:
         resp = Response(status=307)
-        resp.headers['location'] = f"{config.BASE_URI}/login"
+        resp.headers['location'] = f"{app.config['BASE_URI']}/login"
         return resp
 
-    user_json = graphcall()
+    with span('graph', metric='Graph Profile Time'):
+        user_json = graphcall(token)
     user = User(**user_json)
-    # capture the request start time
-    start = default_timer()
-
-    # retrieve an application insights telemetry client
-    telemetry_client = get_telemetry_client()
 
     # capture a website visitor's request details
     try:
-        with app.app_context():
-            # get the request origin country
-            ip_address = request.remote_addr
-            country = get_country_from_ip(ip_address)
-
-            # get the operating system and browser version
-            browser = "N/A"
-            if request.user_agent.browser and request.user_agent.version:
-                browser = request.user_agent.browser + request.user_agent.version
-            operating_system = request.user_agent.platform if request.user_agent.platform else "N/A"
-
-            # escape data going to be stored in the database
-            country, browser, operating_system = (
-                html.escape(country), html.escape(browser), html.escape(operating_system))
+        # get the request origin country, browser and operating system
+        with span('describe_visitor'):
+            country, browser, operating_system = describe_visitor(
+                request.remote_addr, request.headers.get('User-Agent', ''))
 
-            # store the database write time
-            db_write_start = default_timer()
-
-            # create a visitor,use stored procedures called in the Visitor.save_ method
+        # create a visitor and hand it to the write-behind queue, which stores it in batches
+        with span('visitor_write', metric='PostgreSQL Database Write Time'):
             visitor = Visitor.create_(country, browser, operating_system)
-            Visitor.save_(visitor)
-
-            db_write_end = default_timer()
-
-            if telemetry_client:
-                telemetry_client.track_metric(
-                    'PostgreSQL Database Write Time', int(db_write_start - db_write_end))
-                telemetry_client.flush()
+            visitor_queue.submit(visitor)
 
     except Exception:
-        # capture exception's when they occur and send telemetry to application insights
-        if telemetry_client:
-            telemetry_client.track_exception()
-            telemetry_client.flush()
-
-    # retrieve stored list of articles and randomize their order
-    # store the database fetch time
-    db_fetch_start = default_timer()
+        # capture exception's when they occur, the telemetry pipeline sends them to application insights
+        telemetry.track_exception()
 
-    documents = AzureDocument.get_grouped_documents()
+    # retrieve stored list of articles, served from the document catalog cache
+    with span('catalog', metric='PostgreSQL Database Read Time'):
+        catalog = document_catalog.snapshot()
 
-    db_fetch_end = default_timer()
+    with span('render', metric='Render Time'):
+        # splice the user into the cached page fragments, the cards are shuffled by the renderer
+        if index_page.enabled:
+            return index_page.render(catalog, user)
 
-    shuffle(documents)
+        # render the basic web page template with the articles in random order
+        documents = list(catalog.documents)
+        shuffle(documents)
+        return render_template("index.html", documents=documents, user=user)
 
-    # capture request end time
-    end = default_timer()
 
-    # log metrics and flush application insights
-    if telemetry_client:
-        telemetry_client.track_metric(
-            'Request Response Time', int(end - start))
-        telemetry_client.track_metric(
-            'PostgreSQL Database Read Time', int(db_fetch_start - db_fetch_end))
-        telemetry_client.flush()
+@app.route("/api/documents", methods=['GET'])
+@cache_policy(REVALIDATE)
+def documents():
+    """
+        Serves a page of the document catalog as JSON, tagged with the page's version as a strong ETag.
+        Query arguments: category, q (words every title must contain), after (the pk the page starts after)
+        and limit. The response links the next page, see search.py.
+        A request whose If-None-Match holds the page's current version is answered with 304 Not Modified
+        without serializing the documents, and with the default memory search backend without touching
+        the database while the catalog is cached.
+    """
+    category = request.args.get('category', '')
+    search = request.args.get('q', '')
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', 0, type=int)
+    if after < 0 or limit < 0:
+        abort(400)
+
+    page = document_search.query(category, search, after, limit)
+    if request.if_none_match.contains(page.version):
+        resp = Response(status=304)
+        resp.set_etag(page.version)
+        return resp
 
+    next_url = None
+    if page.next_after is not None:
+        next_url = url_for('documents', **dict(request.args.items(), after=page.next_after))
 
-    # render the basic web page template
-    return render_template("index.html", documents=documents, user=user)
+    resp = jsonify(documents=[document._asdict() for document in page.documents], next=next_url)
+    resp.set_etag(page.version)
+    return resp
 
 
 @app.route("/login")
@@ -190,9 +232,9 @@ def login():
     auth_state = str(uuid.uuid4())
     session['state'] = auth_state
     authorization_url = config.TEMPLATE_AUTHZ_URL.format(
-        config.TENANT,
-        config.CLIENT_ID,
-        config.REDIRECT_URI,
+        app.config['TENANT'],
+        app.config['CLIENT_ID'],
+        app.config['REDIRECT_URI'],
         auth_state,
         config.RESOURCE)
     resp = Response(status=307)
@@ -206,6 +248,7 @@ def token():
         This endpoint receives the authentication code and state from 
         the OAuth initialization step, this code is then used to acquire
         the user's access token that has access to graph information.
+        The tokens are kept in the server-side token cache, the session holds the user's key.
     """
     code = request.args['code']
     state = request.args['state']
@@ -213,36 +256,27 @@ def token():
     if session.get('state') and session.get('state') != state:
         raise ValueError("State does not match")
 
-    auth_context = adal.AuthenticationContext(config.AUTHORITY_URL)
+    # adal is only needed when signing in, it is imported on the first sign in instead of at startup
+    import adal
+
     try:
-        token_response = auth_context.acquire_token_with_authorization_code(
-            code,
-            config.REDIRECT_URI,
-            config.RESOURCE,
-            config.CLIENT_ID,
-            config.CLIENT_SECRET
-        )
-        session['access_token'] = token_response['accessToken']
+        token = authenticator.sign_in(code)
+        session_store.rotate(session)
+        session['token_user'] = token.user
+        session['access_token'] = token.access_token
+        session['token_expires_at'] = token.expires_at
     except adal.adal_error.AdalError:
-        session.pop('access_token')
+        session.pop('access_token', None)
         session.clear()
-        return redirect(config.BASE_URI)
+        return redirect(app.config['BASE_URI'])
 
-    return redirect(config.BASE_URI)
+    return redirect(app.config['BASE_URI'])
 
 @app.route("/logout")
 def logout():
     """
-        Logs out the user by clearing the current session
+        Logs out the user by clearing the current session and forgetting their tokens
     """
+    authenticator.sign_out(session.get('token_user'))
     session.clear()
     return render_template("intermediate.html")
-
-
-@app.route("/hello", methods=['GET'])
-def hello():
-    """
-        Returns hello world.
-        Endpoint used by the HTTP probes in the application gateway for service health monitoring
-    """
-    return "Hello World Security App"
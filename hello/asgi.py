@@ -0,0 +1,283 @@
+"""
+    Async (ASGI) entry point for the sample application.
+    The index page and the health probes are served by async handlers: the Microsoft Graph profile
+    fetch, the visitor write and the document read run concurrently, on httpx, asyncpg and, when the
+    cached catalog has expired, the catalog's own load in a thread.
+    Every other route (login, token, logout) is served by the Flask application through
+    WSGIMiddleware, so sessions, templates and configuration are shared with the WSGI deployment.
+    Run it with: gunicorn -w 4 -k uvicorn.workers.UvicornWorker hello.asgi:application
+"""
+
+import asyncio
+import contextlib
+from random import shuffle
+from typing import Optional
+
+import asyncpg
+import httpx
+from flask import make_response, render_template
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
+
+from hello.app import User, app as flask_app, describe_visitor
+from hello.auth import TokenEntry, authenticator
+from hello.catalog import document_catalog
+from hello.database import database_dsn
+from hello.dimensions import visitor_dimensions
+from hello.graph import graph_client, token_key
+from hello.health import health
+from hello.instrumentation import span
+from hello.insights import telemetry
+from hello.rendering import index_page
+from hello.sessions import PostgresSessionBackend, session_key, session_store
+
+
+class AsyncGraphClient:
+    """
+        Fetches Microsoft Graph profiles with httpx, sharing the profile cache of the WSGI graph client.
+        Concurrent fetches for the same token await a single request.
+    """
+
+    def __init__(self, graph) -> None:
+        self.graph = graph
+        self.client = None
+        self._in_flight = {}
+
+    async def open(self) -> None:
+        """
+            Creates the pooled HTTP client.
+        """
+        self.client = httpx.AsyncClient(
+            timeout=self.graph.timeout,
+            limits=httpx.Limits(max_keepalive_connections=self.graph.pool_size))
+
+    async def close(self) -> None:
+        """
+            Closes the pooled HTTP client.
+        """
+        await self.client.aclose()
+
+    async def get_profile(self, access_token: str, token_expires_at: float = None) -> dict:
+        """
+            Returns the profile of the user the access token belongs to.
+        """
+        profile = self.graph.cached_profile(access_token)
+        if profile is not None:
+            return profile
+
+        key = token_key(access_token)
+        fetch = self._in_flight.get(key)
+        if fetch is None:
+            fetch = self._in_flight[key] = asyncio.ensure_future(self._fetch(access_token, token_expires_at))
+            fetch.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # shielded so that a cancelled request does not cancel the fetch other requests wait for
+        return await asyncio.shield(fetch)
+
+    async def _fetch(self, access_token: str, token_expires_at: float) -> dict:
+        response = await self.client.get(self.graph.endpoint, headers=self.graph.request_headers(access_token))
+        profile = response.json()
+
+        # error responses are returned as they always were but never cached
+        if response.is_success:
+            self.graph.remember_profile(access_token, profile, token_expires_at)
+        return profile
+
+
+class AsyncDatabase:
+    """
+        asyncpg connection pool sized like the SQLAlchemy pool of a WSGI worker.
+        asyncpg prepares and caches the statements on each connection.
+    """
+
+    def __init__(self) -> None:
+        self.pool = None
+        self._catalog_load = None
+
+    async def open(self) -> None:
+        """
+            Creates the connection pool.
+        """
+        engine_options = flask_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.pool = await asyncpg.create_pool(
+            database_dsn(flask_app.config['SQLALCHEMY_DATABASE_URI']),
+            min_size=1,
+            max_size=engine_options.get('pool_size', 5) + engine_options.get('max_overflow', 2),
+            max_inactive_connection_lifetime=engine_options.get('pool_recycle', 1800))
+
+    async def close(self) -> None:
+        """
+            Closes the connection pool.
+        """
+        await self.pool.close()
+
+    async def insert_visitor(self, country: str, browser: str, operating_system: str) -> None:
+        """
+            Saves a new visitor with the insert_visitor_ids stored function.
+            The dimension ids come from the worker's cache, values it has not seen are looked up once.
+        """
+        names = (country, browser, operating_system)
+        try:
+            ids = visitor_dimensions.cached_ids(names)
+            if ids is None:
+                # the statement adds the missing values and commits before their ids are cached
+                ids = tuple(await self.pool.fetchrow(
+                    "SELECT visitor_dimension_id('visitor_country', $1), visitor_dimension_id('visitor_browser', $2), "
+                    "visitor_dimension_id('visitor_operating_system', $3)", *names))
+                visitor_dimensions.remember_ids(names, ids)
+            await self.pool.execute("SELECT insert_visitor_ids($1, $2, $3)", *ids)
+        except Exception:
+            # capture exception's when they occur, the telemetry pipeline sends them to application insights
+            telemetry.track_exception()
+
+    async def session(self, key: str, serializer) -> dict:
+        """
+            Returns the data of an unexpired server-side session, empty when there is none.
+        """
+        data = await self.pool.fetchval(
+            "SELECT data FROM http_session WHERE key = $1 AND expires_at > NOW()", key)
+        return serializer.loads(data) if data else {}
+
+    async def catalog(self):
+        """
+            Returns the cached document catalog, reloading it when it has expired.
+            Concurrent requests await a single reload, run by the catalog in a thread like in the WSGI
+            workers: it reads from the primary after a write, and an invalidation arriving during the
+            load waits for it and drops its result.
+        """
+        snapshot = document_catalog.cached_snapshot()
+        if snapshot is not None:
+            return snapshot
+
+        load = self._catalog_load
+        if load is None:
+            load = self._catalog_load = asyncio.ensure_future(run_in_threadpool(document_catalog.snapshot))
+            load.add_done_callback(lambda _: setattr(self, '_catalog_load', None))
+
+        # shielded so that a cancelled request does not cancel the load other requests wait for
+        return await asyncio.shield(load)
+
+
+graph = AsyncGraphClient(graph_client)
+database = AsyncDatabase()
+
+
+async def read_session(request) -> dict:
+    """
+        Returns the Flask session of a request, empty when it is missing, invalid or expired.
+        Server-side sessions are read from the memory backend or with asyncpg from http_session,
+        signed cookie sessions are decoded from the cookie.
+    """
+    cookie = request.cookies.get(flask_app.session_cookie_name)
+    if not cookie:
+        return {}
+
+    backend = session_store.backend
+    if isinstance(backend, PostgresSessionBackend):
+        return await database.session(session_key(cookie), backend.serializer)
+    if backend is not None:
+        return backend.load(session_key(cookie)) or {}
+
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+def session_token(session: dict) -> Optional[TokenEntry]:
+    """
+        Returns the tokens of the user signed in to a session, refreshed when they expired, see hello.auth.
+        Blocking, the token cache may read its store or call the authority.
+    """
+    with flask_app.app_context():
+        return authenticator.session_token(session)
+
+
+def render_index(request, catalog, user) -> Response:
+    """
+        Renders the index page with the Flask application's renderer and after request handlers.
+    """
+    headers = {'Accept-Encoding': request.headers.get('accept-encoding', '')}
+    with flask_app.test_request_context('/', headers=headers):
+        if index_page.enabled:
+            flask_response = index_page.render(catalog, user)
+        else:
+            documents = list(catalog.documents)
+            shuffle(documents)
+            flask_response = make_response(render_template("index.html", documents=documents, user=user))
+        flask_response = flask_app.process_response(flask_response)
+
+    response = Response(flask_response.get_data(), status_code=flask_response.status_code)
+    response.raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in flask_response.headers.items()]
+    return response
+
+
+async def index(request) -> Response:
+    """
+        The index route of the application, see hello.app.index.
+        The Graph profile, the visitor write and the catalog read are awaited together.
+    """
+    token = await run_in_threadpool(session_token, await read_session(request))
+    if token is None:
+        return Response(status_code=307, headers={'location': f"{flask_app.config['BASE_URI']}/login"})
+
+    # time the request, the phases run concurrently so only the whole request is a span
+    with span('asgi.index', metric='Request Response Time'):
+        country, browser, operating_system = describe_visitor(
+            request.client.host, request.headers.get('user-agent', ''))
+
+        user_json, _, catalog = await asyncio.gather(
+            graph.get_profile(token.access_token, token.expires_at),
+            database.insert_visitor(country, browser, operating_system),
+            database.catalog())
+
+        with span('render', metric='Render Time'):
+            return render_index(request, catalog, User(**user_json))
+
+
+async def hello(request) -> Response:
+    """
+        Returns hello world.
+        Endpoint used by the HTTP probes in the application gateway for service health monitoring
+    """
+    return PlainTextResponse("Hello World Security App")
+
+
+async def ready(request) -> Response:
+    """
+        Reports the cached results of the readiness checks, see hello.health.
+    """
+    health.monitor.ensure_running()
+    is_ready, summary = health.monitor.report()
+    return JSONResponse(summary, status_code=200 if is_ready else 503, headers={'Cache-Control': 'no-store'})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    """
+        Opens the connection pools when a worker starts and closes them when it stops.
+    """
+    await asyncio.gather(database.open(), graph.open())
+    try:
+        yield
+    finally:
+        await asyncio.gather(database.close(), graph.close())
+        telemetry.flush()
+
+
+# The ASGI application, routes that are not async are served by the Flask application
+application = Starlette(
+    routes=[
+        Route('/', index, methods=['GET']),
+        Route('/hello', hello, methods=['GET']),
+        Route(flask_app.config.get('HEALTH_READINESS_PATH', '/ready'), ready, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
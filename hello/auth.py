@@ -0,0 +1,328 @@
+"""
+    Azure AD sign in and the signed in users' access tokens.
+    Every sign in of a worker goes through one shared adal AuthenticationContext, so the authority's
+    instance discovery runs once per worker instead of once per login.
+    The tokens a sign in returns, including the refresh token, are kept server-side in a token cache
+    keyed by the user's object id. The session only holds the user's key and the current access token.
+    A worker keeps the tokens of its recent users in memory and writes them to the session backend,
+    which SESSION_BACKEND=postgres shares between workers.
+    A background thread refreshes the tokens expiring within AUTH_REFRESH_MARGIN_SECONDS, so users are
+    not sent through the sign in redirects again when their access token expires. A request finding
+    its token expired refreshes it itself. Concurrent refreshes of one user's token share a single
+    call to the authority.
+"""
+
+import contextlib
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from secrets import token_urlsafe
+from typing import List, NamedTuple, Optional
+
+from hello.concurrency import SingleFlight
+from hello.sessions import session_key, session_store
+
+logger = logging.getLogger(__name__)
+
+# Seconds before its expiry a token no longer counts as valid, allows for clock skew with Graph
+EXPIRY_LEEWAY_SECONDS = 30
+
+
+class TokenEntry(NamedTuple):
+    """
+        The tokens of a signed in user, expires_at is the access token's expiry as a unix timestamp.
+    """
+    user: str
+    access_token: str
+    refresh_token: Optional[str]
+    expires_at: float
+
+    @classmethod
+    def from_response(cls, response: dict, user: str = None, refresh_token: str = None):
+        """
+            Creates an entry from an adal token response, keeping the given refresh token when none is returned.
+            Without a user, the user is the object id of the response's id token, or a random key without one.
+        """
+        return cls(
+            user or response.get('oid') or response.get('userId') or token_urlsafe(16),
+            response['accessToken'],
+            response.get('refreshToken') or refresh_token,
+            time.time() + response['expiresIn'])
+
+    @property
+    def expired(self) -> bool:
+        """
+            Whether the access token has expired or is about to.
+        """
+        return self.expires_at - EXPIRY_LEEWAY_SECONDS <= time.time()
+
+
+class TokenCache:
+    """
+        Keeps the tokens of up to max_size users in memory, least recently used first out,
+        and writes them through to store, a session backend, for lifetime_seconds.
+        Users missing from memory are looked up in the store. Must be used inside an application
+        context when store is a PostgresSessionBackend.
+    """
+
+    def __init__(self, store=None, max_size: int = 1024, lifetime_seconds: float = 86400) -> None:
+        self.store = store
+        self.max_size = max_size
+        self.lifetime = datetime.timedelta(seconds=lifetime_seconds)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(user: str) -> str:
+        """
+            Returns the key a user's tokens are stored under, in a namespace no session cookie reaches.
+        """
+        return session_key(user, namespace='aad-token')
+
+    def get(self, user: str, reload: bool = False) -> Optional[TokenEntry]:
+        """
+            Returns the tokens of a user, None when the user has none.
+            reload reads them from the store even when they are in memory, e.g. before refreshing them.
+        """
+        with self._lock:
+            entry = self._entries.get(user)
+            if entry is not None:
+                self._entries.move_to_end(user)
+                if not reload or self.store is None:
+                    return entry
+
+        data = self.store.load(self.key(user)) if self.store is not None else None
+        if data is None:
+            return None
+        entry = TokenEntry(**data)
+        self._remember(entry)
+        return entry
+
+    def put(self, entry: TokenEntry) -> None:
+        """
+            Stores the tokens of a user.
+        """
+        self._remember(entry)
+        if self.store is not None:
+            expires_at = datetime.datetime.now(datetime.timezone.utc) + self.lifetime
+            self.store.save(self.key(entry.user), entry._asdict(), expires_at)
+
+    def remove(self, user: str) -> None:
+        """
+            Forgets the tokens of a user.
+        """
+        with self._lock:
+            self._entries.pop(user, None)
+        if self.store is not None:
+            self.store.delete(self.key(user))
+
+    def expiring(self, before: float) -> List[TokenEntry]:
+        """
+            Returns the tokens in memory whose access token expires before the given unix timestamp.
+        """
+        with self._lock:
+            return [entry for entry in self._entries.values() if entry.expires_at < before and entry.refresh_token]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, entry: TokenEntry) -> None:
+        with self._lock:
+            self._entries[entry.user] = entry
+            self._entries.move_to_end(entry.user)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class Authenticator:
+    """
+        Signs users in with the authorization code flow and keeps their access tokens fresh.
+        context_factory returns the authentication context, an adal AuthenticationContext for the
+        configured authority by default, tests pass a fake authority.
+    """
+
+    def __init__(self, context_factory=None, cache: TokenCache = None, refresh_margin_seconds: float = 300,
+                 refresh_interval_seconds: float = 60) -> None:
+        self.context_factory = context_factory
+        self.cache = cache if cache is not None else TokenCache()
+        self.refresh_margin = refresh_margin_seconds
+        self.refresh_interval = refresh_interval_seconds
+        self.config = {}
+        self._flask_app = None
+        self._context = None
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+        self._thread = None
+        self._counters = {'sign_ins': 0, 'refreshes': 0, 'refresh_failures': 0}
+
+    def init_app(self, flask_app) -> None:
+        """
+            Reads AUTH_REFRESH_MARGIN_SECONDS, AUTH_REFRESH_INTERVAL_SECONDS and AUTH_TOKEN_CACHE_SIZE
+            from the Flask configuration. Must follow the session store's init_app, whose backend keeps the tokens.
+            The authority and client settings are read on the first sign in, they are Key Vault secrets.
+        """
+        self.refresh_margin = flask_app.config.get('AUTH_REFRESH_MARGIN_SECONDS', 300)
+        self.refresh_interval = flask_app.config.get('AUTH_REFRESH_INTERVAL_SECONDS', 60)
+        self.cache = TokenCache(
+            session_store.backend,
+            flask_app.config.get('AUTH_TOKEN_CACHE_SIZE', 1024),
+            flask_app.config.get('SESSION_LIFETIME_SECONDS', 86400))
+        self.config = flask_app.config
+        self._flask_app = flask_app
+        flask_app.extensions['auth'] = self
+
+    def context(self):
+        """
+            Returns the shared authentication context, creating it on first use.
+        """
+        if self._context is None:
+            with self._lock:
+                if self._context is None:
+                    self._context = self.context_factory() if self.context_factory else self._adal_context()
+        return self._context
+
+    def sign_in(self, code: str) -> TokenEntry:
+        """
+            Redeems an authorization code and caches the user's tokens.
+        """
+        response = self.context().acquire_token_with_authorization_code(
+            code, self.config['REDIRECT_URI'], self.config['RESOURCE'],
+            self.config['CLIENT_ID'], self.config['CLIENT_SECRET'])
+        entry = TokenEntry.from_response(response)
+        self.cache.put(entry)
+        self._count('sign_ins')
+        self.ensure_running()
+        return entry
+
+    def sign_out(self, user: str) -> None:
+        """
+            Forgets a user's tokens.
+        """
+        if user:
+            self.cache.remove(user)
+
+    def token(self, user: str) -> Optional[TokenEntry]:
+        """
+            Returns a user's unexpired tokens, refreshing them when they expired.
+            None when the user never signed in or the refresh token was rejected.
+        """
+        entry = self.cache.get(user) if user else None
+        if entry is None or not entry.expired:
+            return entry
+        return self.refresh(user)
+
+    def session_token(self, session) -> Optional[TokenEntry]:
+        """
+            Returns the tokens of the user signed in to a session and keeps the session's access token current.
+            Without cached tokens, as in sessions created before the token cache or with cookie sessions on
+            a worker the user did not sign in on, the session's access token is used until it expires.
+        """
+        user = session.get('token_user')
+        entry = self.token(user) if user else None
+        if entry is None:
+            entry = TokenEntry(user, session.get('access_token'), None, session.get('token_expires_at') or 0)
+            return entry if entry.access_token and not entry.expired else None
+
+        if entry.access_token != session.get('access_token'):
+            session['access_token'] = entry.access_token
+            session['token_expires_at'] = entry.expires_at
+        return entry
+
+    def refresh(self, user: str) -> Optional[TokenEntry]:
+        """
+            Redeems a user's refresh token for new tokens, concurrent calls for one user share a single request.
+        """
+        return self._single_flight.do(user, lambda: self._refresh(user))
+
+    def refresh_expiring(self) -> int:
+        """
+            Refreshes the tokens expiring within the refresh margin and returns how many were refreshed.
+        """
+        refreshed = 0
+        for entry in self.cache.expiring(time.time() + self.refresh_margin):
+            try:
+                refreshed += self.refresh(entry.user) is not None
+            except Exception:
+                logger.exception("Refreshing the tokens of a signed in user failed")
+        return refreshed
+
+    def stats(self) -> dict:
+        """
+            Returns the sign in and refresh counters and the number of users with cached tokens.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        return dict(stats, users=len(self.cache))
+
+    def ensure_running(self) -> None:
+        """
+            Starts the background refresh, once per process.
+        """
+        if self._thread is not None or not self.refresh_interval:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_forever, name='token-refresh', daemon=True)
+                self._thread.start()
+
+    def reset_after_fork(self) -> None:
+        """
+            Drops the parent's refresh thread and in flight refreshes, the child starts its own on its first sign in.
+        """
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+        self._thread = None
+
+    def _count(self, counter: str) -> None:
+        # request threads and the refresh thread update the counters
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _adal_context(self):
+        # adal is only needed when signing in, it is imported on the first sign in instead of at startup
+        import adal
+
+        return adal.AuthenticationContext(
+            self.config['AUTHORITY_URL'], timeout=self.config.get('AUTH_TIMEOUT_SECONDS', 10))
+
+    def _refresh(self, user: str) -> Optional[TokenEntry]:
+        entry = self.cache.get(user, reload=True)
+        if entry is None or not entry.refresh_token:
+            return None
+        # another worker may have refreshed the tokens in the shared store since this one read them
+        if entry.expires_at >= time.time() + self.refresh_margin:
+            return entry
+
+        import adal
+
+        try:
+            response = self.context().acquire_token_with_refresh_token(
+                entry.refresh_token, self.config['CLIENT_ID'], self.config['RESOURCE'],
+                self.config['CLIENT_SECRET'])
+        except adal.adal_error.AdalError:
+            # the refresh token was revoked or expired, the user has to sign in again
+            self._count('refresh_failures')
+            self.cache.remove(user)
+            return None
+
+        refreshed = TokenEntry.from_response(response, user, entry.refresh_token)
+        self.cache.put(refreshed)
+        self._count('refreshes')
+        return refreshed
+
+    def _run_forever(self) -> None:
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                with self._flask_app.app_context() if self._flask_app else contextlib.nullcontext():
+                    self.refresh_expiring()
+            except Exception:
+                logger.exception("Token refresh round failed")
+
+
+# The process wide authenticator, bound to the Flask application in register_extensions.
+authenticator = Authenticator()
+os.register_at_fork(after_in_child=authenticator.reset_after_fork)
@@ -0,0 +1,86 @@
+"""
+    HTTP caching policies.
+    Every response gets the Cache-Control header of its route's policy, set on the view with cache_policy:
+        NO_STORE    personalized pages, redirects and the sign in flow, the default of routes without a policy
+        REVALIDATE  shared responses revalidated with their ETag on every use, e.g. /api/documents
+        IMMUTABLE   fingerprinted static files, cached for a year
+    Templates link static files with static_url, which adds a fingerprint of the file's content to
+    the url, so a changed file is fetched from a new url and the old one can be cached forever.
+    Static files requested without their current fingerprint are revalidated instead.
+"""
+
+import hashlib
+import os
+from functools import lru_cache
+
+from flask import current_app, request, url_for
+
+NO_STORE = 'no-store'
+REVALIDATE = 'public, no-cache'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def cache_policy(policy: str):
+    """
+        Decorates a view with the Cache-Control header value of its responses.
+        Applied below the route decorator, a header set by the view itself is kept.
+    """
+    def decorator(view):
+        view.cache_policy = policy
+        return view
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def fingerprint(path: str) -> str:
+    """
+        Returns a short digest of a file's content, empty when the file does not exist.
+        Deployed files do not change while a worker runs, so each is hashed once.
+    """
+    try:
+        with open(path, 'rb') as static_file:
+            return hashlib.sha256(static_file.read()).hexdigest()[:12]
+    except OSError:
+        return ''
+
+
+def static_url(filename: str) -> str:
+    """
+        Returns the url of a static file with its content fingerprint, for use in templates.
+    """
+    version = fingerprint(os.path.join(current_app.static_folder, filename))
+    return url_for('static', filename=filename, v=version) if version else url_for('static', filename=filename)
+
+
+class CachePolicies:
+    """
+        Sets the Cache-Control header of every response from its route's policy.
+    """
+
+    def __init__(self, default_policy: str = NO_STORE) -> None:
+        self.default_policy = default_policy
+
+    def init_app(self, flask_app) -> None:
+        """
+            Registers the response hook and the static_url template function.
+        """
+        flask_app.after_request(self.apply)
+        flask_app.jinja_env.globals['static_url'] = static_url
+        flask_app.extensions['cache_policies'] = self
+
+    def apply(self, response):
+        """
+            Sets the Cache-Control header of a response.
+        """
+        if request.endpoint == 'static':
+            path = os.path.join(current_app.static_folder, request.view_args.get('filename', ''))
+            version = request.args.get('v')
+            response.headers['Cache-Control'] = IMMUTABLE if version and version == fingerprint(path) else REVALIDATE
+        elif 'Cache-Control' not in response.headers:
+            view = current_app.view_functions.get(request.endpoint)
+            response.headers['Cache-Control'] = getattr(view, 'cache_policy', self.default_policy)
+        return response
+
+
+# The process wide cache policies, bound to the Flask application in register_extensions.
+cache_policies = CachePolicies()
@@ -0,0 +1,269 @@
+"""
+    In-process cache of the Azure document catalog.
+    The catalog is loaded once per worker into immutable DocumentRecord tuples and
+    served from memory until CATALOG_TTL_SECONDS pass or it is invalidated.
+    Every load is tagged with a version derived from the documents' content, which
+    changes whenever a document is written and is the same in every worker.
+    AzureDocument.save_ and seed_db invalidate the catalog, and when CATALOG_NOTIFY_CHANNEL
+    is set the other workers are told to drop their copy through PostgreSQL LISTEN/NOTIFY.
+"""
+
+import hashlib
+import logging
+import os
+import select
+import threading
+import time
+from timeit import default_timer
+from typing import NamedTuple, Tuple
+
+import psycopg2
+
+from hello.database import database_dsn, replica_router
+
+logger = logging.getLogger(__name__)
+
+# Css class names for the document categories, used when rendering the document cards
+CATEGORY_CLASSES = {
+    "Azure Technical Overviews": "is-info",
+    "Azure Whitepapers": "is-dark",
+    "Azure Best Practices": "is-warning"
+}
+
+DEFAULT_CATEGORY_CLASS = "is-light"
+
+
+class DocumentRecord(NamedTuple):
+    """
+        A read only copy of an azure_document row.
+    """
+    pk: int
+    title: str
+    url: str
+    category: str
+
+    @property
+    def category_class(self) -> str:
+        """
+            Gets a css class name based on the document category.
+        """
+        return CATEGORY_CLASSES.get(self.category, DEFAULT_CATEGORY_CLASS)
+
+
+def catalog_version(documents: Tuple[DocumentRecord, ...]) -> str:
+    """
+        Returns a short digest of the documents, identical for identical catalogs.
+    """
+    digest = hashlib.sha1()
+    for document in documents:
+        digest.update(repr(tuple(document)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class CatalogSnapshot(NamedTuple):
+    """
+        The documents loaded by one catalog refresh and their content version.
+    """
+    documents: Tuple[DocumentRecord, ...]
+    version: str
+
+
+class DocumentCatalog:
+    """
+        Caches the document catalog for ttl_seconds.
+        loader is called without arguments and returns (pk, title, url, category) rows,
+        when used through init_app it is AzureDocument.load_rows inside an application context.
+    """
+
+    def __init__(self, loader=None, ttl_seconds: float = 300, notify_channel: str = '') -> None:
+        self.loader = loader
+        self.ttl = ttl_seconds
+        self.notify_channel = notify_channel
+        self._snapshot = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listen_connect = None
+        self._listen_connection = None
+        # the counters are updated under their own lock, a refresh holds _lock while it records its time
+        self._counters_lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'invalidations': 0,
+            'last_refresh_seconds': 0.0,
+            'refresh_seconds_total': 0.0,
+        }
+
+    def init_app(self, flask_app) -> None:
+        """
+            Configures the catalog from the Flask configuration and loads documents
+            with AzureDocument.load_rows inside the application's context.
+        """
+        # imported here to avoid a circular import between the models and the catalog
+        from hello.models import AzureDocument
+
+        self.ttl = flask_app.config.get('CATALOG_TTL_SECONDS', 300)
+        self.notify_channel = flask_app.config.get('CATALOG_NOTIFY_CHANNEL', '')
+
+        def load_rows():
+            with flask_app.app_context():
+                return AzureDocument.load_rows()
+
+        def listen_connect():
+            # a connection of its own rather than one of the pool's, the listener holds it for good
+            return psycopg2.connect(database_dsn(flask_app.config['SQLALCHEMY_DATABASE_URI']))
+
+        self.loader = load_rows
+        self._listen_connect = listen_connect
+        flask_app.extensions['document_catalog'] = self
+
+    def documents(self) -> Tuple[DocumentRecord, ...]:
+        """
+            Returns the cached documents, loading them when the cache is empty or expired.
+        """
+        return self.snapshot().documents
+
+    def snapshot(self) -> CatalogSnapshot:
+        """
+            Returns the cached documents together with their version,
+            loading them when the cache is empty or expired.
+        """
+        snapshot = self.cached_snapshot()
+        if snapshot is not None:
+            return snapshot
+
+        with self._lock:
+            # another thread may have refreshed the catalog while this one waited
+            if self._snapshot is not None and time.monotonic() < self._expires_at:
+                self._count('hits')
+                return self._snapshot
+
+            self._count('misses')
+            return self._refresh()
+
+    def cached_snapshot(self):
+        """
+            Returns the cached snapshot, or None when the cache is empty or expired.
+            Used by callers that must not wait for a load, e.g. the async entry point.
+        """
+        if self.notify_channel and self._listen_connect is not None:
+            self._ensure_listening()
+
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._expires_at:
+            self._count('hits')
+            return snapshot
+        return None
+
+    def store(self, rows, load_seconds: float = 0.0) -> CatalogSnapshot:
+        """
+            Caches (pk, title, url, category) rows loaded by the caller and returns their snapshot.
+        """
+        refresh_start = default_timer()
+        documents = tuple(DocumentRecord(*row) for row in rows)
+        snapshot = CatalogSnapshot(documents, catalog_version(documents))
+        elapsed = load_seconds + default_timer() - refresh_start
+
+        self._snapshot = snapshot
+        self._expires_at = time.monotonic() + self.ttl
+        with self._counters_lock:
+            self._counters['refreshes'] += 1
+            self._counters['last_refresh_seconds'] = elapsed
+            self._counters['refresh_seconds_total'] += elapsed
+        return snapshot
+
+    def invalidate(self) -> None:
+        """
+            Drops the cached documents so the next request reloads them, from the primary while
+            the read replicas may not have replayed the write yet.
+        """
+        replica_router.note_write()
+        with self._lock:
+            self._snapshot = None
+            self._expires_at = 0.0
+            self._count('invalidations')
+
+    def notify(self, cursor) -> None:
+        """
+            Tells every worker listening on the notify channel to invalidate its catalog.
+            The notification is sent when the cursor's transaction commits.
+        """
+        if self.notify_channel:
+            cursor.execute("SELECT pg_notify(%s, '')", [self.notify_channel])
+
+    def stats(self) -> dict:
+        """
+            Returns the hit, miss and refresh time counters of the cache.
+        """
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats['documents'] = len(self._snapshot.documents) if self._snapshot is not None else 0
+        return stats
+
+    def reset_after_fork(self) -> None:
+        """
+            Keeps the documents loaded by the parent process, e.g. gunicorn's preloading master,
+            and lets the child start its own LISTEN connection, closing one inherited from the parent.
+            Only workers listen, a preloading master that serves no requests has none.
+        """
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._listener = None
+        self._close_listen_connection()
+
+    def _count(self, counter: str) -> None:
+        with self._counters_lock:
+            self._counters[counter] += 1
+
+    def _close_listen_connection(self) -> None:
+        connection, self._listen_connection = self._listen_connection, None
+        if connection is not None:
+            connection.close()
+
+    def _refresh(self) -> CatalogSnapshot:
+        load_start = default_timer()
+        rows = self.loader()
+        return self.store(rows, default_timer() - load_start)
+
+    def _ensure_listening(self) -> None:
+        # started lazily so that importing the app does not open connections or spawn threads
+        if self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, name='catalog-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self) -> None:
+        """
+            Invalidates the catalog whenever a notification arrives on the notify channel.
+            Reconnects after connection failures.
+        """
+        while True:
+            try:
+                connection = self._listen_connection = self._listen_connect()
+                connection.autocommit = True
+                connection.cursor().execute(f'LISTEN "{self.notify_channel}"')
+
+                # anything written while this worker was not listening is unknown
+                self.invalidate()
+
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    if connection.notifies:
+                        connection.notifies.clear()
+                        self.invalidate()
+            except Exception:
+                logger.exception("Catalog listener lost its connection, reconnecting")
+                self._close_listen_connection()
+                time.sleep(5)
+
+
+# The process wide document catalog, bound to the Flask application in register_extensions.
+document_catalog = DocumentCatalog()
+os.register_at_fork(after_in_child=document_catalog.reset_after_fork)
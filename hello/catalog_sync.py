@@ -0,0 +1,250 @@
+"""
+    Incremental sync of the document catalog with a CSV file, plain or gzip compressed.
+    The file is streamed through a generator pipeline, one batch of rows in memory at a time:
+
+        read_rows -> validate_rows -> batched -> dedupe_batch -> fetch_stored -> diff_batch -> apply_diff
+
+    Rows are validated and escaped the way seed_db stores them, and deduplicated by url within
+    the batch, the last row of a url winning. The stored documents of the batch's urls are read
+    with a single keyed query and compared by a hash of their content, new documents are inserted,
+    changed ones updated and unchanged ones left alone, each in one statement per batch.
+    The keys of the documents found in the file are kept in a temporary table instead of memory,
+    and the documents missing from the file are deleted at the end unless pruning is turned off.
+    The sync runs in a single transaction and invalidates the document catalog when it commits.
+    Run it with flask sync-catalog.
+"""
+
+import csv
+import hashlib
+import html
+from collections import Counter
+from timeit import default_timer
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+from urllib.parse import urlsplit
+
+from psycopg2.extras import execute_values
+
+from hello.catalog import document_catalog
+from hello.database import transaction
+from hello.seeding import SEED_FILE, batched, open_catalog
+
+# Longest accepted values once escaped, category is stored in a VARCHAR(100) column
+MAX_TITLE_LENGTH = 1000
+MAX_URL_LENGTH = 2048
+MAX_CATEGORY_LENGTH = 100
+
+# Schemes a document url may use
+URL_SCHEMES = ('http', 'https')
+
+# Column names of an optional header row
+HEADER = ('title', 'url', 'category')
+
+# The content hash of a stored document, computed the same way as content_hash
+STORED_HASH = "md5(COALESCE(title, '') || chr(31) || COALESCE(category, ''))"
+
+
+class CatalogRow(NamedTuple):
+    """
+        A valid, escaped document row of a catalog file.
+    """
+    line: int
+    title: str
+    url: str
+    category: str
+    content_hash: str
+
+
+class BatchDiff(NamedTuple):
+    """
+        The changes a batch of rows makes to the stored documents.
+    """
+    inserts: List[CatalogRow]
+    updates: List[Tuple[int, CatalogRow]]
+    unchanged: List[int]
+
+
+def content_hash(title: str, category: str) -> str:
+    """
+        Returns the hash a document's title and category are compared by.
+    """
+    return hashlib.md5(f"{title}\x1f{category}".encode('utf-8'), usedforsecurity=False).hexdigest()
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, List[str]]]:
+    """
+        Streams the (line number, fields) rows of a CSV file, decompressing .gz files on the fly.
+    """
+    with open_catalog(path) as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        for fields in reader:
+            yield reader.line_num, fields
+
+
+def rejection(fields: List[str]) -> str:
+    """
+        Returns why a row of raw fields is invalid, or an empty string when it is valid.
+    """
+    if len(fields) != 3:
+        return 'columns'
+    title, url, category = [field.strip() for field in fields]
+    if not title:
+        return 'title'
+    parts = urlsplit(url)
+    if parts.scheme not in URL_SCHEMES or not parts.netloc or any(char.isspace() for char in url):
+        return 'url'
+    return ''
+
+
+def validate_rows(rows: Iterable[Tuple[int, List[str]]], report: dict) -> Iterator[CatalogRow]:
+    """
+        Escapes and hashes the valid rows, counting the others by reason in report['rejected'].
+        A header row on the first line is skipped.
+    """
+    for line, fields in rows:
+        if line == 1 and tuple(field.strip().lower() for field in fields) == HEADER:
+            continue
+        report['rows'] += 1
+
+        reason = rejection(fields)
+        if not reason:
+            title, url, category = [html.escape(field.strip()) for field in fields]
+            if len(title) > MAX_TITLE_LENGTH:
+                reason = 'title'
+            elif len(url) > MAX_URL_LENGTH:
+                reason = 'url'
+            elif len(category) > MAX_CATEGORY_LENGTH:
+                reason = 'category'
+            else:
+                yield CatalogRow(line, title, url, category, content_hash(title, category))
+                continue
+
+        report['rejected'][reason] += 1
+        if len(report['rejected_lines']) < 10:
+            report['rejected_lines'].append((line, reason))
+
+
+def dedupe_batch(batch: List[CatalogRow], report: dict) -> List[CatalogRow]:
+    """
+        Keeps one row per url, the last one, counting the rows dropped in report['duplicates'].
+        A url repeated in a later batch is matched against the row stored by the earlier one instead.
+    """
+    by_url: Dict[str, CatalogRow] = {}
+    for row in batch:
+        by_url[row.url] = row
+    report['duplicates'] += len(batch) - len(by_url)
+    return list(by_url.values())
+
+
+def fetch_stored(cursor, urls: List[str]) -> Dict[str, Tuple[int, str]]:
+    """
+        Returns the (pk, content hash) of the stored document of each url, the first one of a url stored twice.
+    """
+    cursor.execute(f"""
+        SELECT DISTINCT ON (url) url, pk, {STORED_HASH}
+          FROM azure_document
+         WHERE url = ANY(%s)
+         ORDER BY url, pk
+    """, [urls])
+    return {url: (pk, stored_hash) for url, pk, stored_hash in cursor.fetchall()}
+
+
+def diff_batch(rows: List[CatalogRow], stored: Dict[str, Tuple[int, str]]) -> BatchDiff:
+    """
+        Splits deduplicated rows into documents to insert, to update and the keys of those unchanged.
+    """
+    diff = BatchDiff([], [], [])
+    for row in rows:
+        if row.url not in stored:
+            diff.inserts.append(row)
+            continue
+        pk, stored_hash = stored[row.url]
+        if stored_hash == row.content_hash:
+            diff.unchanged.append(pk)
+        else:
+            diff.updates.append((pk, row))
+    return diff
+
+
+def apply_diff(cursor, diff: BatchDiff) -> List[int]:
+    """
+        Inserts and updates the batch's documents in bulk, returning the keys of every document of the batch.
+    """
+    keys = list(diff.unchanged)
+    if diff.inserts:
+        # a single page, so the returned keys of every row can be fetched afterwards
+        execute_values(
+            cursor, "INSERT INTO azure_document (title, url, category) VALUES %s RETURNING pk",
+            [(row.title, row.url, row.category) for row in diff.inserts], page_size=len(diff.inserts))
+        keys.extend(pk for pk, in cursor.fetchall())
+    if diff.updates:
+        execute_values(cursor, """
+            UPDATE azure_document AS document
+               SET title = changed.title, category = changed.category
+              FROM (VALUES %s) AS changed (pk, title, category)
+             WHERE document.pk = changed.pk
+        """, [(pk, row.title, row.category) for pk, row in diff.updates], page_size=len(diff.updates))
+        keys.extend(pk for pk, _ in diff.updates)
+    return keys
+
+
+def sync_documents(cursor, rows: Iterable[Tuple[int, List[str]]], batch_size: int = 5000,
+                   prune: bool = True, progress=None) -> dict:
+    """
+        Syncs azure_document with the raw rows on the cursor's connection without committing.
+        progress is called after every batch with the report so far and the elapsed seconds.
+        Returns a report of the rows read, rejected and duplicated and the documents inserted,
+        updated, unchanged and deleted, with the elapsed seconds.
+    """
+    report = {'rows': 0, 'rejected': Counter(), 'rejected_lines': [], 'duplicates': 0,
+              'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'seconds': 0.0}
+
+    # keep concurrent writers from inserting a url this sync is about to insert
+    cursor.execute("LOCK TABLE azure_document IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute("CREATE TEMPORARY TABLE catalog_sync_seen (pk INTEGER PRIMARY KEY) ON COMMIT DROP")
+
+    sync_start = default_timer()
+    for batch in batched(validate_rows(rows, report), batch_size):
+        batch = dedupe_batch(batch, report)
+        diff = diff_batch(batch, fetch_stored(cursor, [row.url for row in batch]))
+        keys = apply_diff(cursor, diff)
+        execute_values(cursor, "INSERT INTO catalog_sync_seen (pk) VALUES %s ON CONFLICT DO NOTHING",
+                       [(pk,) for pk in keys], page_size=len(keys))
+
+        report['inserted'] += len(diff.inserts)
+        report['updated'] += len(diff.updates)
+        report['unchanged'] += len(diff.unchanged)
+        if progress:
+            progress(report, default_timer() - sync_start)
+
+    # a file without a single valid row is more likely broken than an empty catalog
+    if prune and report['inserted'] + report['updated'] + report['unchanged']:
+        cursor.execute("""
+            DELETE FROM azure_document AS document
+             WHERE NOT EXISTS (SELECT 1 FROM catalog_sync_seen AS seen WHERE seen.pk = document.pk)
+        """)
+        report['deleted'] = cursor.rowcount
+
+    report['seconds'] = default_timer() - sync_start
+    return report
+
+
+def print_progress(report: dict, seconds: float) -> None:
+    """
+        Prints the number of rows read and the read rate.
+    """
+    rate = report['rows'] / seconds if seconds else 0
+    print(f"Read {report['rows']:,} rows ({rate:,.0f} rows/sec)")
+
+
+def sync_catalog(path: str = SEED_FILE, batch_size: int = 5000, prune: bool = True,
+                 progress=print_progress) -> dict:
+    """
+        Syncs the document catalog with a CSV file in one transaction and invalidates the document catalog.
+        Must be called inside an application context.
+    """
+    with transaction() as cursor:
+        report = sync_documents(cursor, read_rows(path), batch_size, prune, progress)
+        document_catalog.notify(cursor)
+
+    document_catalog.invalidate()
+    return report
@@ -0,0 +1,108 @@
+"""
+    Flask command line commands for operating the sample application.
+    Registered on the application in app.py, run them with flask <command> --help for their options.
+"""
+
+import time
+
+import click
+from flask import current_app
+
+from hello.catalog_sync import sync_catalog
+from hello.partitions import RETENTION_ACTIONS, maintain_partitions
+from hello.rollups import reset_rollups, run_rollup
+from hello.seeding import SEED_FILE, bulk_seed
+from hello.sessions import session_store
+
+
+def register_commands(flask_app) -> None:
+    """
+        Adds the application's commands to the flask command line.
+    """
+
+    @flask_app.cli.command('seed')
+    @click.option('--path', default=SEED_FILE, show_default=True, help='CSV file of title,url,category rows.')
+    @click.option('--batch-size', default=10000, show_default=True, help='Rows sent per COPY batch.')
+    @click.option('--upsert', is_flag=True, help='Update documents whose url is already stored.')
+    def seed(path, batch_size, upsert):
+        """
+            Bulk loads a document catalog CSV file in a single transaction.
+        """
+        counts = bulk_seed(path, batch_size, upsert)
+        click.echo(f"Read {counts['rows']:,} rows, inserted {counts['inserted']:,}, updated {counts['updated']:,}, "
+                   f"skipped {counts['malformed']:,} malformed rows")
+
+    @flask_app.cli.command('sync-catalog')
+    @click.option('--path', default=SEED_FILE, show_default=True,
+                  help='CSV file of title,url,category rows, gzip compressed when it ends in .gz.')
+    @click.option('--batch-size', default=5000, show_default=True, help='Rows diffed and applied per batch.')
+    @click.option('--prune/--no-prune', default=True, show_default=True,
+                  help='Delete the documents whose url is not in the file.')
+    def sync_catalog_command(path, batch_size, prune):
+        """
+            Inserts, updates and deletes documents so the catalog matches a CSV file, in a single transaction.
+        """
+        report = sync_catalog(path, batch_size, prune)
+        rate = report['rows'] / report['seconds'] if report['seconds'] else 0
+        click.echo(f"Read {report['rows']:,} rows in {report['seconds']:.2f}s ({rate:,.0f} rows/sec)")
+        click.echo(f"Inserted {report['inserted']:,}, updated {report['updated']:,}, "
+                   f"unchanged {report['unchanged']:,}, deleted {report['deleted']:,}, "
+                   f"duplicate urls {report['duplicates']:,}")
+        rejected = sum(report['rejected'].values())
+        if rejected:
+            reasons = ', '.join(f"{reason} {count:,}" for reason, count in sorted(report['rejected'].items()))
+            lines = ', '.join(f"{line} ({reason})" for line, reason in report['rejected_lines'])
+            click.echo(f"Rejected {rejected:,} invalid rows: {reasons}. First lines: {lines}")
+
+    @flask_app.cli.command('rollup')
+    @click.option('--backfill', is_flag=True, help='Rebuild the rollups from the first visitor.')
+    @click.option('--interval', default=0, show_default=True,
+                  help='Seconds between runs, 0 runs the aggregator once.')
+    @click.option('--batch-size', default=None, type=int, help='Visitor keys rolled up per transaction.')
+    def rollup(backfill, interval, batch_size):
+        """
+            Adds the visitors recorded since the last run to the hourly and daily visitor rollups.
+        """
+        batch_size = batch_size or current_app.config.get('ROLLUP_BATCH_SIZE', 50000)
+        settle_seconds = current_app.config.get('ROLLUP_SETTLE_SECONDS', 300)
+        if backfill:
+            reset_rollups()
+
+        while True:
+            result = run_rollup(batch_size, settle_seconds)
+            click.echo(f"Rolled up visitors {result['from_pk']:,} to {result['to_pk']:,} "
+                       f"in {result['ranges']} ranges ({result['seconds']:.2f}s)")
+            if not interval:
+                return
+            time.sleep(interval)
+
+    @flask_app.cli.command('partitions')
+    @click.option('--months-ahead', default=None, type=int, help='Monthly partitions created past the current month.')
+    @click.option('--retention-months', default=None, type=int,
+                  help='Months of visits kept in visitor, 0 keeps every month.')
+    @click.option('--action', default=None, type=click.Choice(RETENTION_ACTIONS),
+                  help='Archive or drop the partitions older than the retention period.')
+    def partitions(months_ahead, retention_months, action):
+        """
+            Creates the upcoming monthly visitor partitions and applies the retention policy.
+        """
+        config = current_app.config
+        result = maintain_partitions(
+            config.get('VISITOR_PARTITION_MONTHS_AHEAD', 3) if months_ahead is None else months_ahead,
+            config.get('VISITOR_RETENTION_MONTHS', 0) if retention_months is None else retention_months,
+            action or config.get('VISITOR_RETENTION_ACTION', 'archive'))
+        click.echo(f"Created partitions: {', '.join(result['created']) or 'none'}")
+        click.echo(f"Expired partitions: {', '.join(result['expired']) or 'none'}")
+
+    @flask_app.cli.command('cleanup-sessions')
+    @click.option('--batch-size', default=None, type=int, help='Expired sessions deleted per transaction.')
+    def cleanup_sessions(batch_size):
+        """
+            Deletes every expired server-side session.
+        """
+        if session_store.backend is None:
+            click.echo("Sessions are stored in signed cookies, there is nothing to clean up")
+            return
+        deleted = session_store.backend.cleanup(
+            batch_size or current_app.config.get('SESSION_CLEANUP_BATCH_SIZE', 1000))
+        click.echo(f"Deleted {deleted:,} expired sessions")
@@ -0,0 +1,56 @@
+"""
+    Concurrency helpers shared by the application's caches.
+"""
+
+import threading
+
+
+class _Call:
+    """
+        A call in progress and, once it finished, its result or error.
+    """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+        Deduplicates concurrent calls for the same key.
+        The first caller runs the function, callers arriving while it runs wait for
+        and share its result, or its exception.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+            Runs func for key unless a call for key is already running, then returns its result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
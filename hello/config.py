@@ -1,46 +1,244 @@
 """
     Configuration module for the application.
     All Flask configuration will be stored here and configured using app.config.from_object
+    Key Vault secrets are LazyValue settings, nothing is fetched until the first one is read, see lazy.py.
 """
 import os
+from functools import lru_cache
 from urllib.parse import urlsplit
 
-from hello.secrets import get_key_vault_secret
+from hello.lazy import LazyValue, resolve
+from hello.secrets import get_key_vault_secret, secret_store
+
+# Key Vault secrets used by the application, resolved concurrently when the first of them is read
+KEY_VAULT_SECRETS = [
+    'PGCONNECTIONSTRING', 'FLASKSECRETKEY', 'TENANT', 'CLIENTID', 'CLIENTSECRET', 'REDIRECTURI',
+    'APPINSIGHTSKEY'
+]
+
+# Secrets the application runs without, telemetry is discarded when there is no instrumentation key
+OPTIONAL_SECRETS = ['APPINSIGHTSKEY']
+
+
+@lru_cache(maxsize=None)
+def prefetch_secrets() -> None:
+    """
+        Resolves every Key Vault secret of the application at once, the first time one is needed.
+    """
+    secret_store.prefetch(KEY_VAULT_SECRETS)
+
+
+def key_vault_secret(name: str) -> LazyValue:
+    """
+        Returns a setting holding a Key Vault secret, resolved on first use.
+    """
+    def load():
+        prefetch_secrets()
+        return get_key_vault_secret(name)
+    return LazyValue(load)
+
 
 # Debug mode for the application, for production set it to False
 DEBUG = False
 
 
 # Connection string for the database
-SQLALCHEMY_DATABASE_URI = get_key_vault_secret('PGCONNECTIONSTRING')
+SQLALCHEMY_DATABASE_URI = key_vault_secret('PGCONNECTIONSTRING')
 
 
+# Connection pool of each worker, gunicorn's 4 workers open at most 4 * (POOL_SIZE + MAX_OVERFLOW) connections
+# Connections are checked with a ping before use and replaced after POOL_RECYCLE seconds
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', '5')),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '2')),
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', '10')),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '1800')),
+    'pool_pre_ping': True,
+}
+
+# Read replicas, see ReplicaRouter in database.py
+# Comma separated connection strings of the replicas, read-only queries stay on the primary without any
+DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+
+# How reads are spread over the replicas: round_robin or least_connections
+DATABASE_REPLICA_SELECTION = os.environ.get('DATABASE_REPLICA_SELECTION', 'round_robin')
+
+# Replicas further behind the primary get no reads, and reads go to the primary for this long after a document write
+DATABASE_REPLICA_MAX_LAG_SECONDS = int(os.environ.get('DATABASE_REPLICA_MAX_LAG_SECONDS', '10'))
+
+# Seconds between two measurements of the replicas' lag
+DATABASE_REPLICA_CHECK_INTERVAL_SECONDS = int(os.environ.get('DATABASE_REPLICA_CHECK_INTERVAL_SECONDS', '5'))
+
 # Track modifications to model changes, set to False for performance
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Visitor write-behind queue, see visitor_queue.py
+# Maximum number of page views buffered in memory per worker
+VISITOR_QUEUE_MAX_SIZE = int(os.environ.get('VISITOR_QUEUE_MAX_SIZE', '10000'))
+
+# Buffered visitors are written every BATCH_SIZE rows or FLUSH_INTERVAL_MS milliseconds
+VISITOR_QUEUE_BATCH_SIZE = int(os.environ.get('VISITOR_QUEUE_BATCH_SIZE', '500'))
+VISITOR_QUEUE_FLUSH_INTERVAL_MS = int(os.environ.get('VISITOR_QUEUE_FLUSH_INTERVAL_MS', '1000'))
+
+# What to do when the buffer is full: block, drop or sync (write on the request thread)
+VISITOR_QUEUE_BACKPRESSURE = os.environ.get('VISITOR_QUEUE_BACKPRESSURE', 'sync')
+
+# How long the block policy waits for room before dropping a visitor
+VISITOR_QUEUE_BLOCK_TIMEOUT_MS = int(os.environ.get('VISITOR_QUEUE_BLOCK_TIMEOUT_MS', '100'))
+
+# Document catalog cache, see catalog.py
+# Seconds a worker serves its cached copy of the document catalog before reloading it
+CATALOG_TTL_SECONDS = int(os.environ.get('CATALOG_TTL_SECONDS', '300'))
+
+# PostgreSQL LISTEN/NOTIFY channel used to invalidate the catalog in every worker, empty to disable
+CATALOG_NOTIFY_CHANNEL = os.environ.get('CATALOG_NOTIFY_CHANNEL', '')
+
+# Catalog queries of /api/documents, see search.py
+# Where queries run: memory (an inverted index of the cached catalog) or postgres (the azure_document indexes)
+CATALOG_SEARCH_BACKEND = os.environ.get('CATALOG_SEARCH_BACKEND', 'memory')
+
+# Documents per page when the request does not ask for a limit
+CATALOG_PAGE_SIZE = int(os.environ.get('CATALOG_PAGE_SIZE', '50'))
+
+# The largest limit a request may ask for
+CATALOG_MAX_PAGE_SIZE = int(os.environ.get('CATALOG_MAX_PAGE_SIZE', '500'))
+
+# Visitor rollups, see rollups.py
+# Visitor keys aggregated per transaction by flask rollup
+ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE', '50000'))
+
+# Visitor keys handed out more recently than this are left for a later run, so late commits are not skipped
+ROLLUP_SETTLE_SECONDS = int(os.environ.get('ROLLUP_SETTLE_SECONDS', '300'))
+
+# Monthly visitor partitions, see partitions.py
+# Partitions created ahead of the current month by flask partitions
+VISITOR_PARTITION_MONTHS_AHEAD = int(os.environ.get('VISITOR_PARTITION_MONTHS_AHEAD', '3'))
+
+# Months of visits kept in the visitor table, 0 keeps every month
+VISITOR_RETENTION_MONTHS = int(os.environ.get('VISITOR_RETENTION_MONTHS', '0'))
+
+# archive moves expired partitions to the visitor_archive schema, drop deletes them
+VISITOR_RETENTION_ACTION = os.environ.get('VISITOR_RETENTION_ACTION', 'archive')
+
+# GeoIP lookups, see geoip.py
+# Number of resolved ip addresses kept in each worker's LRU cache
+GEOIP_CACHE_SIZE = int(os.environ.get('GEOIP_CACHE_SIZE', '65536'))
+
+# Cache countries per /24 (IPv4) or /48 (IPv6) network instead of per address
+GEOIP_CACHE_BY_PREFIX = os.environ.get('GEOIP_CACHE_BY_PREFIX', 'false').lower() == 'true'
+
+# User-Agent parsing, see useragents.py
+# Number of parsed User-Agent strings kept in each worker's LRU cache
+USER_AGENT_CACHE_SIZE = int(os.environ.get('USER_AGENT_CACHE_SIZE', '4096'))
+
+# Visitor dimensions, see dimensions.py
+# Country, browser and operating system ids kept in each worker's cache, per dimension
+DIMENSION_CACHE_SIZE = int(os.environ.get('DIMENSION_CACHE_SIZE', '10000'))
+
+# Telemetry pipeline, see insights.py
+# Where aggregated telemetry is sent: appinsights, file, memory or none
+TELEMETRY_SINK = os.environ.get('TELEMETRY_SINK', 'appinsights')
+
+# File the file sink appends JSON lines to
+TELEMETRY_FILE_PATH = os.environ.get('TELEMETRY_FILE_PATH', 'telemetry.jsonl')
+
+# Seconds between background flushes, and the number of samples buffered between them
+TELEMETRY_FLUSH_INTERVAL_SECONDS = int(os.environ.get('TELEMETRY_FLUSH_INTERVAL_SECONDS', '30'))
+TELEMETRY_MAX_PENDING = int(os.environ.get('TELEMETRY_MAX_PENDING', '100000'))
+
+# Request instrumentation, see instrumentation.py
+# Add a Server-Timing header with the request's span durations to every response
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
+# Client addresses allowed to scrape /metrics, comma separated, empty allows every client
+METRICS_ALLOWED_ADDRESSES = [address.strip() for address in
+                             os.environ.get('METRICS_ALLOWED_ADDRESSES', '127.0.0.1,::1').split(',') if address.strip()]
+
+# Server-side sessions, see sessions.py
+# Where session data is kept: postgres (shared by every worker), memory (a single worker process only)
+# or cookie (Flask's signed cookie sessions)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'postgres')
+
+# Seconds a session is kept after it was last modified
+SESSION_LIFETIME_SECONDS = int(os.environ.get('SESSION_LIFETIME_SECONDS', '86400'))
+
+# Sessions kept by each worker with the memory backend, the least recently used are evicted first
+SESSION_MEMORY_MAX_SIZE = int(os.environ.get('SESSION_MEMORY_MAX_SIZE', '10000'))
+
+# Every SESSION_CLEANUP_EVERY session writes, one batch of SESSION_CLEANUP_BATCH_SIZE expired sessions is deleted
+SESSION_CLEANUP_EVERY = int(os.environ.get('SESSION_CLEANUP_EVERY', '1000'))
+SESSION_CLEANUP_BATCH_SIZE = int(os.environ.get('SESSION_CLEANUP_BATCH_SIZE', '1000'))
+
+# Health probes, see health.py
+# Path of the readiness probe, the liveness probe stays on /hello where the application gateway polls it
+HEALTH_READINESS_PATH = os.environ.get('HEALTH_READINESS_PATH', '/ready')
+
+# Seconds between the background readiness checks, results older than 3 intervals count as failed
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.environ.get('HEALTH_CHECK_INTERVAL_SECONDS', '10'))
+
+# Index page rendering, see rendering.py
+# fragments renders each document card once per catalog version, template renders index.html per request
+INDEX_RENDER_MODE = os.environ.get('INDEX_RENDER_MODE', 'fragments')
+
+# Serve the fragment rendered page gzip compressed to browsers that accept it
+INDEX_GZIP = os.environ.get('INDEX_GZIP', 'true').lower() == 'true'
+
 # Folder for app static files e.g. images, stylesheets
 STATIC_FOLDER = os.path.join(os.path.dirname(__file__), 'static')
 
-SECRET_KEY = get_key_vault_secret('FLASKSECRETKEY')
+SECRET_KEY = key_vault_secret('FLASKSECRETKEY')
 
 API_VERSION = 'v1.0'
 RESOURCE = "https://graph.microsoft.com"
-RESOURCE_ENDPOINT = f"{RESOURCE}/{API_VERSION}/me/"
+# The profile endpoint can be pointed at a local stub Graph server for load tests
+RESOURCE_ENDPOINT = os.environ.get('GRAPH_RESOURCE_ENDPOINT', f"{RESOURCE}/{API_VERSION}/me/")
 AUTHORITY_HOST_URL = "https://login.microsoftonline.com"
 
+# Microsoft Graph client, see graph.py
+# Seconds to wait for Graph to connect and to respond
+GRAPH_TIMEOUT_SECONDS = float(os.environ.get('GRAPH_TIMEOUT_SECONDS', '5'))
+
+# Keep-alive connections kept open to Graph by each worker
+GRAPH_POOL_SIZE = int(os.environ.get('GRAPH_POOL_SIZE', '10'))
+
+# Profiles cached per worker, each for the lifetime of its token or MAX_AGE_SECONDS, whichever is shorter
+GRAPH_CACHE_SIZE = int(os.environ.get('GRAPH_CACHE_SIZE', '1024'))
+GRAPH_PROFILE_MAX_AGE_SECONDS = int(os.environ.get('GRAPH_PROFILE_MAX_AGE_SECONDS', '300'))
+
+# Azure AD tokens, see auth.py
+# Seconds before expiry a signed in user's access token is refreshed in the background
+AUTH_REFRESH_MARGIN_SECONDS = int(os.environ.get('AUTH_REFRESH_MARGIN_SECONDS', '300'))
+
+# Seconds between the background refresh rounds, 0 refreshes tokens only when a request finds them expired
+AUTH_REFRESH_INTERVAL_SECONDS = int(os.environ.get('AUTH_REFRESH_INTERVAL_SECONDS', '60'))
+
+# Signed in users whose tokens each worker keeps in memory
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', '1024'))
+
+# Seconds to wait for the authority to respond
+AUTH_TIMEOUT_SECONDS = float(os.environ.get('AUTH_TIMEOUT_SECONDS', '10'))
+
+
+TENANT = key_vault_secret('TENANT')
+
+CLIENT_ID = key_vault_secret('CLIENTID')
+
+CLIENT_SECRET = key_vault_secret('CLIENTSECRET')
 
-TENANT = get_key_vault_secret('TENANT')
+AUTHORITY_URL = LazyValue(lambda: f"{AUTHORITY_HOST_URL}/{resolve(TENANT)}")
 
-CLIENT_ID = get_key_vault_secret('CLIENTID')
+REDIRECT_URI = key_vault_secret('REDIRECTURI')
 
-CLIENT_SECRET = get_key_vault_secret('CLIENTSECRET')
 
-AUTHORITY_URL = f"{AUTHORITY_HOST_URL}/{TENANT}"
+def base_uri() -> str:
+    """
+        Returns the scheme and host of the redirect uri, the address the application is served on.
+    """
+    path = urlsplit(resolve(REDIRECT_URI))
+    return f"{path.scheme}://{path.netloc}"
 
-REDIRECT_URI = get_key_vault_secret('REDIRECTURI')
 
-path = urlsplit(REDIRECT_URI)
-BASE_URI = f"{path.scheme}://{path.netloc}"
+BASE_URI = LazyValue(base_uri)
 
 TEMPLATE_AUTHZ_URL = ('https://login.microsoftonline.com/{}/oauth2/authorize?' +
                       'response_type=code&client_id={}&redirect_uri={}&' +
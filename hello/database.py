@@ -1,10 +1,396 @@
 """
 Module creates an instance of the SQLAlchemy database object.
 In separate file to avoid circular dependencies.
+Also contains the small data access layer used to call the stored functions in functions.sql
+through the engine's connection pool, the pool metrics reported for it, and the routing of
+read-only queries to the read replicas in DATABASE_REPLICA_URLS.
 """
 
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from timeit import default_timer
+from typing import List, Optional
+
+import sqlalchemy
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN = 'round_robin'
+LEAST_CONNECTIONS = 'least_connections'
+SELECTIONS = (ROUND_ROBIN, LEAST_CONNECTIONS)
+
+# Seconds a replica's replay is behind the primary, 0 once it replayed all it received and for a server
+# that is not a standby. NULL while a standby has not replayed any transaction yet.
+REPLICATION_LAG_QUERY = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+class PoolMetrics:
+    """
+        Counters describing how the connection pool is used by this worker.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pool = None
+        self._counters = {
+            'checkouts': 0,
+            'checkout_wait_seconds_total': 0.0,
+            'checkout_wait_seconds_max': 0.0,
+            'connects': 0,
+            'overflow_checkouts': 0,
+            'invalidations': 0,
+        }
+
+    def watch(self, engine) -> None:
+        """
+            Listens to the pool events of an engine.
+        """
+        self._pool = engine.pool
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+
+    def record_wait(self, seconds: float) -> None:
+        """
+            Records how long a checkout waited for a connection.
+        """
+        with self._lock:
+            self._counters['checkouts'] += 1
+            self._counters['checkout_wait_seconds_total'] += seconds
+            self._counters['checkout_wait_seconds_max'] = max(
+                self._counters['checkout_wait_seconds_max'], seconds)
+
+    def stats(self) -> dict:
+        """
+            Returns the counters together with the pool's current size and usage.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        if self._pool is not None and hasattr(self._pool, 'checkedout'):
+            stats['in_use'] = self._pool.checkedout()
+            stats['idle'] = self._pool.checkedin()
+            stats['overflow'] = max(0, self._pool.overflow())
+        return stats
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self._counters['connects'] += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        # connections beyond the pool size are opened from the overflow allowance
+        if hasattr(self._pool, 'overflow') and self._pool.overflow() > 0:
+            with self._lock:
+                self._counters['overflow_checkouts'] += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        with self._lock:
+            self._counters['invalidations'] += 1
+
+
+class InstrumentedSQLAlchemy(SQLAlchemy):
+    """
+        SQLAlchemy extension that reports the pool metrics of the engines it creates.
+        The pool is tuned with SQLALCHEMY_ENGINE_OPTIONS in config.py.
+    """
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = sqlalchemy.create_engine(sa_url, **engine_opts)
+        pool_metrics.watch(engine)
+        return engine
+
+
+# Metrics for the connection pool of this worker
+pool_metrics = PoolMetrics()
 
 # An instance of the SQLAlchemy ORM's database object.
 # It will be used to call stored procedures and read/write to the database.
-db = SQLAlchemy()
+db = InstrumentedSQLAlchemy()
+
+
+def database_dsn(uri: str) -> str:
+    """
+        Converts the SQLAlchemy database uri into a dsn asyncpg and libpq understand.
+    """
+    scheme, separator, rest = uri.partition('://')
+    return scheme.split('+', 1)[0] + separator + rest
+
+
+# Names of the statements prepared on each DBAPI connection, dropped with the connection
+_prepared_statements = weakref.WeakKeyDictionary()
+
+
+@contextmanager
+def checkout():
+    """
+        Checks a DBAPI connection out of the pool and returns it when the block exits.
+        Must be used inside an application context.
+    """
+    wait_start = default_timer()
+    connection = db.engine.raw_connection()
+    pool_metrics.record_wait(default_timer() - wait_start)
+    try:
+        yield connection
+    finally:
+        # closing a pooled connection returns it to the pool, rolling back anything uncommitted
+        connection.close()
+
+
+@contextmanager
+def transaction():
+    """
+        Yields a cursor on a pooled connection, commits when the block succeeds and rolls back when it raises.
+    """
+    with checkout() as connection:
+        cursor = connection.cursor()
+        try:
+            yield cursor
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def call_procedure(cursor, function_name: str, params: list) -> None:
+    """
+        Calls a stored function through a server-side prepared statement.
+        The statement is prepared the first time a pooled connection calls the function,
+        afterwards only the parameters are sent.
+    """
+    prepared = _prepared_statements.setdefault(cursor.connection, set())
+    statement = f"{function_name}_plan"
+
+    if statement not in prepared:
+        placeholders = ', '.join(f"${position}" for position in range(1, len(params) + 1))
+        cursor.execute(f"PREPARE {statement} AS SELECT {function_name}({placeholders})")
+        prepared.add(statement)
+
+    cursor.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
+
+
+def replication_lag(connection) -> Optional[float]:
+    """
+        Returns how many seconds a replica is behind the primary, None when it cannot tell.
+    """
+    lag = connection.execute(sqlalchemy.text(REPLICATION_LAG_QUERY)).scalar()
+    return None if lag is None else float(lag)
+
+
+class Replica:
+    """
+        The engine of a read replica and what the router last learned about it.
+        lag_seconds is None until the first lag check, the replica gets no reads before it.
+    """
+
+    def __init__(self, url: str, engine) -> None:
+        self.url = url
+        self.engine = engine
+        self.lag_seconds: Optional[float] = None
+        self.available = True
+        self.in_use = 0
+        self.reads = 0
+
+    def stats(self) -> dict:
+        """
+            Returns the replica's url without its password, lag, availability and read counters.
+        """
+        return {'url': repr(self.engine.url), 'lag_seconds': self.lag_seconds, 'available': self.available,
+                'in_use': self.in_use, 'reads': self.reads}
+
+
+class ReplicaRouter:
+    """
+        Sends read-only queries to the read replicas and everything else to the primary.
+        A read goes to a replica that answered its last lag check and is at most max_lag_seconds behind,
+        picked round robin or by fewest connections in use, and to the primary when there is none.
+        A replica that fails to connect gets no reads until its next successful lag check.
+        For max_lag_seconds after note_write, plus one check interval, reads go to the primary, so a
+        worker reloading what was just written does not read it from a replica that has not replayed it yet.
+        The lag checks run in a background thread started by the first read.
+        lag_probe measures the lag on a connection, replication_lag by default, tests pass their own.
+    """
+
+    def __init__(self, urls: List[str] = (), selection: str = ROUND_ROBIN, max_lag_seconds: float = 10,
+                 check_interval_seconds: float = 5, engine_options: dict = None, lag_probe=replication_lag) -> None:
+        self.selection = selection
+        self.max_lag = max_lag_seconds
+        self.check_interval = check_interval_seconds
+        self.lag_probe = lag_probe
+        self.replicas: List[Replica] = []
+        self._turns = itertools.count()
+        self._primary_until = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = {'replica_reads': 0, 'primary_reads': 0, 'replica_errors': 0, 'lag_checks': 0}
+        self.configure(urls, engine_options)
+
+    def configure(self, urls: List[str], engine_options: dict = None) -> None:
+        """
+            Creates an engine per replica url, with the primary's pool options.
+            The engines only connect when a lag check or a read needs them.
+        """
+        self.dispose()
+        self.replicas = [Replica(url, sqlalchemy.create_engine(url, **(engine_options or {}))) for url in urls]
+
+    def init_app(self, flask_app) -> None:
+        """
+            Reads DATABASE_REPLICA_URLS, DATABASE_REPLICA_SELECTION, DATABASE_REPLICA_MAX_LAG_SECONDS
+            and DATABASE_REPLICA_CHECK_INTERVAL_SECONDS from the Flask configuration.
+        """
+        selection = flask_app.config.get('DATABASE_REPLICA_SELECTION', ROUND_ROBIN)
+        if selection not in SELECTIONS:
+            raise ValueError(f"Unknown replica selection {selection!r}, expected one of {SELECTIONS}")
+        self.selection = selection
+        self.max_lag = flask_app.config.get('DATABASE_REPLICA_MAX_LAG_SECONDS', 10)
+        self.check_interval = flask_app.config.get('DATABASE_REPLICA_CHECK_INTERVAL_SECONDS', 5)
+        self.configure(flask_app.config.get('DATABASE_REPLICA_URLS', []),
+                       flask_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        flask_app.extensions['replica_router'] = self
+
+    def choose(self) -> Optional[Replica]:
+        """
+            Returns the replica the next read goes to, None when it goes to the primary.
+        """
+        if not self.replicas or time.monotonic() < self._primary_until:
+            return None
+        candidates = [replica for replica in self.replicas if replica.available
+                      and replica.lag_seconds is not None and replica.lag_seconds <= self.max_lag]
+        if not candidates:
+            return None
+        if self.selection == LEAST_CONNECTIONS:
+            fewest = min(replica.in_use for replica in candidates)
+            candidates = [replica for replica in candidates if replica.in_use == fewest]
+        return candidates[next(self._turns) % len(candidates)]
+
+    @contextmanager
+    def connect(self):
+        """
+            Yields a SQLAlchemy connection for read-only queries, on a replica or the primary.
+            Must be used inside an application context.
+        """
+        self.ensure_running()
+        replica = self.choose()
+        connection = None
+        if replica is not None:
+            try:
+                connection = replica.engine.connect()
+            except sqlalchemy.exc.DBAPIError:
+                logger.warning("Read replica %r is unreachable, reading from the primary", replica.engine.url)
+                replica.available = False
+                self._count('replica_errors')
+                replica = None
+
+        if replica is None:
+            connection = db.engine.connect()
+            self._count('primary_reads')
+        else:
+            with self._lock:
+                replica.in_use += 1
+                replica.reads += 1
+                self._counters['replica_reads'] += 1
+        try:
+            yield connection
+        finally:
+            connection.close()
+            if replica is not None:
+                with self._lock:
+                    replica.in_use -= 1
+
+    def note_write(self) -> None:
+        """
+            Sends the reads of the next max_lag_seconds and check interval to the primary.
+        """
+        if self.replicas:
+            self._primary_until = time.monotonic() + self.max_lag + self.check_interval
+
+    def check_lag(self) -> None:
+        """
+            Measures the lag of every replica, marking those that cannot be reached as unavailable.
+        """
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    replica.lag_seconds = self.lag_probe(connection)
+                replica.available = True
+            except Exception:
+                if replica.available:
+                    logger.exception("Checking the lag of read replica %r failed", replica.engine.url)
+                replica.available = False
+        self._count('lag_checks')
+
+    def stats(self) -> dict:
+        """
+            Returns the read counters and the state of every replica.
+        """
+        with self._lock:
+            return dict(self._counters, replicas=[replica.stats() for replica in self.replicas])
+
+    def ensure_running(self) -> None:
+        """
+            Starts the lag checks, once per process and only with replicas.
+        """
+        if self._thread is not None or not self.replicas:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_forever, name='replica-lag', daemon=True)
+                self._thread.start()
+
+    def dispose(self) -> None:
+        """
+            Closes the pooled replica connections, e.g. before forking workers that must open their own.
+        """
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def reset_after_fork(self) -> None:
+        """
+            Drops the parent's lag check thread, the child starts its own on its first read.
+        """
+        self._lock = threading.Lock()
+        self._thread = None
+        for replica in self.replicas:
+            replica.in_use = 0
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _run_forever(self) -> None:
+        while True:
+            try:
+                self.check_lag()
+            except Exception:
+                logger.exception("Replica lag check round failed")
+            time.sleep(self.check_interval)
+
+
+# Routes the read-only queries of this worker, bound to the Flask application in register_extensions.
+replica_router = ReplicaRouter()
+os.register_at_fork(after_in_child=replica_router.reset_after_fork)
+
+
+@contextmanager
+def read_transaction():
+    """
+        Yields a cursor for read-only queries, on a read replica when one is current and on the primary otherwise.
+        Nothing is committed, writes go through transaction.
+        Must be used inside an application context.
+    """
+    with replica_router.connect() as connection:
+        cursor = connection.connection.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
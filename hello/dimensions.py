@@ -0,0 +1,147 @@
+"""
+    Dimension tables of the visitor table.
+    Visitors reference their country, browser and operating system by a small integer id into
+    visitor_country, visitor_browser and visitor_operating_system instead of repeating the strings
+    in every row. Each worker caches the ids it has seen, so storing a visitor only touches the
+    dimension tables the first time a worker meets a value. Unknown values are added in their own
+    transaction, so a cached id always belongs to a committed row.
+"""
+
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from hello.database import transaction
+
+# Dimension table of each visitor attribute
+DIMENSIONS = {
+    'country': 'visitor_country',
+    'browser': 'visitor_browser',
+    'operating_system': 'visitor_operating_system',
+}
+
+
+def lookup_ids(cursor, table: str, names: List[str]) -> Dict[str, int]:
+    """
+        Returns the ids of names in a dimension table, adding the names it does not hold yet.
+        Existing names are read first, so the id sequence only advances for new names.
+    """
+    cursor.execute(f"SELECT name, id FROM {table} WHERE name = ANY(%s)", [names])
+    ids = dict(cursor.fetchall())
+    missing = [name for name in names if name not in ids]
+    if missing:
+        cursor.execute(f"""
+            INSERT INTO {table} (name) SELECT unnest(%s::text[])
+                ON CONFLICT (name) DO NOTHING
+        """, [missing])
+        # a new statement sees the names another worker inserted concurrently and committed
+        cursor.execute(f"SELECT name, id FROM {table} WHERE name = ANY(%s)", [missing])
+        ids.update(cursor.fetchall())
+    return ids
+
+
+class DimensionCache:
+    """
+        Maps visitor attribute values to their dimension ids.
+        Each dimension keeps up to max_size ids and starts over when it is full.
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self._ids: Dict[str, Dict[str, int]] = {dimension: {} for dimension in DIMENSIONS}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    def init_app(self, flask_app) -> None:
+        """
+            Configures the cache from the Flask configuration.
+        """
+        self.max_size = flask_app.config.get('DIMENSION_CACHE_SIZE', 10000)
+        flask_app.extensions['visitor_dimensions'] = self
+
+    def ids(self, visitors: Iterable) -> List[Tuple[Optional[int], Optional[int], Optional[int]]]:
+        """
+            Returns the (country_id, browser_id, operating_system_id) of each visitor, in order.
+            Values missing from the cache are looked up, and added when needed, in one transaction.
+            Must be called inside an application context.
+        """
+        visitors = list(visitors)
+        # the id dictionaries are only ever added to, a dimension that starts over gets a new one
+        cached = dict(self._ids)
+        missing = {}
+        for dimension in DIMENSIONS:
+            names = {getattr(visitor, dimension) for visitor in visitors} - {None}
+            missing[dimension] = [name for name in names if name not in cached[dimension]]
+
+        resolved = {}
+        if any(missing.values()):
+            self._count('misses')
+            with transaction() as cursor:
+                resolved = {dimension: lookup_ids(cursor, DIMENSIONS[dimension], names)
+                            for dimension, names in missing.items() if names}
+            # remembered once the transaction committed
+            self._remember(resolved)
+        else:
+            self._count('hits')
+
+        rows = []
+        for visitor in visitors:
+            row = []
+            for dimension in DIMENSIONS:
+                name = getattr(visitor, dimension)
+                row.append(None if name is None else cached[dimension].get(name) or resolved[dimension][name])
+            rows.append(tuple(row))
+        return rows
+
+    def cached_ids(self, names: tuple) -> Optional[tuple]:
+        """
+            Returns the ids of one visitor's (country, browser, operating_system), None unless all are cached.
+            For callers that look values up themselves, e.g. the async entry point.
+        """
+        ids = []
+        for dimension, name in zip(DIMENSIONS, names):
+            key = None if name is None else self._ids[dimension].get(name)
+            if key is None and name is not None:
+                self._count('misses')
+                return None
+            ids.append(key)
+        self._count('hits')
+        return tuple(ids)
+
+    def remember_ids(self, names: tuple, ids: tuple) -> None:
+        """
+            Caches the committed ids of one visitor's (country, browser, operating_system).
+        """
+        self._remember({dimension: {name: key} for dimension, name, key in zip(DIMENSIONS, names, ids)
+                        if name is not None})
+
+    def stats(self) -> dict:
+        """
+            Returns the hit and miss counters and the number of cached ids per dimension.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        return dict(stats, **{dimension: len(ids) for dimension, ids in self._ids.items()})
+
+    def reset_after_fork(self) -> None:
+        """
+            Keeps the ids cached by the parent process, they are valid in every process.
+        """
+        self._lock = threading.Lock()
+
+    def _count(self, counter: str) -> None:
+        # request threads and the visitor queue's flusher look ids up concurrently
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _remember(self, resolved: Dict[str, Dict[str, int]]) -> None:
+        with self._lock:
+            for dimension, ids in resolved.items():
+                if len(self._ids[dimension]) + len(ids) > self.max_size:
+                    self._ids[dimension] = {}
+                self._ids[dimension].update(ids)
+
+
+# The process wide dimension id cache, bound to the Flask application in register_extensions.
+visitor_dimensions = DimensionCache()
+os.register_at_fork(after_in_child=visitor_dimensions.reset_after_fork)
@@ -0,0 +1,124 @@
+"""
+    Country lookups for visitor ip addresses.
+    The packaged GeoLite2 database is opened once per process in memory-mapped mode
+    and shared by every thread, resolved country names are kept in a bounded LRU cache.
+"""
+
+import atexit
+import ipaddress
+import threading
+from functools import lru_cache
+from typing import Iterable, List
+
+import maxminddb
+
+# Returned when an ip address is not in the GeoLite2 database
+UNKNOWN_COUNTRY = "N/A"
+
+
+class GeoIPLookup:
+    """
+        Resolves ip addresses to English country names.
+        When cache_by_prefix is set addresses are cached per /24 (IPv4) or /48 (IPv6) network,
+        trading exactness at the edge of a network for a far higher hit rate.
+    """
+
+    def __init__(self, database_path: str = '', cache_size: int = 65536,
+                 cache_by_prefix: bool = False) -> None:
+        # the bundled GeoLite2 database is located when it is first opened
+        self.database_path = database_path
+        self._reader = None
+        self._lock = threading.Lock()
+        self.configure(cache_size, cache_by_prefix)
+
+    def configure(self, cache_size: int, cache_by_prefix: bool) -> None:
+        """
+            Applies the cache settings, dropping anything cached so far.
+        """
+        self.cache_by_prefix = cache_by_prefix
+        self._cached_lookup = lru_cache(maxsize=cache_size)(self._lookup_uncached)
+
+    def init_app(self, flask_app) -> None:
+        """
+            Configures the cache from the Flask configuration.
+        """
+        self.configure(
+            flask_app.config.get('GEOIP_CACHE_SIZE', 65536),
+            flask_app.config.get('GEOIP_CACHE_BY_PREFIX', False))
+        flask_app.extensions['geoip'] = self
+
+    def reader(self) -> maxminddb.Reader:
+        """
+            Returns the shared database reader, opening the database on first use.
+        """
+        if self._reader is not None:
+            return self._reader
+        with self._lock:
+            if self._reader is None:
+                if not self.database_path:
+                    from geolite2 import geolite2
+                    self.database_path = geolite2.filename
+                try:
+                    # the C extension decodes records far faster than the pure python reader
+                    self._reader = maxminddb.open_database(self.database_path, maxminddb.MODE_MMAP_EXT)
+                except ValueError:
+                    self._reader = maxminddb.open_database(self.database_path, maxminddb.MODE_MMAP)
+                atexit.register(self.close)
+            return self._reader
+
+    def lookup(self, ip_address: str) -> str:
+        """
+            Gets the English country name of an ip address.
+        """
+        return self._cached_lookup(self._cache_key(ip_address))
+
+    def lookup_many(self, ip_addresses: Iterable[str]) -> List[str]:
+        """
+            Gets the country names of many ip addresses, e.g. to backfill stored visitors.
+            Each distinct address is only resolved once.
+        """
+        resolved = {}
+        countries = []
+        for ip_address in ip_addresses:
+            country = resolved.get(ip_address)
+            if country is None:
+                country = resolved[ip_address] = self.lookup(ip_address)
+            countries.append(country)
+        return countries
+
+    def cache_info(self):
+        """
+            Returns the hits, misses and size of the LRU cache.
+        """
+        return self._cached_lookup.cache_info()
+
+    def close(self) -> None:
+        """
+            Closes the database reader and clears the cache.
+        """
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+        self._cached_lookup.cache_clear()
+
+    def _cache_key(self, ip_address: str) -> str:
+        if not self.cache_by_prefix:
+            return ip_address
+
+        if ':' not in ip_address:
+            # the network address of the /24 the visitor belongs to
+            return ip_address.rpartition('.')[0] + '.0'
+
+        return str(ipaddress.ip_network(f"{ip_address}/48", strict=False).network_address)
+
+    def _lookup_uncached(self, ip_address: str) -> str:
+        country_data = self.reader().get(ip_address)
+        country = UNKNOWN_COUNTRY
+        if country_data:
+            country = country_data.get('country', {}).get('names', {}).get('en', '')
+        return country
+
+
+# The process wide GeoIP lookup service, configured in register_extensions.
+geoip = GeoIPLookup()
@@ -0,0 +1,152 @@
+"""
+    Microsoft Graph client used to fetch the signed in user's profile.
+    Requests go through one pooled requests.Session with keep-alive and strict timeouts.
+    Profiles are cached per hash of the access token until the token expires, or for
+    GRAPH_PROFILE_MAX_AGE_SECONDS at most, and concurrent fetches for one token share a single request.
+"""
+
+import collections
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from hello.concurrency import SingleFlight
+
+
+def token_key(access_token: str) -> str:
+    """
+        Returns the hash an access token's profile is cached under, so tokens are not kept in memory.
+    """
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+
+
+class GraphClient:
+    """
+        Fetches and caches Microsoft Graph user profiles.
+    """
+
+    def __init__(self, endpoint: str = '', timeout: float = 5, pool_size: int = 10,
+                 cache_size: int = 1024, max_age_seconds: float = 300) -> None:
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.max_age = max_age_seconds
+        self._session = None
+        self._profiles = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    def init_app(self, flask_app) -> None:
+        """
+            Configures the client from the Flask configuration.
+        """
+        self.endpoint = flask_app.config['RESOURCE_ENDPOINT']
+        self.timeout = flask_app.config.get('GRAPH_TIMEOUT_SECONDS', 5)
+        self.pool_size = flask_app.config.get('GRAPH_POOL_SIZE', 10)
+        self.cache_size = flask_app.config.get('GRAPH_CACHE_SIZE', 1024)
+        self.max_age = flask_app.config.get('GRAPH_PROFILE_MAX_AGE_SECONDS', 300)
+        flask_app.extensions['graph'] = self
+
+    def session(self):
+        """
+            Returns the pooled requests.Session, creating it on first use.
+        """
+        if self._session is None:
+            # requests is imported with the first Graph call instead of when a worker boots
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def reset_after_fork(self) -> None:
+        """
+            Drops the connections inherited from the parent process, they must not be shared between workers.
+        """
+        self._session = None
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+
+    def get_profile(self, access_token: str, token_expires_at: float = None) -> dict:
+        """
+            Returns the profile of the user the access token belongs to.
+            token_expires_at is the token's expiry as a unix timestamp, the cached profile never outlives it.
+        """
+        profile = self.cached_profile(access_token)
+        if profile is not None:
+            return profile
+
+        key = token_key(access_token)
+        return self._single_flight.do(key, lambda: self._fetch(access_token, token_expires_at))
+
+    def cached_profile(self, access_token: str):
+        """
+            Returns the cached profile for an access token, or None when it is not cached or expired.
+        """
+        key = token_key(access_token)
+        with self._lock:
+            entry = self._profiles.get(key)
+            if entry is not None and time.time() < entry[1]:
+                self._profiles.move_to_end(key)
+                self._counters['hits'] += 1
+                return entry[0]
+            self._counters['misses'] += 1
+        return None
+
+    def remember_profile(self, access_token: str, profile: dict, token_expires_at: float = None) -> None:
+        """
+            Caches a profile fetched for an access token.
+        """
+        expires_at = time.time() + self.max_age
+        if token_expires_at:
+            expires_at = min(expires_at, token_expires_at)
+
+        with self._lock:
+            key = token_key(access_token)
+            self._profiles[key] = (profile, expires_at)
+            self._profiles.move_to_end(key)
+            while len(self._profiles) > self.cache_size:
+                self._profiles.popitem(last=False)
+
+    def request_headers(self, access_token: str) -> dict:
+        """
+            Returns the headers sent with a profile request.
+        """
+        return {'Authorization': 'Bearer ' + access_token,
+                'User-Agent': 'adal-python-sample',
+                'Accept': 'application/json',
+                'Content-Type': 'application/json',
+                'client-request-id': str(uuid.uuid4())}
+
+    def stats(self) -> dict:
+        """
+            Returns the cache hit and miss counters and the number of cached profiles.
+        """
+        with self._lock:
+            return dict(self._counters, profiles=len(self._profiles))
+
+    def _fetch(self, access_token: str, token_expires_at: float) -> dict:
+        response = self.session().get(
+            self.endpoint, headers=self.request_headers(access_token), timeout=self.timeout)
+        profile = response.json()
+
+        # error responses are returned as they always were but never cached
+        if response.ok:
+            self.remember_profile(access_token, profile, token_expires_at)
+
+        return profile
+
+
+# The process wide Microsoft Graph client, configured in register_extensions.
+graph_client = GraphClient()
+os.register_at_fork(after_in_child=graph_client.reset_after_fork)
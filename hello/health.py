@@ -0,0 +1,218 @@
+"""
+    Health probes for the application gateway and the platform.
+    Both probes are answered by a WSGI middleware in front of the Flask application, so they
+    skip URL dispatch, sessions, the request hooks and the after_request headers:
+        /hello      liveness, always answered while the worker can serve requests
+        /ready      readiness, the cached results of the readiness checks, 503 while any fails
+    The readiness checks (a database ping through the connection pool, the GeoIP reader and the
+    Key Vault secrets) run in a background thread every HEALTH_CHECK_INTERVAL_SECONDS, so a probe
+    never waits on the database. Results older than three intervals count as failed, which
+    also catches a check stuck on a hung connection. /ready is not authenticated, so it only reports
+    whether each check passed, the details of a failure, which may name hosts or secrets, are logged.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, NamedTuple
+
+from hello.config import KEY_VAULT_SECRETS, OPTIONAL_SECRETS, prefetch_secrets
+from hello.database import checkout, pool_metrics
+from hello.geoip import geoip
+from hello.secrets import secret_store
+
+logger = logging.getLogger(__name__)
+
+# The body of the liveness probe, unchanged from the Flask view it replaces
+LIVENESS_BODY = b"Hello World Security App"
+
+# Headers of every probe response, probes must never be served from a cache
+PROBE_HEADERS = [('Cache-Control', 'no-store'), ('X-Content-Type-Options', 'nosniff')]
+
+
+class CheckResult(NamedTuple):
+    """
+        The outcome of one run of a readiness check.
+    """
+    healthy: bool
+    detail: str
+    checked_at: float
+    duration_ms: float
+
+
+class HealthMonitor:
+    """
+        Runs named readiness checks in a background thread and keeps their latest results.
+        A check is a callable returning a short detail string, it fails by raising.
+        The thread is started by the first request a worker serves.
+    """
+
+    def __init__(self, interval_seconds: float = 10) -> None:
+        self.interval = interval_seconds
+        self.checks: Dict[str, Callable[[], str]] = {}
+        self._results: Dict[str, CheckResult] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_check(self, name: str, check: Callable[[], str]) -> None:
+        """
+            Adds a readiness check run from the next round on.
+        """
+        self.checks[name] = check
+
+    def run_checks(self) -> Dict[str, CheckResult]:
+        """
+            Runs every check once and stores the results.
+        """
+        results = {}
+        for name, check in list(self.checks.items()):
+            check_start = time.perf_counter()
+            try:
+                healthy, detail = True, check()
+            except Exception as error:
+                healthy, detail = False, f"{type(error).__name__}: {error}"
+                logger.warning("Readiness check %s failed: %s", name, detail)
+            results[name] = CheckResult(healthy, detail, time.time(), (time.perf_counter() - check_start) * 1000)
+
+        # replaced rather than mutated so probes read the results without the lock
+        self._results = results
+        return results
+
+    def report(self) -> tuple:
+        """
+            Returns whether the worker is ready and whether each check passed, without the checks' details.
+            A check not run yet or whose result is stale counts as failed.
+        """
+        now = time.time()
+        results = self._results
+        checks = {}
+        for name in self.checks:
+            result = results.get(name)
+            healthy = result is not None and result.healthy and now - result.checked_at <= 3 * self.interval
+            checks[name] = {'healthy': healthy}
+
+        ready = all(check['healthy'] for check in checks.values())
+        return ready, {'status': 'ready' if ready else 'not ready', 'checks': checks}
+
+    def ensure_running(self) -> None:
+        """
+            Starts the background checks, once per process.
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_forever, name='health-monitor', daemon=True)
+                self._thread.start()
+
+    def reset_after_fork(self) -> None:
+        """
+            Drops the parent's results and thread, e.g. gunicorn's preloading master's, so the child runs its own.
+        """
+        self._results = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run_forever(self) -> None:
+        while True:
+            try:
+                self.run_checks()
+            except Exception:
+                logger.exception("Readiness checks failed to run")
+            time.sleep(self.interval)
+
+
+class HealthMiddleware:
+    """
+        WSGI middleware answering the liveness and readiness probes before the wrapped application.
+    """
+
+    def __init__(self, wsgi_app, monitor: HealthMonitor, liveness_path: str = '/hello',
+                 readiness_path: str = '/ready') -> None:
+        self.wsgi_app = wsgi_app
+        self.monitor = monitor
+        self.liveness_path = liveness_path
+        self.readiness_path = readiness_path
+        self._liveness_headers = [('Content-Type', 'text/html; charset=utf-8'),
+                                  ('Content-Length', str(len(LIVENESS_BODY)))] + PROBE_HEADERS
+
+    def __call__(self, environ, start_response):
+        self.monitor.ensure_running()
+        path = environ.get('PATH_INFO')
+        method = environ.get('REQUEST_METHOD')
+        if path == self.liveness_path and method in ('GET', 'HEAD'):
+            start_response('200 OK', self._liveness_headers)
+            return [LIVENESS_BODY if method == 'GET' else b'']
+        if path == self.readiness_path and method in ('GET', 'HEAD'):
+            ready, summary = self.monitor.report()
+            body = json.dumps(summary).encode('utf-8')
+            start_response('200 OK' if ready else '503 Service Unavailable',
+                           [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))] + PROBE_HEADERS)
+            return [body if method == 'GET' else b'']
+        return self.wsgi_app(environ, start_response)
+
+
+def check_database(flask_app) -> Callable[[], str]:
+    """
+        Returns a check pinging the database through the connection pool.
+    """
+    def check() -> str:
+        with flask_app.app_context(), checkout() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+        stats = pool_metrics.stats()
+        return f"pool in use {stats.get('in_use', 0)}, idle {stats.get('idle', 0)}"
+    return check
+
+
+def check_geoip() -> str:
+    """
+        Opens the GeoIP reader when needed and reports the database's build date.
+    """
+    metadata = geoip.reader().metadata()
+    return f"{metadata.database_type} built {time.strftime('%Y-%m-%d', time.gmtime(metadata.build_epoch))}"
+
+
+def check_secrets() -> str:
+    """
+        Resolves the Key Vault secrets when needed and fails while a required one is missing or expired.
+    """
+    prefetch_secrets()
+    missing = [name for name in secret_store.missing(KEY_VAULT_SECRETS) if name not in OPTIONAL_SECRETS]
+    if missing:
+        raise LookupError(f"unresolved secrets {', '.join(missing)}")
+    return f"{len(KEY_VAULT_SECRETS) - len(OPTIONAL_SECRETS)} secrets resolved"
+
+
+class Health:
+    """
+        Installs the probe middleware and the readiness checks on the Flask application.
+    """
+
+    def __init__(self) -> None:
+        self.monitor = HealthMonitor()
+
+    def init_app(self, flask_app) -> None:
+        """
+            Wraps the application's WSGI callable, reads HEALTH_READINESS_PATH and HEALTH_CHECK_INTERVAL_SECONDS.
+        """
+        self.monitor.interval = flask_app.config.get('HEALTH_CHECK_INTERVAL_SECONDS', 10)
+        self.monitor.add_check('database', check_database(flask_app))
+        self.monitor.add_check('geoip', check_geoip)
+        self.monitor.add_check('secrets', check_secrets)
+
+        flask_app.wsgi_app = HealthMiddleware(
+            flask_app.wsgi_app, self.monitor,
+            readiness_path=flask_app.config.get('HEALTH_READINESS_PATH', '/ready'))
+        flask_app.extensions['health'] = self
+
+
+# The process wide health monitor, bound to the Flask application in register_extensions.
+health = Health()
+os.register_at_fork(after_in_child=health.monitor.reset_after_fork)
@@ -1,14 +1,29 @@
 """
     Application Insights methods are defined here.
-    If the Instrumentation Key Exists a telemetry client will be initialized and returned by get_telemetry_client.
+    If the Instrumentation Key Exists telemetry is sent to application insights by the telemetry pipeline.
     The APPINSIGHTS key should be stored in Key Vault and the application checks at runtime to get the key.
     If the key does not exist the application runs without telemetry.
+    Requests only append metric samples to an in-memory buffer, a background thread
+    aggregates them per metric name and sends them to the configured sink every
+    TELEMETRY_FLUSH_INTERVAL_SECONDS.
 """
 
-from applicationinsights import TelemetryClient
+import atexit
+import collections
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List
 
 from hello.secrets import get_key_vault_secret
 
+logger = logging.getLogger(__name__)
+
 
 def get_instrumentation_key():
     """
@@ -18,23 +33,220 @@ def get_instrumentation_key():
 
     try:
         instrumentation_key = get_key_vault_secret('APPINSIGHTSKEY')
-        
-    except Exception as exception:
-        if instrumentation_key:
-            telemetry_client = TelemetryClient(instrumentation_key)
-            telemetry_client.track_exception()
+
+    except Exception:
+        logger.warning("No application insights instrumentation key, telemetry is disabled")
 
     return instrumentation_key
 
 
-def get_telemetry_client():
+def percentile(ordered: List[float], fraction: float) -> float:
+    """
+        Returns the nearest-rank percentile of an already sorted list of samples.
+    """
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class MetricAggregate:
+    """
+        Summary of the samples recorded for one metric name during a flush interval.
+    """
+    __slots__ = ('name', 'count', 'sum', 'min', 'max', 'p50', 'p95', 'p99')
+
+    def __init__(self, name: str, samples: List[float]) -> None:
+        ordered = sorted(samples)
+        self.name = name
+        self.count = len(ordered)
+        self.sum = sum(ordered)
+        self.min = ordered[0]
+        self.max = ordered[-1]
+        self.p50 = percentile(ordered, 0.50)
+        self.p95 = percentile(ordered, 0.95)
+        self.p99 = percentile(ordered, 0.99)
+
+    def to_dict(self) -> dict:
+        """
+            Returns the aggregate as a plain dictionary.
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class AppInsightsSink:
+    """
+        Sends aggregates to application insights through one reusable TelemetryClient.
+        The instrumentation key is looked up on the first send, without a key telemetry is discarded.
+    """
+
+    def __init__(self) -> None:
+        self._client = None
+        self._resolved = False
+
+    def client(self):
+        """
+            Returns the shared telemetry client, or None when there is no instrumentation key.
+        """
+        if not self._resolved:
+            # imported on the first flush, workers start without loading the SDK
+            from applicationinsights import TelemetryClient
+
+            key = get_instrumentation_key()
+            self._client = TelemetryClient(key) if key else None
+            self._resolved = True
+        return self._client
+
+    def send(self, aggregates: List[MetricAggregate], exceptions: list) -> None:
+        """
+            Tracks every aggregate and exception and sends them in a single flush.
+        """
+        telemetry_client = self.client()
+        if telemetry_client is None:
+            return
+
+        from applicationinsights.channel.contracts import DataPointType
+
+        for aggregate in aggregates:
+            telemetry_client.track_metric(
+                aggregate.name, aggregate.sum, type=DataPointType.aggregation,
+                count=aggregate.count, min=aggregate.min, max=aggregate.max,
+                properties={'p50': aggregate.p50, 'p95': aggregate.p95, 'p99': aggregate.p99})
+        for exc_type, exc_value, exc_traceback in exceptions:
+            telemetry_client.track_exception(exc_type, exc_value, exc_traceback)
+        telemetry_client.flush()
+
+
+class FileSink:
+    """
+        Appends every flush to a file as one JSON object per line, for running offline.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def send(self, aggregates: List[MetricAggregate], exceptions: list) -> None:
+        """
+            Writes the aggregates and formatted exceptions as a JSON line.
+        """
+        record = {
+            'time': time.time(),
+            'metrics': [aggregate.to_dict() for aggregate in aggregates],
+            'exceptions': [''.join(traceback.format_exception(*exception)) for exception in exceptions],
+        }
+        with open(self.path, 'a', encoding='utf-8') as telemetry_file:
+            telemetry_file.write(json.dumps(record) + '\n')
+
+
+class MemorySink:
+    """
+        Keeps every flush in memory, used in tests.
+    """
+
+    def __init__(self) -> None:
+        self.flushes = []
+
+    def send(self, aggregates: List[MetricAggregate], exceptions: list) -> None:
+        """
+            Stores the aggregates by metric name together with the exceptions.
+        """
+        self.flushes.append(({aggregate.name: aggregate for aggregate in aggregates}, exceptions))
+
+
+class TelemetryPipeline:
     """
-        Returns a telemetry client used to communicate with application insights.
+        Buffers metric samples and exceptions and sends them to a sink in the background.
+        Tracking only appends to a bounded deque, which is thread safe without a lock,
+        when more than max_pending samples arrive between flushes the oldest are discarded.
     """
-    # get the telemetry key for application insights
-    key = get_instrumentation_key()
 
-    if key:
-        return TelemetryClient(key)
+    def __init__(self, sink=None, flush_interval_seconds: float = 30, max_pending: int = 100000) -> None:
+        self.sink = sink
+        self.flush_interval = flush_interval_seconds
+        self._samples = collections.deque(maxlen=max_pending)
+        self._exceptions = collections.deque(maxlen=100)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, flask_app) -> None:
+        """
+            Chooses the sink from the Flask configuration and flushes when the worker exits.
+            TELEMETRY_SINK is one of appinsights, file (TELEMETRY_FILE_PATH), memory or none.
+        """
+        sink_name = flask_app.config.get('TELEMETRY_SINK', 'appinsights')
+        if sink_name == 'appinsights':
+            self.sink = AppInsightsSink()
+        elif sink_name == 'file':
+            self.sink = FileSink(flask_app.config.get('TELEMETRY_FILE_PATH', 'telemetry.jsonl'))
+        elif sink_name == 'memory':
+            self.sink = MemorySink()
+        elif sink_name == 'none':
+            self.sink = None
+        else:
+            raise ValueError(f"Unknown telemetry sink {sink_name!r}")
+
+        self.flush_interval = flask_app.config.get('TELEMETRY_FLUSH_INTERVAL_SECONDS', 30)
+        self._samples = collections.deque(maxlen=flask_app.config.get('TELEMETRY_MAX_PENDING', 100000))
+        flask_app.extensions['telemetry'] = self
+        atexit.register(self.flush)
+
+    def track_metric(self, name: str, value: float) -> None:
+        """
+            Records a metric sample.
+        """
+        self._ensure_started()
+        self._samples.append((name, value))
+
+    def track_exception(self) -> None:
+        """
+            Records the exception currently being handled.
+        """
+        self._ensure_started()
+        self._exceptions.append(sys.exc_info())
+
+    def flush(self) -> None:
+        """
+            Aggregates everything recorded since the last flush and sends it to the sink.
+        """
+        with self._flush_lock:
+            samples: Dict[str, List[float]] = collections.defaultdict(list)
+            for _ in range(len(self._samples)):
+                name, value = self._samples.popleft()
+                samples[name].append(value)
+
+            exceptions = [self._exceptions.popleft() for _ in range(len(self._exceptions))]
+
+            if self.sink is None or not (samples or exceptions):
+                return
+
+            aggregates = [MetricAggregate(name, values) for name, values in samples.items()]
+            try:
+                self.sink.send(aggregates, exceptions)
+            except Exception:
+                logger.exception("Failed to send telemetry")
+
+    def reset_after_fork(self) -> None:
+        """
+            Drops the flusher thread and samples inherited from the parent process, e.g. gunicorn's preloading master.
+        """
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._samples.clear()
+        self._exceptions.clear()
+
+    def _ensure_started(self) -> None:
+        # started lazily so that importing the app does not spawn threads
+        if self._thread is not None:
+            return
+        with self._flush_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='telemetry-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
 
-    return None
+# The process wide telemetry pipeline, bound to the Flask application in register_extensions.
+telemetry = TelemetryPipeline()
+os.register_at_fork(after_in_child=telemetry.reset_after_fork)
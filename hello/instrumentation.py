@@ -0,0 +1,308 @@
+"""
+    Request phase timing for the application.
+    Code is timed with named spans, used as a context manager or a decorator:
+
+        with span('graph'):
+            ...
+
+        @span('render')
+        def render(): ...
+
+    Spans are timed with perf_counter_ns. Inside a Flask request they form a tree on flask.g
+    under the request's root span, which can be returned in a Server-Timing header.
+    Every span duration is recorded in an in-process log-linear (HDR style) histogram per span
+    name, served in the Prometheus text format from /metrics for local scraping.
+"""
+
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import Response, abort, g, has_app_context, request
+
+from hello.insights import telemetry
+
+# Upper bounds, in seconds, of the histogram buckets exported to Prometheus
+EXPORT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                  0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+        Log-linear histogram of nanosecond durations in the style of HdrHistogram.
+        Values below 2 ** significant_bits are counted exactly, larger values in buckets
+        2 ** (significant_bits - 1) per power of two, so every recorded value is known to
+        within 1 / 2 ** (significant_bits - 1) of itself (1.6% with the default 7 bits).
+        Recording is constant time and the memory use is fixed by highest_value_ns.
+    """
+
+    def __init__(self, significant_bits: int = 7, highest_value_ns: int = 3600 * 10 ** 9) -> None:
+        self.significant_bits = significant_bits
+        self.sub_bucket_count = 1 << significant_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.highest_value = highest_value_ns
+        self.counts = [0] * (self.index_of(highest_value_ns) + 1)
+        self.total_count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self._lock = threading.Lock()
+
+    def index_of(self, value: int) -> int:
+        """
+            Returns the index of the bucket counting a value.
+        """
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.significant_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def lowest_value_at(self, index: int) -> int:
+        """
+            Returns the smallest value counted by a bucket.
+        """
+        if index < self.sub_bucket_count:
+            return index
+        shift, offset = divmod(index - self.sub_bucket_count, self.half_count)
+        return (self.half_count + offset) << (shift + 1)
+
+    def highest_value_at(self, index: int) -> int:
+        """
+            Returns the largest value counted by a bucket.
+        """
+        return self.lowest_value_at(index + 1) - 1
+
+    def record(self, value_ns: int) -> None:
+        """
+            Counts a duration, durations above highest_value_ns are counted as highest_value_ns.
+        """
+        value_ns = min(max(value_ns, 0), self.highest_value)
+        index = self.index_of(value_ns)
+        with self._lock:
+            self.counts[index] += 1
+            self.total_count += 1
+            self.total_ns += value_ns
+            if value_ns > self.max_ns:
+                self.max_ns = value_ns
+
+    def value_at_quantile(self, quantile: float) -> int:
+        """
+            Returns the largest value of the bucket holding the nearest-rank quantile, 0 when empty.
+        """
+        with self._lock:
+            counts, total = list(self.counts), self.total_count
+        if not total:
+            return 0
+
+        rank = max(1, int(quantile * total + 0.5))
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return min(self.highest_value_at(index), self.max_ns)
+        return self.max_ns
+
+    def cumulative_counts(self, bounds_ns: List[int]) -> List[int]:
+        """
+            Returns the number of values at or below each of the ascending bounds.
+        """
+        with self._lock:
+            counts = list(self.counts)
+
+        cumulative = []
+        seen = 0
+        index = 0
+        for bound in bounds_ns:
+            last = min(self.index_of(min(bound, self.highest_value)), len(counts) - 1)
+            while index <= last:
+                seen += counts[index]
+                index += 1
+            cumulative.append(seen)
+        return cumulative
+
+
+class MetricsRegistry:
+    """
+        The span duration histograms of this worker, keyed by span name.
+    """
+
+    def __init__(self) -> None:
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        """
+            Returns the histogram of a span name, creating it on first use.
+        """
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+    def items(self) -> List[Tuple[str, Histogram]]:
+        """
+            Returns the (span name, histogram) pairs sorted by name.
+        """
+        with self._lock:
+            return sorted(self._histograms.items())
+
+    def reset(self) -> None:
+        """
+            Drops every histogram, e.g. those recorded by gunicorn's preloading master before it forked the worker.
+        """
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def render_prometheus(self, buckets=EXPORT_BUCKETS) -> str:
+        """
+            Formats the histograms in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP hello_span_duration_seconds Duration of instrumented code spans.',
+            '# TYPE hello_span_duration_seconds histogram',
+        ]
+        bounds_ns = [int(bound * 1e9) for bound in buckets]
+        for name, histogram in self.items():
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            for bound, count in zip(buckets, histogram.cumulative_counts(bounds_ns)):
+                lines.append(f'hello_span_duration_seconds_bucket{{span="{label}",le="{bound}"}} {count}')
+            lines.append(f'hello_span_duration_seconds_bucket{{span="{label}",le="+Inf"}} {histogram.total_count}')
+            lines.append(f'hello_span_duration_seconds_sum{{span="{label}"}} {histogram.total_ns / 1e9}')
+            lines.append(f'hello_span_duration_seconds_count{{span="{label}"}} {histogram.total_count}')
+        return '\n'.join(lines) + '\n'
+
+
+# The span histograms of this worker
+metrics = MetricsRegistry()
+os.register_at_fork(after_in_child=metrics.reset)
+
+
+class span(ContextDecorator):
+    """
+        Times a named block of code, as a context manager or as a decorator.
+        metric optionally names an application insights metric the duration is also sent to, in milliseconds.
+    """
+
+    def __init__(self, name: str, metric: Optional[str] = None) -> None:
+        self.name = name
+        self.metric = metric
+        self.start_ns = 0
+        self.end_ns = 0
+        self.children: List['span'] = []
+
+    @property
+    def duration_ns(self) -> int:
+        """
+            The duration of the span, up to now while it is open.
+        """
+        return (self.end_ns or time.perf_counter_ns()) - self.start_ns
+
+    def __enter__(self) -> 'span':
+        if has_app_context():
+            stack = g.setdefault('span_stack', [])
+            if stack:
+                stack[-1].children.append(self)
+            stack.append(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.end_ns = time.perf_counter_ns()
+        duration = self.end_ns - self.start_ns
+        metrics.histogram(self.name).record(duration)
+        if self.metric:
+            telemetry.track_metric(self.metric, duration / 1e6)
+
+        if has_app_context():
+            stack = g.get('span_stack')
+            if stack and stack[-1] is self:
+                stack.pop()
+
+    def _recreate_cm(self) -> 'span':
+        # a decorated function may run in several threads at once, each call times its own span
+        return span(self.name, self.metric)
+
+    def walk(self, depth: int = 0) -> Iterator[Tuple[int, 'span']]:
+        """
+            Yields (depth, span) for the span and its descendants, depth first.
+        """
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+def server_timing(root: span) -> str:
+    """
+        Formats a span tree as a Server-Timing header value, durations in milliseconds.
+    """
+    entries = []
+    for _, timed in root.walk():
+        name = ''.join(char if char.isalnum() or char in '-_.' else '_' for char in timed.name)
+        entries.append(f"{name};dur={timed.duration_ns / 1e6:.3f}")
+    return ', '.join(entries)
+
+
+class Instrumentation:
+    """
+        Opens a root span around every Flask request, adds the Server-Timing header and serves /metrics.
+    """
+
+    def __init__(self, server_timing_enabled: bool = False, metrics_addresses=('127.0.0.1', '::1')) -> None:
+        self.server_timing = server_timing_enabled
+        self.metrics_addresses = frozenset(metrics_addresses)
+
+    def init_app(self, flask_app) -> None:
+        """
+            Registers the request hooks and the /metrics route.
+            SERVER_TIMING_ENABLED adds the header to every response, METRICS_ALLOWED_ADDRESSES lists
+            the client addresses /metrics answers, an empty list serves everyone.
+        """
+        self.server_timing = flask_app.config.get('SERVER_TIMING_ENABLED', False)
+        self.metrics_addresses = frozenset(flask_app.config.get('METRICS_ALLOWED_ADDRESSES', ['127.0.0.1', '::1']))
+
+        flask_app.before_request(self._start_request)
+        flask_app.after_request(self._finish_request)
+        flask_app.teardown_request(self._teardown_request)
+        flask_app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        flask_app.extensions['instrumentation'] = self
+
+    def metrics_view(self) -> Response:
+        """
+            Serves the span histograms in the Prometheus text format.
+        """
+        if self.metrics_addresses and request.remote_addr not in self.metrics_addresses:
+            abort(404)
+        return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    @staticmethod
+    def request_span() -> Optional[span]:
+        """
+            Returns the root span of the current request.
+        """
+        return g.get('request_span')
+
+    def _start_request(self) -> None:
+        root = span(f"request.{request.endpoint or 'unknown'}")
+        root.__enter__()
+        g.request_span = root
+
+    def _finish_request(self, response):
+        root = g.pop('request_span', None)
+        if root is not None:
+            root.__exit__(None, None, None)
+            if self.server_timing:
+                response.headers['Server-Timing'] = server_timing(root)
+        return response
+
+    @staticmethod
+    def _teardown_request(_) -> None:
+        # requests that raised skip after_request, their root span is still recorded
+        root = g.pop('request_span', None)
+        if root is not None:
+            root.__exit__(None, None, None)
+
+
+# The process wide instrumentation, bound to the Flask application in register_extensions.
+instrumentation = Instrumentation()
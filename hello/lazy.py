@@ -0,0 +1,68 @@
+"""
+    Deferred configuration values.
+    Settings that are expensive to resolve, like the Key Vault secrets, are stored in the
+    Flask configuration as LazyValue placeholders and resolved the first time they are read,
+    so importing the application and creating it makes no network calls.
+"""
+
+import threading
+
+from flask import Config
+
+
+class LazyValue:
+    """
+        A configuration value computed by loader on first use and cached afterwards.
+    """
+    __slots__ = ('loader', '_value', '_resolved', '_lock')
+
+    def __init__(self, loader) -> None:
+        self.loader = loader
+        self._value = None
+        self._resolved = False
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """
+            Returns the value, calling the loader when it has not been resolved yet.
+        """
+        if not self._resolved:
+            with self._lock:
+                if not self._resolved:
+                    self._value = self.loader()
+                    self._resolved = True
+        return self._value
+
+    def __repr__(self) -> str:
+        return f"<LazyValue {'resolved' if self._resolved else 'unresolved'}>"
+
+
+def resolve(value):
+    """
+        Returns the value of a setting that may be a LazyValue.
+    """
+    return value.resolve() if isinstance(value, LazyValue) else value
+
+
+class LazyConfig(Config):
+    """
+        Flask configuration resolving LazyValue settings when they are read.
+        Membership tests and setdefault do not resolve a value, so extensions checking
+        whether a setting exists at init_app time leave it deferred.
+    """
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, LazyValue):
+            value = value.resolve()
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
@@ -6,27 +6,79 @@
 
 import datetime
 
-from hello.database import db
+from psycopg2.extras import execute_values
+
+from hello.catalog import CATEGORY_CLASSES, DEFAULT_CATEGORY_CLASS, document_catalog
+from hello.database import call_procedure, db, replica_router, transaction
+from hello.dimensions import visitor_dimensions
 
 # pylint: disable=no-member
 # Disabling no-member checking during testing as SQLAlchemy adds database members on the db object during runtime.
 
+class VisitorCountry(db.Model):
+    """
+        A country visitors came from, referenced by visitor.country_id.
+    """
+    __tablename__ = 'visitor_country'
+
+    id = db.Column(db.SmallInteger, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+
+
+class VisitorBrowser(db.Model):
+    """
+        A browser and version visitors used, referenced by visitor.browser_id.
+    """
+    __tablename__ = 'visitor_browser'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Text, nullable=False, unique=True)
+
+
+class VisitorOperatingSystem(db.Model):
+    """
+        An operating system visitors used, referenced by visitor.operating_system_id.
+    """
+    __tablename__ = 'visitor_operating_system'
+
+    id = db.Column(db.SmallInteger, primary_key=True)
+    name = db.Column(db.Text, nullable=False, unique=True)
+
+
 class Visitor(db.Model):
     """
         This class represents a database table for a website's Visitor session.
         The fields represent column names in the table.
+        country, browser and operating_system are stored as ids into their dimension tables, see dimensions.py,
+        and read back as names.
         create_ creates an instance of the class to be used in adding a new row
         save_   saves a visitor instance using stored functions in the database
     """
     __tablename__ = 'visitor'
 
+    # the table is partitioned by month on date_visited, see partitions.py
+    __table_args__ = (
+        db.Index('ix_visitor_date_visited_brin', 'date_visited', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (date_visited)'},
+    )
+
     # comments on class fields
-    pk = db.Column(db.Integer, primary_key=True)
+    # the partition key is part of the primary key, pk alone is still unique as it comes from a sequence
+    pk = db.Column(db.Integer, db.Sequence('visitor_pk_seq'), primary_key=True)
     
-    country = db.Column(db.String(100), unique=False, nullable=True)
-    browser = db.Column(db.Text, unique=False, nullable=True)
-    operating_system = db.Column(db.Text, unique=False, nullable=True)
-    date_visited = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    country_id = db.Column(db.SmallInteger, db.ForeignKey('visitor_country.id'), nullable=True)
+    browser_id = db.Column(db.Integer, db.ForeignKey('visitor_browser.id'), nullable=True)
+    operating_system_id = db.Column(db.SmallInteger, db.ForeignKey('visitor_operating_system.id'), nullable=True)
+    date_visited = db.Column(db.DateTime, primary_key=True, default=datetime.datetime.utcnow,
+                             server_default=db.func.now())
+
+    # the names behind the ids, loaded with a visitor, and set by the constructor for the ids to be looked up
+    country = db.column_property(
+        db.select([VisitorCountry.name]).where(VisitorCountry.id == country_id).as_scalar())
+    browser = db.column_property(
+        db.select([VisitorBrowser.name]).where(VisitorBrowser.id == browser_id).as_scalar())
+    operating_system = db.column_property(
+        db.select([VisitorOperatingSystem.name]).where(VisitorOperatingSystem.id == operating_system_id).as_scalar())
 
     def __init__(self, country: str = '', browser: str = '', operating_system: str = '') -> None:
         # Initializes a new visitor object using the properties defined in the model
@@ -52,34 +104,114 @@ class Visitor(db.Model):
             Saves a new database visitor.
             Calls a stored procedure created during deployment as seen in the functions.sql file.
         """
-        
-        # get the database connection and cursor
-        connection = db.engine.raw_connection()
-        cursor = connection.cursor()
+        # the dimension ids are cached per worker, the tables are only queried for values not seen before
+        country_id, browser_id, operating_system_id = visitor_dimensions.ids([visitor])[0]
 
-        # call the stored procedure with the visitor objects properties to insert a new visitor row
-        cursor.callproc(
-            "insert_visitor", [
-                visitor.country, visitor.browser, visitor.operating_system])
-        connection.commit()
+        # check a connection out of the pool, it is committed and returned when the block exits
+        with transaction() as cursor:
+            # call the stored procedure with the visitor objects properties to insert a new visitor row
+            call_procedure(
+                cursor, "insert_visitor_ids", [country_id, browser_id, operating_system_id])
 
+    @staticmethod
+    def save_many_(visitors) -> None:
+        """
+            Saves a batch of visitors using a single multi-row insert and one commit.
+            Used by the write-behind queue in visitor_queue.py to drain buffered page views.
+        """
+        visitors = list(visitors)
+        rows = [ids + (visitor.date_visited,) for ids, visitor in zip(visitor_dimensions.ids(visitors), visitors)]
 
+        with transaction() as cursor:
+            execute_values(
+                cursor,
+                "INSERT INTO visitor (country_id, browser_id, operating_system_id, date_visited) VALUES %s",
+                rows,
+                template="(%s, %s, %s, COALESCE(%s, NOW()))",
+                page_size=len(rows))
 
     def __repr__(self) -> str:
         # Return a string representation of the visitor model
         return "<Visitor: {}>".format(self.date_visited.ctime())
 
 
+class VisitorHourlyRollup(db.Model):
+    """
+        Number of visits per hour, country, browser and operating system.
+        Maintained incrementally from the visitor table by rollups.py.
+    """
+    __tablename__ = 'visitor_hourly_rollup'
+
+    bucket = db.Column(db.DateTime, primary_key=True)
+    country = db.Column(db.String(100), primary_key=True)
+    browser = db.Column(db.Text, primary_key=True)
+    operating_system = db.Column(db.Text, primary_key=True)
+    visits = db.Column(db.BigInteger, nullable=False)
+
+
+class VisitorDailyRollup(db.Model):
+    """
+        Number of visits per day, country, browser and operating system.
+        Maintained incrementally from the visitor table by rollups.py.
+    """
+    __tablename__ = 'visitor_daily_rollup'
+
+    bucket = db.Column(db.Date, primary_key=True)
+    country = db.Column(db.String(100), primary_key=True)
+    browser = db.Column(db.Text, primary_key=True)
+    operating_system = db.Column(db.Text, primary_key=True)
+    visits = db.Column(db.BigInteger, nullable=False)
+
+
+class RollupWatermark(db.Model):
+    """
+        The last visitor primary key included in the rollup tables.
+    """
+    __tablename__ = 'rollup_watermark'
+
+    name = db.Column(db.String(100), primary_key=True)
+    last_pk = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class DeploymentState(db.Model):
+    """
+        A named value recorded by the startup step in startup.py, e.g. the version of the last seeded catalog.
+    """
+    __tablename__ = 'deployment_state'
+
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+class HttpSession(db.Model):
+    """
+        A server-side session, stored under a hash of the id in its cookie.
+        Read and written by the postgres backend in sessions.py.
+    """
+    __tablename__ = 'http_session'
+
+    key = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    # expired sessions are deleted in batches in expires_at order
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+
 class AzureDocument(db.Model):
     """
         Model representing an Azure document resource.
         Calls a stored procedure created during deployment as seen in the functions.sql file.
     """
     __tablename__ = 'azure_document'
+    # keyset pages of a category, the title search index is created by migration c3e91f5a7d20 only,
+    # as its expression is PostgreSQL specific
+    __table_args__ = (db.Index('ix_azure_document_category_pk', 'category', 'pk'),)
 
     pk = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.Text, nullable=True)
-    url = db.Column(db.Text, nullable=True)
+    # looked up by catalog_sync.py, one keyed query per batch of the synced file
+    url = db.Column(db.Text, nullable=True, index=True)
     category = db.Column(db.String(100), nullable=True)
 
     def __init__(self, title: str = '', url: str = '', category: str = ''):
@@ -104,38 +236,67 @@ class AzureDocument(db.Model):
         """
             Stores an azure document using stored procedures.
         """
-        # retrieve the database connection and cursor
-        connection = db.engine.raw_connection()
-        cursor = connection.cursor()
+        with transaction() as cursor:
+            # call the stored function to insert a new document row
+            call_procedure(
+                cursor, "insert_azure_document", [
+                    azure_document.title, azure_document.url, azure_document.category])
+
+            # the other workers drop their cached catalog once the insert commits
+            document_catalog.notify(cursor)
+
+        document_catalog.invalidate()
+
+    @staticmethod
+    def load_rows():
+        """
+            Returns (pk, title, url, category) tuples for every stored document.
+            Used by the document catalog cache, skips building ORM instances. Read from a replica when one is current.
+        """
+        query = AzureDocument.query.with_entities(
+            AzureDocument.pk, AzureDocument.title, AzureDocument.url, AzureDocument.category
+        ).order_by(AzureDocument.pk)
+        with replica_router.connect() as connection:
+            return connection.execute(query.statement).fetchall()
 
-        # call the stored function to insert a new document row
-        cursor.callproc(
-            "insert_azure_document", [
-                azure_document.title, azure_document.url, azure_document.category])
-        connection.commit()
+    @staticmethod
+    def query_rows(category: str = '', search: str = '', after: int = 0, limit: int = 50):
+        """
+            Returns up to limit (pk, title, url, category) tuples with a pk above after, in pk order,
+            optionally of one category and with titles matching every word of search.
+            Served by the (category, pk) index and the GIN index on the title's tsvector, on a replica when one is current.
+        """
+        query = AzureDocument.query.with_entities(
+            AzureDocument.pk, AzureDocument.title, AzureDocument.url, AzureDocument.category
+        ).filter(AzureDocument.pk > after)
+        if category:
+            query = query.filter(AzureDocument.category == category)
+        if search:
+            # the expression of ix_azure_document_title_search
+            english = db.literal_column("'english'")
+            document = db.func.to_tsvector(english, db.func.coalesce(AzureDocument.title, ''))
+            query = query.filter(document.op('@@')(db.func.plainto_tsquery(english, search)))
+        with replica_router.connect() as connection:
+            return connection.execute(query.order_by(AzureDocument.pk).limit(limit).statement).fetchall()
 
     @staticmethod
     def get_grouped_documents():
         """
-            Returns all the documents stored in the database.
+            Returns the stored documents grouped by category, each group in pk order.
+            Served from the per worker document catalog cache in catalog.py.
         """
-        # query the database and returns all saved documents
-        return AzureDocument.query.all()
+        grouped = {}
+        for document in document_catalog.documents():
+            grouped.setdefault(document.category, []).append(document)
+        return grouped
 
     @property
     def category_class(self):
         """
             Gets a css class name based on the document category.
         """
-        # Assign document categories a css class name
-        classes = {
-            "Azure Technical Overviews": "is-info",
-            "Azure Whitepapers": "is-dark",
-            "Azure Best Practices": "is-warning"
-        }
-
         # return matching class name for category
-        return classes.get(self.category, "is-light")
+        return CATEGORY_CLASSES.get(self.category, DEFAULT_CATEGORY_CLASS)
 
     def __repr__(self) -> str:
         # Returns a string representation of the Azure Document model
@@ -0,0 +1,174 @@
+"""
+    Monthly partitions of the visitor table.
+    visitor is range partitioned on date_visited, one partition per calendar month named
+    visitor_yYYYYmMM, plus a default partition that catches visits no monthly partition covers yet.
+    maintain_partitions creates the partitions of the coming months ahead of time and detaches the
+    months older than the retention period, dropping them or moving them to the visitor_archive schema.
+    The container start runs it from startup.py when a partition is missing or has expired, long running
+    deployments also run flask partitions on a schedule, e.g. daily.
+"""
+
+import datetime
+import re
+from typing import Dict, List, Optional
+
+from hello.database import transaction
+
+# Name of the partition receiving visits outside every monthly partition
+DEFAULT_PARTITION = 'visitor_default'
+
+# Schema expired partitions are moved to when they are archived
+ARCHIVE_SCHEMA = 'visitor_archive'
+
+PARTITION_NAME = re.compile(r'^visitor_y(\d{4})m(\d{2})$')
+
+# What to do with partitions older than the retention period
+RETENTION_ACTIONS = ('archive', 'drop')
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    """
+        Returns the first day of the month of a date.
+    """
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    """
+        Returns the first day of the month a number of months after the month of a date.
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    """
+        Returns the name of the partition holding the visits of a month.
+    """
+    return f"visitor_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partition(table_name: str) -> bool:
+    """
+        Whether a table is a partition of visitor rather than a table of the models,
+        used to keep flask db migrate from dropping them.
+    """
+    return table_name == DEFAULT_PARTITION or PARTITION_NAME.match(table_name) is not None
+
+
+def expired_partitions(partitions: Dict[datetime.date, str], retention_months: int,
+                       today: datetime.date) -> List[str]:
+    """
+        Returns the partitions whose whole month lies before the retention period, oldest first.
+        A retention of 0 months keeps every partition.
+    """
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(today), -retention_months)
+    return [name for month, name in sorted(partitions.items()) if add_months(month, 1) <= cutoff]
+
+
+def missing_months(partitions: Dict[datetime.date, str], months_ahead: int,
+                   today: datetime.date) -> List[datetime.date]:
+    """
+        Returns the first days of the current month and the months_ahead months after it that have no partition.
+    """
+    current = month_start(today)
+    return [month for month in (add_months(current, offset) for offset in range(months_ahead + 1))
+            if month not in partitions]
+
+
+def list_partitions(cursor) -> Dict[datetime.date, str]:
+    """
+        Returns the monthly partitions attached to visitor, keyed by the first day of their month.
+    """
+    cursor.execute("""
+        SELECT child.relname
+          FROM pg_inherits
+          JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+          JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+         WHERE parent.relname = 'visitor' AND parent.relnamespace = 'public'::regnamespace
+    """)
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime.date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def move_rows_statement(name: str) -> str:
+    """
+        Returns the statement moving a month's rows from the default partition into the partition name,
+        listing the visitor model's columns so it follows the table as the migrations change it.
+    """
+    # imported here, the models import the database layer this module is loaded with
+    from hello.models import Visitor
+
+    columns = ', '.join(column.name for column in Visitor.__table__.columns)
+    return f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+             WHERE date_visited >= %(lower)s AND date_visited < %(upper)s
+         RETURNING {columns}
+        )
+        INSERT INTO {name} ({columns})
+        SELECT {columns} FROM moved
+    """
+
+
+def create_partition(cursor, month: datetime.date) -> str:
+    """
+        Creates and attaches the partition of a month, moving the month's rows out of the default partition.
+        From PostgreSQL 12 attaching only locks visitor against other schema changes, visits keep being inserted.
+    """
+    name = partition_name(month)
+    lower, upper = month, add_months(month, 1)
+
+    cursor.execute(f"CREATE TABLE {name} (LIKE visitor INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(move_rows_statement(name), {'lower': lower, 'upper': upper})
+    cursor.execute(
+        f"ALTER TABLE visitor ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [lower, upper])
+    return name
+
+
+def ensure_partitions(cursor, months_ahead: int, today: Optional[datetime.date] = None) -> List[str]:
+    """
+        Creates the missing partitions of the current month and the months_ahead months after it.
+        Returns the names of the partitions created.
+    """
+    missing = missing_months(list_partitions(cursor), months_ahead, today or datetime.date.today())
+    return [create_partition(cursor, month) for month in missing]
+
+
+def apply_retention(cursor, retention_months: int, action: str = 'archive',
+                    today: Optional[datetime.date] = None) -> List[str]:
+    """
+        Detaches the partitions older than retention_months and archives or drops them.
+        Returns the names of the partitions removed from visitor.
+    """
+    if action not in RETENTION_ACTIONS:
+        raise ValueError(f"Unknown retention action {action}, expected one of {', '.join(RETENTION_ACTIONS)}")
+
+    expired = expired_partitions(list_partitions(cursor), retention_months, today or datetime.date.today())
+    if expired and action == 'archive':
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+
+    for name in expired:
+        cursor.execute(f"ALTER TABLE visitor DETACH PARTITION {name}")
+        if action == 'archive':
+            cursor.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+        else:
+            cursor.execute(f"DROP TABLE {name}")
+    return expired
+
+
+def maintain_partitions(months_ahead: int = 3, retention_months: int = 0, action: str = 'archive') -> dict:
+    """
+        Creates the upcoming partitions and applies the retention policy in one transaction.
+        Must be called inside an application context.
+    """
+    with transaction() as cursor:
+        created = ensure_partitions(cursor, months_ahead)
+        expired = apply_retention(cursor, retention_months, action)
+    return {'created': created, 'expired': expired}
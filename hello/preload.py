@@ -0,0 +1,51 @@
+"""
+    Warm up of the application in gunicorn's master process, used with preload_app in gunicorn.conf.py.
+    The document catalog, the rendered index page fragments, the compiled templates and the
+    GeoIP database are loaded once before the workers are forked, so every worker starts with
+    them already in memory and shares the pages copy-on-write instead of loading its own copy.
+"""
+
+import gc
+import logging
+from timeit import default_timer
+
+from hello.catalog import document_catalog
+from hello.database import db, replica_router
+from hello.geoip import geoip
+from hello.rendering import index_page
+
+logger = logging.getLogger(__name__)
+
+# Templates compiled ahead of the first request
+TEMPLATES = ('index.html', '_document_card.html', 'intermediate.html')
+
+
+def warm_up(flask_app) -> float:
+    """
+        Loads everything the workers share, then closes the master's database connections.
+        Failures are logged and left to the workers, which load the same things lazily.
+        Returns the time taken in seconds.
+    """
+    warm_up_start = default_timer()
+
+    for template in TEMPLATES:
+        flask_app.jinja_env.get_template(template)
+    geoip.reader()
+
+    try:
+        with flask_app.test_request_context('/'):
+            snapshot = document_catalog.snapshot()
+            if index_page.enabled and snapshot.documents:
+                index_page.page(snapshot)
+    except Exception:
+        logger.exception("Could not preload the document catalog, workers will load it on first use")
+    finally:
+        # connections must not be shared with the forked workers, each opens its own
+        with flask_app.app_context():
+            db.engine.dispose()
+        replica_router.dispose()
+
+    # objects that survive the warm up are never collected, keeping the collector from
+    # touching, and so copying, the pages the workers share with the master
+    gc.freeze()
+    return default_timer() - warm_up_start
@@ -0,0 +1,163 @@
+"""
+    Fragment cache for the index page.
+    The document grid is the same for every visitor apart from its order, so each document
+    card and the page around the grid are rendered once per catalog version. A request only
+    shuffles the card fragments and splices in the signed in user's name.
+    When INDEX_GZIP is set every fragment is also kept deflate compressed, and gzip responses
+    are assembled from the compressed fragments without compressing the page again.
+"""
+
+import random
+import struct
+import threading
+import uuid
+import zlib
+from typing import List, NamedTuple
+
+from flask import Response, current_app, render_template, request
+from markupsafe import Markup, escape
+
+# Compression level used once per fragment, the cost is paid once per catalog version
+GZIP_LEVEL = 9
+
+# gzip member header: magic, deflate, no flags, no modification time, max compression, unknown OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff'
+
+# An empty, final deflate block that ends a stream of sync flushed fragments
+DEFLATE_END = b'\x03\x00'
+
+
+def deflate_fragment(data: bytes) -> bytes:
+    """
+        Compresses data into raw deflate blocks that can be followed by other fragments.
+        The sync flush ends the fragment on a byte boundary without marking the stream final.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class Fragment(NamedTuple):
+    """
+        A piece of the index page, as utf-8 bytes and as deflate blocks.
+    """
+    raw: bytes
+    deflated: bytes
+
+
+def fragment(html: str, compress: bool) -> Fragment:
+    """
+        Encodes a piece of the page, compressing it when gzip responses are enabled.
+    """
+    raw = html.encode('utf-8')
+    return Fragment(raw, deflate_fragment(raw) if compress else b'')
+
+
+class RenderedPage(NamedTuple):
+    """
+        The index page of one catalog version split around the user's name and the document cards.
+    """
+    version: str
+    head: Fragment
+    middle: Fragment
+    tail: Fragment
+    cards: List[Fragment]
+
+
+class _Placeholder:
+    """
+        Stands in for the signed in user while the page shell is rendered.
+    """
+    def __init__(self, display_name: str) -> None:
+        self.displayName = display_name
+
+
+class IndexPageRenderer:
+    """
+        Renders the index page from fragments cached per catalog version.
+    """
+
+    def __init__(self, enabled: bool = True, gzip: bool = True) -> None:
+        self.enabled = enabled
+        self.gzip = gzip
+        self._page = None
+        self._lock = threading.Lock()
+
+    def init_app(self, flask_app) -> None:
+        """
+            Configures the renderer from the Flask configuration.
+            INDEX_RENDER_MODE is fragments or template, the latter renders index.html on every request.
+        """
+        self.enabled = flask_app.config.get('INDEX_RENDER_MODE', 'fragments') == 'fragments'
+        self.gzip = flask_app.config.get('INDEX_GZIP', True)
+        flask_app.extensions['index_page'] = self
+
+    def render(self, snapshot, user) -> Response:
+        """
+            Returns the index page for a catalog snapshot with the cards in random order.
+            Must be called inside a request context.
+        """
+        if not snapshot.documents:
+            # the empty catalog message is rare and cheap to render
+            return Response(render_template("index.html", documents=[], user=user))
+
+        page = self.page(snapshot)
+        use_gzip = self.gzip and 'gzip' in request.headers.get('Accept-Encoding', '')
+
+        # only the user's name is compressed per request
+        name = fragment(str(escape(getattr(user, 'displayName', ''))), use_gzip)
+        parts = [page.head, name, page.middle] + random.sample(page.cards, len(page.cards)) + [page.tail]
+
+        if use_gzip:
+            response = Response(self._gzip(parts), mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(b''.join(part.raw for part in parts), mimetype='text/html')
+
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def page(self, snapshot) -> RenderedPage:
+        """
+            Returns the rendered fragments of a catalog snapshot, rendering them on first use.
+        """
+        page = self._page
+        if page is not None and page.version == snapshot.version:
+            return page
+
+        with self._lock:
+            if self._page is None or self._page.version != snapshot.version:
+                self._page = self._render_page(snapshot)
+            return self._page
+
+    def _render_page(self, snapshot) -> RenderedPage:
+        card_template = current_app.jinja_env.get_template("_document_card.html")
+        cards = [fragment(card_template.render(document=document) + '\n', self.gzip)
+                 for document in snapshot.documents]
+
+        # render the page once with markers where the user's name and the cards go
+        user_marker = uuid.uuid4().hex
+        cards_marker = uuid.uuid4().hex
+        shell = render_template(
+            "index.html", documents=snapshot.documents, user=_Placeholder(user_marker),
+            cards=Markup(cards_marker))
+        head, rest = shell.split(user_marker, 1)
+        middle, tail = rest.split(cards_marker, 1)
+
+        return RenderedPage(
+            snapshot.version, fragment(head, self.gzip), fragment(middle, self.gzip),
+            fragment(tail, self.gzip), cards)
+
+    @staticmethod
+    def _gzip(parts: List[Fragment]) -> bytes:
+        checksum = 0
+        size = 0
+        for part in parts:
+            checksum = zlib.crc32(part.raw, checksum)
+            size += len(part.raw)
+
+        trailer = struct.pack('<II', checksum, size & 0xffffffff)
+        return b''.join([GZIP_HEADER] + [part.deflated for part in parts] + [DEFLATE_END, trailer])
+
+
+# The process wide index page renderer, configured in register_extensions.
+index_page = IndexPageRenderer()
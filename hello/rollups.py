@@ -0,0 +1,174 @@
+"""
+    Incremental visitor rollups for the analytics dashboards.
+    Visits are counted per hour and per day, country, browser and operating system names in
+    visitor_hourly_rollup and visitor_daily_rollup, so dashboards read a few thousand
+    rows instead of scanning the visitor table.
+    The aggregator only reads visitors with a primary key above the watermark stored in
+    rollup_watermark, in ranges of batch_size keys, and moves the watermark in the same
+    transaction as the counts, so every visitor is counted exactly once.
+    Keys are only rolled up once every transaction that could still insert one of them has finished.
+    Each run records the visitor key sequence's position as the horizon, and keys up to a horizon
+    recorded SETTLE_SECONDS ago count as settled. This follows the order keys are handed out in,
+    whereas date_visited is stamped when a page view is queued, see visitor_queue.py, and a row
+    flushed late would carry an old date with a new key.
+    Run it with flask rollup, once or with --interval to keep the rollups up to date.
+"""
+
+from timeit import default_timer
+from typing import Iterator, List, Tuple
+
+from hello.database import read_transaction, transaction
+
+# The watermark row of the visitor rollups
+WATERMARK = 'visitor'
+
+# The rollup_watermark row holding the key sequence's position when it was last recorded
+HORIZON = 'visitor_horizon'
+
+# Keys handed out more recently are left for a later run. Keys are assigned when a row is inserted
+# but rows become visible when they commit, so a recent key may still have a smaller uncommitted neighbour.
+# Visitor inserts are single statement transactions, they finish well within this time.
+SETTLE_SECONDS = 300
+
+# Dimensions a dashboard can group the rollups by
+DIMENSIONS = ('country', 'browser', 'operating_system')
+
+# Rollup table and the expression truncating date_visited to its bucket, per granularity
+GRANULARITIES = {
+    'hour': ('visitor_hourly_rollup', "date_trunc('hour', date_visited)"),
+    'day': ('visitor_daily_rollup', "date_visited::date"),
+}
+
+
+def pk_ranges(last_pk: int, upper_pk: int, batch_size: int) -> Iterator[Tuple[int, int]]:
+    """
+        Splits the keys above last_pk up to and including upper_pk into (exclusive, inclusive] ranges.
+    """
+    while last_pk < upper_pk:
+        end = min(last_pk + batch_size, upper_pk)
+        yield last_pk, end
+        last_pk = end
+
+
+def read_watermark(cursor, lock: bool = False) -> int:
+    """
+        Returns the last visitor key included in the rollups, creating the watermark when missing.
+        With lock the watermark row stays locked until the transaction ends, so only one aggregator runs at a time.
+    """
+    cursor.execute(
+        "INSERT INTO rollup_watermark (name, last_pk, updated_at) VALUES (%s, 0, NOW()) "
+        "ON CONFLICT (name) DO NOTHING", [WATERMARK])
+    cursor.execute(
+        "SELECT last_pk FROM rollup_watermark WHERE name = %s" + (" FOR UPDATE" if lock else ""),
+        [WATERMARK])
+    return cursor.fetchone()[0]
+
+
+def settled_pk(cursor, last_pk: int, settle_seconds: int) -> int:
+    """
+        Returns the largest visitor key whose inserting transaction has finished, at least last_pk.
+        That is the horizon recorded settle_seconds or more ago, which is then replaced by the
+        sequence's current position. Until the horizon is that old, last_pk is returned.
+    """
+    cursor.execute(
+        "INSERT INTO rollup_watermark (name, last_pk, updated_at) SELECT %s, last_value, NOW() FROM visitor_pk_seq "
+        "ON CONFLICT (name) DO NOTHING", [HORIZON])
+    cursor.execute(
+        "SELECT last_pk, updated_at < NOW() - make_interval(secs => %s) FROM rollup_watermark "
+        "WHERE name = %s FOR UPDATE", [settle_seconds, HORIZON])
+    horizon, settled = cursor.fetchone()
+    if not settled:
+        return last_pk
+
+    cursor.execute(
+        "UPDATE rollup_watermark SET last_pk = (SELECT last_value FROM visitor_pk_seq), updated_at = NOW() "
+        "WHERE name = %s", [HORIZON])
+    return max(horizon, last_pk)
+
+
+def rollup_range(cursor, first_pk: int, last_pk: int) -> None:
+    """
+        Adds the visitors with keys in (first_pk, last_pk] to the hourly and daily rollups
+        and moves the watermark to last_pk.
+    """
+    for table, bucket in GRANULARITIES.values():
+        # grouped by the dimension ids first, so only one row per group is joined to the dimension names
+        cursor.execute(f"""
+            INSERT INTO {table} (bucket, country, browser, operating_system, visits)
+            SELECT counts.bucket, COALESCE(country.name, 'N/A'), COALESCE(browser.name, 'N/A'),
+                   COALESCE(operating_system.name, 'N/A'), SUM(counts.visits)
+              FROM (SELECT {bucket} AS bucket, country_id, browser_id, operating_system_id, COUNT(*) AS visits
+                      FROM visitor
+                     WHERE pk > %s AND pk <= %s
+                     GROUP BY 1, 2, 3, 4) AS counts
+              LEFT JOIN visitor_country AS country ON country.id = counts.country_id
+              LEFT JOIN visitor_browser AS browser ON browser.id = counts.browser_id
+              LEFT JOIN visitor_operating_system AS operating_system ON operating_system.id = counts.operating_system_id
+             GROUP BY 1, 2, 3, 4
+                ON CONFLICT (bucket, country, browser, operating_system)
+                DO UPDATE SET visits = {table}.visits + EXCLUDED.visits
+        """, [first_pk, last_pk])
+
+    cursor.execute(
+        "UPDATE rollup_watermark SET last_pk = %s, updated_at = NOW() WHERE name = %s",
+        [last_pk, WATERMARK])
+
+
+def run_rollup(batch_size: int = 50000, settle_seconds: int = SETTLE_SECONDS, progress=None) -> dict:
+    """
+        Rolls up the settled visitors above the watermark, one transaction per key range.
+        A run finds no settled keys while the last recorded horizon is younger than settle_seconds.
+        progress is called after every range with the keys processed so far and the elapsed seconds.
+        Must be called inside an application context.
+    """
+    with transaction() as cursor:
+        last_pk = read_watermark(cursor)
+        upper_pk = settled_pk(cursor, last_pk, settle_seconds)
+
+    rollup_start = default_timer()
+    ranges = 0
+    for first_pk, end_pk in pk_ranges(last_pk, upper_pk, batch_size):
+        with transaction() as cursor:
+            # another aggregator may have moved the watermark while this one waited for the lock
+            if read_watermark(cursor, lock=True) != first_pk:
+                break
+            rollup_range(cursor, first_pk, end_pk)
+        ranges += 1
+        if progress:
+            progress(end_pk - last_pk, default_timer() - rollup_start)
+
+    return {'from_pk': last_pk, 'to_pk': upper_pk, 'ranges': ranges,
+            'seconds': default_timer() - rollup_start}
+
+
+def reset_rollups() -> None:
+    """
+        Empties the rollup tables and moves the watermark back to the first visitor, for a full backfill.
+        Must be called inside an application context.
+    """
+    with transaction() as cursor:
+        read_watermark(cursor, lock=True)
+        cursor.execute("TRUNCATE visitor_hourly_rollup, visitor_daily_rollup")
+        cursor.execute(
+            "UPDATE rollup_watermark SET last_pk = 0, updated_at = NOW() WHERE name = %s", [WATERMARK])
+
+
+def visits_by(dimension: str, since, granularity: str = 'day') -> List[Tuple]:
+    """
+        Returns (bucket, value, visits) rows of the visits since a date grouped by one dimension,
+        read from the rollup of the given granularity, on a read replica when one is current.
+        Must be called inside an application context.
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension {dimension}, expected one of {', '.join(DIMENSIONS)}")
+    table, _ = GRANULARITIES[granularity]
+
+    with read_transaction() as cursor:
+        cursor.execute(f"""
+            SELECT bucket, {dimension}, SUM(visits) AS visits
+              FROM {table}
+             WHERE bucket >= %s
+             GROUP BY bucket, {dimension}
+             ORDER BY bucket, visits DESC
+        """, [since])
+        return cursor.fetchall()
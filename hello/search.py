@@ -0,0 +1,171 @@
+"""
+    Document catalog queries behind /api/documents: category filtering, title search and keyset pagination.
+    Results are in pk order and a page continues after the last pk of the previous one, so fetching
+    a page costs the same wherever it is in the catalog, instead of an OFFSET scanning every row before it.
+    The query backend is set with CATALOG_SEARCH_BACKEND:
+        memory      an inverted index over the worker's cached catalog snapshot, rebuilt when the catalog
+                    version changes; words match exactly. The default
+        postgres    queries azure_document through its (category, pk) index and the GIN index on the
+                    title's tsvector, with PostgreSQL's English stemming, for catalogs too large to cache
+    Like plainto_tsquery, a search matches the titles containing every one of its words.
+    Every page carries the version of the data it was built from, the strong ETag of /api/documents:
+    the catalog snapshot's version for the memory backend, so a conditional request for a cached catalog
+    is answered without touching the database, and a digest of the rows the query returned for the
+    postgres backend, which never loads the whole catalog but runs its query for every request.
+"""
+
+import os
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from hello.catalog import CatalogSnapshot, DocumentRecord, catalog_version, document_catalog
+from hello.models import AzureDocument
+
+BACKEND_MEMORY = 'memory'
+BACKEND_POSTGRES = 'postgres'
+BACKENDS = (BACKEND_MEMORY, BACKEND_POSTGRES)
+
+WORD = re.compile(r'\w+')
+
+
+class DocumentPage(NamedTuple):
+    """
+        One page of query results and the pk the next page starts after, None on the last page.
+        version identifies the data the page was built from, set by DocumentSearch.query.
+    """
+    documents: Tuple[DocumentRecord, ...]
+    next_after: Optional[int]
+    version: str = ''
+
+
+def search_words(text: str) -> List[str]:
+    """
+        Returns the distinct lower cased words of a title or search.
+    """
+    return list(dict.fromkeys(word.lower() for word in WORD.findall(text or '')))
+
+
+def page_of(documents: List[DocumentRecord], limit: int) -> DocumentPage:
+    """
+        Returns a page from up to limit + 1 documents, the extra one only tells that there is a next page.
+    """
+    if len(documents) > limit:
+        documents = documents[:limit]
+        return DocumentPage(tuple(documents), documents[-1].pk)
+    return DocumentPage(tuple(documents), None)
+
+
+class InvertedIndex:
+    """
+        Posting lists of the positions of a catalog's documents, in pk order, per title word and per category.
+    """
+
+    def __init__(self, documents) -> None:
+        self.documents = sorted(documents, key=lambda document: document.pk)
+        self.pks = [document.pk for document in self.documents]
+        self.words: Dict[str, List[int]] = {}
+        self.categories: Dict[str, List[int]] = {}
+        for position, document in enumerate(self.documents):
+            self.categories.setdefault(document.category, []).append(position)
+            for word in search_words(document.title):
+                self.words.setdefault(word, []).append(position)
+
+    def query(self, category: str = '', search: str = '', after: int = 0, limit: int = 50) -> DocumentPage:
+        """
+            Returns the page of documents with a pk above after, of the category and matching every search word.
+        """
+        postings = [self.categories.get(category, []) if category else None]
+        postings += [self.words.get(word, []) for word in search_words(search)]
+        postings = sorted((posting for posting in postings if posting is not None), key=len)
+        start = bisect_right(self.pks, after)
+
+        if not postings:
+            return page_of(self.documents[start:start + limit + 1], limit)
+
+        # walks the shortest posting list and looks its positions up in the others
+        shortest, others = postings[0], postings[1:]
+        found = []
+        for position in shortest[bisect_left(shortest, start):]:
+            if all(self._contains(posting, position) for posting in others):
+                found.append(self.documents[position])
+                if len(found) > limit:
+                    break
+        return page_of(found, limit)
+
+    @staticmethod
+    def _contains(posting: List[int], position: int) -> bool:
+        index = bisect_left(posting, position)
+        return index < len(posting) and posting[index] == position
+
+
+class DocumentSearch:
+    """
+        Answers catalog queries with the configured backend.
+        The memory backend's index is built from a snapshot of catalog, the worker's document catalog by default,
+        and kept until its version changes.
+    """
+
+    def __init__(self, backend: str = BACKEND_MEMORY, page_size: int = 50, max_page_size: int = 500,
+                 catalog=None) -> None:
+        self.backend = backend
+        self.catalog = catalog if catalog is not None else document_catalog
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self._index = None
+        self._lock = threading.Lock()
+
+    def init_app(self, flask_app) -> None:
+        """
+            Reads CATALOG_SEARCH_BACKEND, CATALOG_PAGE_SIZE and CATALOG_MAX_PAGE_SIZE from the Flask configuration.
+        """
+        backend = flask_app.config.get('CATALOG_SEARCH_BACKEND', BACKEND_MEMORY)
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown catalog search backend {backend!r}, expected one of {BACKENDS}")
+        self.backend = backend
+        self.page_size = flask_app.config.get('CATALOG_PAGE_SIZE', 50)
+        self.max_page_size = flask_app.config.get('CATALOG_MAX_PAGE_SIZE', 500)
+        flask_app.extensions['document_search'] = self
+
+    def index(self, snapshot: CatalogSnapshot) -> InvertedIndex:
+        """
+            Returns the inverted index of a catalog snapshot, built once per catalog version.
+        """
+        cached = self._index
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+
+        with self._lock:
+            # another thread may have built the index while this one waited
+            cached = self._index
+            if cached is not None and cached[0] == snapshot.version:
+                return cached[1]
+            index = InvertedIndex(snapshot.documents)
+            self._index = (snapshot.version, index)
+            return index
+
+    def query(self, category: str = '', search: str = '', after: int = 0, limit: int = 0) -> DocumentPage:
+        """
+            Returns a page of documents and its version, limit defaults to the page size and is capped
+            at the maximum page size.
+        """
+        limit = min(limit or self.page_size, self.max_page_size)
+        if self.backend == BACKEND_MEMORY:
+            snapshot = self.catalog.snapshot()
+            return self.index(snapshot).query(category, search, after, limit)._replace(version=snapshot.version)
+
+        # the extra row deciding the next link is part of the version, as the link is part of the response
+        documents = tuple(DocumentRecord(*row) for row in AzureDocument.query_rows(category, search, after, limit + 1))
+        return page_of(list(documents), limit)._replace(version=catalog_version(documents))
+
+    def reset_after_fork(self) -> None:
+        """
+            Keeps the index built by the parent process, e.g. gunicorn's preloading master.
+        """
+        self._lock = threading.Lock()
+
+
+# The process wide catalog search, bound to the Flask application in register_extensions.
+document_search = DocumentSearch()
+os.register_at_fork(after_in_child=document_search.reset_after_fork)
@@ -2,38 +2,236 @@
     Secrets is a module that interacts with KeyVault.
     The KeyVault URI is stored in the application settings
     when the deployment is run.
+    Secrets are resolved concurrently through one shared Key Vault client, cached in
+    process for SECRETS_TTL_SECONDS and refreshed in the background before they expire.
+    When SECRETS_SNAPSHOT_PATH and SECRETS_SNAPSHOT_KEY are set an encrypted copy of the
+    secrets is kept on disk so that new workers can start without waiting on Key Vault.
 """
 
+import json
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List
 
-from azure.keyvault import KeyVaultClient
-from msrestazure.azure_active_directory import MSIAuthentication
+logger = logging.getLogger(__name__)
 
 
 def get_auth_credentials():
     """
         Get an instance of the MSI authentication for Key Vault resources.
     """
+    # the Azure SDK takes longer to import than the rest of the application, it is loaded on first use
+    from msrestazure.azure_active_directory import MSIAuthentication
+
     return MSIAuthentication(
         resource="https://vault.azure.net"
     )
 
 
-def get_key_vault_secret(key, version="") -> str:
+def create_key_vault_client():
     """
-        Gets a secret from Key Vault given the secrets name.
+        Creates a Key Vault client authenticated with the MSI credentials.
     """
-    # get MSI credentials for authenticating against Key Vault
-    credentials = get_auth_credentials()
+    from azure.keyvault import KeyVaultClient
 
-    client = KeyVaultClient(
-        credentials
+    return KeyVaultClient(
+        get_auth_credentials()
     )
 
+
+class SecretStore:
+    """
+        Resolves and caches Key Vault secrets.
+        client_factory is called once to build the client used for every request,
+        it can be replaced with a factory returning a fake client in tests.
+        The client must provide get_secret(vault_uri, name, version) returning an object with a value.
+    """
+
+    def __init__(self, client_factory=create_key_vault_client, vault_uri: str = None,
+                 ttl_seconds: float = 3600, max_workers: int = 8,
+                 snapshot_path: str = '', snapshot_key: str = '') -> None:
+        self.client_factory = client_factory
+        self.vault_uri = vault_uri
+        self.ttl = ttl_seconds
+        self.max_workers = max_workers
+        self.snapshot_path = snapshot_path
+        self._fernet = None
+        if snapshot_path and snapshot_key:
+            from cryptography.fernet import Fernet
+            self._fernet = Fernet(snapshot_key)
+        self._client = None
+        self._values = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def client(self):
+        """
+            Returns the shared Key Vault client, creating it on first use.
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.client_factory()
+        return self._client
+
+    def get(self, name: str, version: str = "") -> str:
+        """
+            Returns a secret, fetching it from Key Vault when it is not cached or has expired.
+        """
+        if version:
+            # pinned versions are immutable and rarely requested, skip the cache
+            return self._fetch(name, version)
+
+        entry = self._values.get(name)
+        if entry is not None and time.time() < entry[1] + self.ttl:
+            if self._refresher is None:
+                self._ensure_refreshing()
+            return entry[0]
+
+        value = self._fetch(name)
+        self._store({name: value})
+        return value
+
+    def prefetch(self, names: Iterable[str]) -> List[str]:
+        """
+            Resolves many secrets concurrently and starts the background refresh.
+            Secrets found in a fresh snapshot are not fetched again.
+            Secrets that cannot be resolved are logged and skipped, get raises for them later.
+            Returns the names that are now cached.
+        """
+        names = list(names)
+        self._load_snapshot()
+
+        missing = [name for name in names if name not in self._values]
+        self._store(self._fetch_many(missing))
+        self._ensure_refreshing()
+
+        return [name for name in names if name in self._values]
+
+    def missing(self, names: Iterable[str]) -> List[str]:
+        """
+            Returns the names that are not cached or whose cached value has expired, without fetching them.
+        """
+        now = time.time()
+        values = self._values
+        return [name for name in names if name not in values or now >= values[name][1] + self.ttl]
+
+    def refresh(self) -> None:
+        """
+            Fetches every cached secret again, keeping the old value of secrets that fail.
+        """
+        self._store(self._fetch_many(list(self._values)))
+
+    def reset_after_fork(self) -> None:
+        """
+            Keeps the secrets resolved by the parent process, e.g. gunicorn's preloading master,
+            and lets the child start its own background refresh.
+        """
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def _fetch(self, name: str, version: str = "") -> str:
+        # retrieve a secret that matches the corresponding key value
+        key_bundle = self.client().get_secret(self.vault_uri, name, version)
+        return key_bundle.value
+
+    def _fetch_many(self, names: List[str]) -> Dict[str, str]:
+        if not names:
+            return {}
+
+        def fetch(name):
+            try:
+                return name, self._fetch(name)
+            except Exception:
+                logger.exception("Could not resolve Key Vault secret %s", name)
+                return name, None
+
+        # the client is created up front so the worker threads share it
+        self.client()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names))) as executor:
+            results = executor.map(fetch, names)
+
+        return {name: value for name, value in results if value is not None}
+
+    def _store(self, values: Dict[str, str]) -> None:
+        if not values:
+            return
+        fetched_at = time.time()
+        with self._lock:
+            # replace the dict instead of mutating it so readers never need the lock
+            updated = dict(self._values)
+            updated.update((name, (value, fetched_at)) for name, value in values.items())
+            self._values = updated
+        self._save_snapshot()
+
+    def _ensure_refreshing(self) -> None:
+        # started lazily so that importing the module does not spawn threads
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(
+                    target=self._refresh_forever, name='secret-refresher', daemon=True)
+                self._refresher.start()
+
+    def _refresh_forever(self) -> None:
+        # refreshing at half the ttl leaves time for a second attempt before values expire
+        while True:
+            time.sleep(self.ttl / 2)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Background refresh of Key Vault secrets failed")
+
+    def _load_snapshot(self) -> None:
+        if self._fernet is None or self._values or not os.path.exists(self.snapshot_path):
+            return
+
+        from cryptography.fernet import InvalidToken
+
+        try:
+            with open(self.snapshot_path, 'rb') as snapshot:
+                data = json.loads(self._fernet.decrypt(snapshot.read(), ttl=int(self.ttl)))
+        except (OSError, ValueError, InvalidToken):
+            logger.warning("Ignoring unreadable or expired secrets snapshot %s", self.snapshot_path)
+            return
+
+        with self._lock:
+            self._values = {name: tuple(entry) for name, entry in data.items()}
+
+    def _save_snapshot(self) -> None:
+        if self._fernet is None:
+            return
+
+        token = self._fernet.encrypt(json.dumps(self._values).encode('utf-8'))
+        temporary_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            # write then rename so that a starting worker never reads half a snapshot
+            descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'wb') as snapshot:
+                snapshot.write(token)
+            os.replace(temporary_path, self.snapshot_path)
+        except OSError:
+            logger.exception("Could not write secrets snapshot %s", self.snapshot_path)
+
+
+# The process wide secret store, configured from the Application Settings.
+secret_store = SecretStore(
     # get Key Vault URL from the Application Settings
-    key_vault_uri = os.environ.get("KEY_VAULT_URI")
+    vault_uri=os.environ.get("KEY_VAULT_URI"),
+    ttl_seconds=int(os.environ.get("SECRETS_TTL_SECONDS", "3600")),
+    snapshot_path=os.environ.get("SECRETS_SNAPSHOT_PATH", ""),
+    snapshot_key=os.environ.get("SECRETS_SNAPSHOT_KEY", ""),
+)
+os.register_at_fork(after_in_child=secret_store.reset_after_fork)
 
-    # retrieve a secret that matches the corresponding key value
-    key_bundle = client.get_secret(key_vault_uri, key, version)
 
-    return key_bundle.value
+def get_key_vault_secret(key, version="") -> str:
+    """
+        Gets a secret from Key Vault given the secrets name.
+        Served from the process wide secret store cache.
+    """
+    return secret_store.get(key, version)
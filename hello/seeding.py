@@ -0,0 +1,147 @@
+"""
+    Bulk loader for the Azure document catalog.
+    Rows are streamed from the CSV file, escaped in batches and loaded with
+    COPY FROM STDIN inside a single transaction instead of one stored function call
+    and commit per row. The upsert mode updates documents whose url is already stored,
+    which makes loading the same file twice a no-op.
+"""
+
+import csv
+import gzip
+import html
+import io
+from itertools import islice
+from timeit import default_timer
+from typing import Iterable, Iterator, List, Tuple
+
+from hello.catalog import document_catalog
+from hello.database import transaction
+
+# The sample documents loaded when the application is first deployed
+SEED_FILE = 'seed-data/asis-content.csv'
+
+DocumentRow = Tuple[str, str, str]
+
+
+def open_catalog(path: str):
+    """
+        Opens a catalog CSV file for reading as text, decompressing it on the fly when its name ends in .gz.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_documents(path: str, counts: dict = None) -> Iterator[DocumentRow]:
+    """
+        Streams (title, url, category) rows from a CSV file, escaped the same way as seed_db always has.
+        Rows without exactly three columns are skipped and counted in counts['malformed'] when counts is given.
+    """
+    with open_catalog(path) as csvfile:
+        for row in csv.reader(csvfile, delimiter=','):
+            if len(row) != 3:
+                if counts is not None:
+                    counts['malformed'] = counts.get('malformed', 0) + 1
+                continue
+            title, url, category = [html.escape(field.strip()) for field in row]
+            yield title, url, category
+
+
+def batched(rows: Iterable, batch_size: int) -> Iterator[List]:
+    """
+        Groups an iterable into lists of at most batch_size items.
+    """
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_buffer(rows: List[DocumentRow]) -> io.StringIO:
+    """
+        Encodes rows in PostgreSQL's COPY text format.
+    """
+    buffer = io.StringIO()
+    escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+    buffer.write(''.join(
+        '\t'.join(field.translate(escapes) for field in row) + '\n' for row in rows))
+    buffer.seek(0)
+    return buffer
+
+
+def load_documents(cursor, rows: Iterable[DocumentRow], batch_size: int = 10000,
+                   upsert: bool = False, progress=None) -> dict:
+    """
+        Loads document rows with COPY on the cursor's connection without committing.
+        In upsert mode the rows are copied into a staging table first, documents with a
+        known url are updated and the rest inserted, each url at most once, from its last row in the file.
+        progress is called after every batch with the rows loaded so far and the elapsed seconds.
+        Returns the number of rows read, inserted and updated.
+    """
+    target = 'azure_document'
+    if upsert:
+        # keep concurrent loaders from inserting the same url twice
+        cursor.execute("LOCK TABLE azure_document IN SHARE ROW EXCLUSIVE MODE")
+        # line numbers the staged rows in file order, so the last row of a repeated url wins
+        cursor.execute(
+            "CREATE TEMPORARY TABLE azure_document_staging "
+            "(line BIGSERIAL, title TEXT, url TEXT, category VARCHAR(100)) ON COMMIT DROP")
+        target = 'azure_document_staging'
+
+    load_start = default_timer()
+    loaded = 0
+    for batch in batched(rows, batch_size):
+        cursor.copy_expert(f"COPY {target} (title, url, category) FROM STDIN", copy_buffer(batch))
+        loaded += len(batch)
+        if progress:
+            progress(loaded, default_timer() - load_start)
+
+    counts = {'rows': loaded, 'inserted': loaded, 'updated': 0}
+    if upsert:
+        cursor.execute("""
+            UPDATE azure_document AS document
+               SET title = staged.title, category = staged.category
+              FROM (SELECT DISTINCT ON (url) title, url, category
+                      FROM azure_document_staging
+                     ORDER BY url, line DESC) AS staged
+             WHERE document.url = staged.url
+               AND (document.title, document.category) IS DISTINCT FROM (staged.title, staged.category)
+        """)
+        counts['updated'] = cursor.rowcount
+        cursor.execute("""
+            INSERT INTO azure_document (title, url, category)
+            SELECT DISTINCT ON (url) title, url, category
+              FROM azure_document_staging AS staged
+             WHERE NOT EXISTS (SELECT 1 FROM azure_document AS document WHERE document.url = staged.url)
+             ORDER BY url, line DESC
+        """)
+        counts['inserted'] = cursor.rowcount
+
+    return counts
+
+
+def print_progress(loaded: int, seconds: float) -> None:
+    """
+        Prints the number of rows loaded and the load rate.
+    """
+    rate = loaded / seconds if seconds else 0
+    print(f"Loaded {loaded:,} rows ({rate:,.0f} rows/sec)")
+
+
+def bulk_seed(path: str = SEED_FILE, batch_size: int = 10000, upsert: bool = False,
+              progress=print_progress) -> dict:
+    """
+        Loads a CSV file of documents in one transaction and invalidates the document catalog.
+        Returns the counts of load_documents and the number of malformed rows skipped.
+        Must be called inside an application context.
+    """
+    skipped = {'malformed': 0}
+    with transaction() as cursor:
+        counts = load_documents(cursor, read_documents(path, skipped), batch_size, upsert, progress)
+        document_catalog.notify(cursor)
+
+    document_catalog.invalidate()
+    counts.update(skipped)
+    return counts
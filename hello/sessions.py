@@ -0,0 +1,328 @@
+"""
+    Server-side sessions.
+    The session cookie holds only an opaque random id and the session data is kept by a backend:
+        memory      an LRU of sessions in the worker's memory, for a single process on a single node
+        postgres    the http_session table, shared by every worker and instance
+    Sessions are loaded lazily. Opening a request's session only remembers the id in its cookie,
+    the backend is read the first time the view touches the session, so requests that never use it,
+    like the /hello health probe, do no session work. Sessions are only written, and the cookie
+    only sent, when they are modified, e.g. when signing in. A session keeps its id until it is
+    rotated, when the signed in user changes, see SessionStore.rotate.
+    SESSION_BACKEND=cookie keeps Flask's signed cookie sessions.
+"""
+
+import datetime
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Optional
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+
+from hello.database import transaction
+
+BACKEND_COOKIE = 'cookie'
+BACKEND_MEMORY = 'memory'
+BACKEND_POSTGRES = 'postgres'
+BACKENDS = (BACKEND_COOKIE, BACKEND_MEMORY, BACKEND_POSTGRES)
+
+
+def session_key(sid: str, namespace: str = 'sid') -> str:
+    """
+        Returns the key a session is stored under, a hash of its id so a stored key cannot be used as a cookie.
+        Other entries kept by a session backend, like the token cache's, are hashed in their own namespace,
+        so no cookie names them.
+    """
+    return hashlib.sha256(f"{namespace}:{sid}".encode('utf-8')).hexdigest()
+
+
+def utcnow() -> datetime.datetime:
+    """
+        Returns the current time in UTC.
+    """
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class MemorySessionBackend:
+    """
+        Keeps sessions in the worker's memory, evicting the least recently used beyond max_size.
+        Sessions are not shared between workers, so it only suits a single process.
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, key: str) -> Optional[dict]:
+        """
+            Returns a copy of the data of an unexpired session, None when there is none.
+        """
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if expires_at <= utcnow():
+                del self._sessions[key]
+                return None
+            self._sessions.move_to_end(key)
+            return dict(data)
+
+    def save(self, key: str, data: dict, expires_at: datetime.datetime) -> None:
+        """
+            Stores a copy of the session data until expires_at.
+        """
+        with self._lock:
+            self._sessions[key] = (dict(data), expires_at)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        """
+            Removes a session.
+        """
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def cleanup(self, batch_size: int = 1000, max_batches: int = 0) -> int:
+        """
+            Removes up to batch_size * max_batches expired sessions, all of them when max_batches is 0.
+        """
+        now = utcnow()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._sessions.items() if expires_at <= now]
+            if max_batches:
+                expired = expired[:batch_size * max_batches]
+            for key in expired:
+                del self._sessions[key]
+        return len(expired)
+
+
+class PostgresSessionBackend:
+    """
+        Keeps sessions in the http_session table, serialized like Flask's cookie sessions.
+        Expired sessions are ignored when loaded and deleted in batches by cleanup,
+        using the index on expires_at. Must be used inside an application context.
+    """
+
+    def __init__(self, serializer=session_json_serializer) -> None:
+        self.serializer = serializer
+
+    def load(self, key: str) -> Optional[dict]:
+        """
+            Returns the data of an unexpired session, None when there is none.
+        """
+        with transaction() as cursor:
+            cursor.execute("SELECT data FROM http_session WHERE key = %s AND expires_at > NOW()", [key])
+            row = cursor.fetchone()
+        return self.serializer.loads(row[0]) if row else None
+
+    def save(self, key: str, data: dict, expires_at: datetime.datetime) -> None:
+        """
+            Stores the session data until expires_at.
+        """
+        with transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO http_session (key, data, expires_at) VALUES (%s, %s, %s)
+                ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+            """, [key, self.serializer.dumps(data), expires_at])
+
+    def delete(self, key: str) -> None:
+        """
+            Removes a session.
+        """
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM http_session WHERE key = %s", [key])
+
+    def cleanup(self, batch_size: int = 1000, max_batches: int = 0) -> int:
+        """
+            Deletes expired sessions, batch_size rows per transaction, for at most max_batches
+            transactions or until none are left when max_batches is 0. Returns the number deleted.
+        """
+        deleted = 0
+        batches = 0
+        while True:
+            with transaction() as cursor:
+                # skip rows another cleanup is deleting instead of waiting for it
+                cursor.execute("""
+                    DELETE FROM http_session
+                     WHERE key IN (SELECT key FROM http_session
+                                    WHERE expires_at <= NOW()
+                                    ORDER BY expires_at
+                                    LIMIT %s
+                                      FOR UPDATE SKIP LOCKED)
+                """, [batch_size])
+                count = cursor.rowcount
+            deleted += count
+            batches += 1
+            if count < batch_size or batches == max_batches:
+                return deleted
+
+
+class ServerSideSession(SessionMixin, MutableMapping):
+    """
+        A session whose data is read from the backend the first time it is used.
+        sid is the id from the request's cookie, None for a new session or one that expired.
+    """
+
+    def __init__(self, backend, sid: Optional[str] = None) -> None:
+        self.backend = backend
+        self.cookie_sid = sid
+        self.sid = sid
+        self.modified = False
+        self.accessed = False
+        self.rotated = False
+        self._data = None
+
+    @property
+    def new(self) -> bool:
+        return self.sid is None
+
+    def rotate(self) -> None:
+        """
+            Moves the session to a new id when it is saved.
+        """
+        self._load()
+        self.rotated = True
+        self.modified = True
+
+    def _load(self) -> dict:
+        if self._data is None:
+            self.accessed = True
+            data = self.backend.load(session_key(self.sid)) if self.sid else None
+            if data is None:
+                # an unknown or expired id is never reused, a new session gets a new id
+                self.sid = None
+            self._data = data or {}
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value) -> None:
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key) -> None:
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def __repr__(self) -> str:
+        return f"<ServerSideSession {'loaded' if self.accessed else 'not loaded'}>"
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+        Flask session interface storing sessions with a backend under an opaque cookie id.
+        Every cleanup_every writes, the writing request also deletes one batch of expired sessions.
+    """
+
+    def __init__(self, backend, lifetime_seconds: int = 86400, cleanup_every: int = 1000,
+                 cleanup_batch_size: int = 1000) -> None:
+        self.backend = backend
+        self.lifetime = datetime.timedelta(seconds=lifetime_seconds)
+        self.cleanup_every = cleanup_every
+        self.cleanup_batch_size = cleanup_batch_size
+        self._writes = 0
+
+    def open_session(self, app, request) -> ServerSideSession:
+        return ServerSideSession(self.backend, request.cookies.get(app.session_cookie_name) or None)
+
+    def save_session(self, app, session: ServerSideSession, response) -> None:
+        if not session.accessed:
+            return
+        response.vary.add('Cookie')
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            # cleared or expired, forget the id the browser holds
+            if session.cookie_sid:
+                if session.sid:
+                    self.backend.delete(session_key(session.sid))
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            return
+
+        # other requests in flight with the current id keep finding the session, only a rotated one moves,
+        # so an id fixed before signing in is worthless after it
+        sid = session.sid
+        if sid is None or session.rotated:
+            sid = secrets.token_urlsafe(32)
+        self.backend.save(session_key(sid), dict(session), utcnow() + self.lifetime)
+        if session.sid and session.sid != sid:
+            self.backend.delete(session_key(session.sid))
+        response.set_cookie(
+            app.session_cookie_name, sid, expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+        self._writes += 1
+        if self.cleanup_every and self._writes % self.cleanup_every == 0:
+            self.backend.cleanup(self.cleanup_batch_size, max_batches=1)
+
+
+class SessionStore:
+    """
+        Installs the server-side session interface selected by SESSION_BACKEND on the Flask application.
+    """
+
+    def __init__(self) -> None:
+        self.interface = None
+
+    @property
+    def backend(self):
+        """
+            The session backend, None when the application uses signed cookie sessions.
+        """
+        return self.interface.backend if self.interface else None
+
+    def rotate(self, session) -> None:
+        """
+            Moves a server-side session to a new id, e.g. when a user signs in.
+            Signed cookie sessions have no id and are left as they are.
+        """
+        if isinstance(session, ServerSideSession):
+            session.rotate()
+
+    def init_app(self, flask_app) -> None:
+        """
+            Reads SESSION_BACKEND, SESSION_LIFETIME_SECONDS, SESSION_MEMORY_MAX_SIZE,
+            SESSION_CLEANUP_EVERY and SESSION_CLEANUP_BATCH_SIZE from the Flask configuration.
+        """
+        name = flask_app.config.get('SESSION_BACKEND', BACKEND_COOKIE)
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown session backend {name!r}, expected one of {BACKENDS}")
+
+        self.interface = None
+        if name == BACKEND_MEMORY:
+            backend = MemorySessionBackend(flask_app.config.get('SESSION_MEMORY_MAX_SIZE', 10000))
+        elif name == BACKEND_POSTGRES:
+            backend = PostgresSessionBackend()
+        else:
+            flask_app.extensions['sessions'] = self
+            return
+
+        self.interface = ServerSideSessionInterface(
+            backend,
+            flask_app.config.get('SESSION_LIFETIME_SECONDS', 86400),
+            flask_app.config.get('SESSION_CLEANUP_EVERY', 1000),
+            flask_app.config.get('SESSION_CLEANUP_BATCH_SIZE', 1000))
+        flask_app.session_interface = self.interface
+        flask_app.extensions['sessions'] = self
+
+
+# The process wide session store, bound to the Flask application in register_extensions.
+session_store = SessionStore()
@@ -0,0 +1,246 @@
+"""
+    The database step of a container start, run by init.sh before the server:
+        python3 -m hello.startup [--no-wait] [--lock-timeout 600]
+    A database already at the latest migration and seeded with the current seed file costs one
+    connection and three small queries, without importing the application or reading any Key Vault
+    secret but the connection string. Otherwise the instance takes a PostgreSQL advisory lock, so that
+    of the instances starting together one migrates and seeds while the others wait, or skip with
+    --no-wait, and checks again once it holds the lock. Missing migrations are applied with Flask-Migrate's
+    upgrade, the seed file is loaded in upsert mode when its version differs from the one recorded
+    in deployment_state by the last seeding, and the visitor partitions are maintained when one of the
+    coming months is missing or one has expired, see partitions.py.
+    Migrations are never autogenerated here, flask db migrate is run by developers and the result committed.
+"""
+
+import argparse
+import datetime
+import hashlib
+import logging
+import os
+import sys
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+
+import psycopg2
+
+from hello import config
+from hello.database import database_dsn
+from hello.partitions import apply_retention, ensure_partitions, expired_partitions, list_partitions, missing_months
+from hello.seeding import SEED_FILE, bulk_seed
+
+logger = logging.getLogger(__name__)
+
+# The Alembic migrations of the application
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+# Key of the advisory lock held while an instance migrates or seeds, any constant shared by all instances
+STARTUP_LOCK_KEY = 7305201946118823
+
+# The deployment_state row holding the version of the last seeded catalog
+SEED_STATE = 'seed_catalog'
+
+UPGRADE = 'upgrade'
+SEED = 'seed'
+PARTITIONS = 'partitions'
+
+
+class DatabaseState(NamedTuple):
+    """
+        The Alembic revision of a database and the seed file version it was last seeded with, None when unknown,
+        and the monthly visitor partitions keyed by the first day of their month.
+    """
+    revision: Optional[str]
+    seeded_version: Optional[str]
+    partitions: Dict[datetime.date, str] = {}
+
+
+class PartitionPolicy(NamedTuple):
+    """
+        The partition maintenance settings of config.py, read without the application.
+    """
+    months_ahead: int = config.VISITOR_PARTITION_MONTHS_AHEAD
+    retention_months: int = config.VISITOR_RETENTION_MONTHS
+    action: str = config.VISITOR_RETENTION_ACTION
+
+
+def head_revisions(directory: str = MIGRATIONS_DIRECTORY) -> Set[str]:
+    """
+        Returns the head revisions of the migration scripts, read from the files without a database.
+    """
+    from alembic.script import ScriptDirectory
+
+    return set(ScriptDirectory(directory).get_heads())
+
+
+def seed_version(path: str) -> str:
+    """
+        Returns a short digest of a seed file, it changes whenever the file does.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as seed_file:
+        for chunk in iter(lambda: seed_file.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def read_state(connection) -> DatabaseState:
+    """
+        Reads the revision, seeded catalog version and visitor partitions, None for the tables
+        a new database does not have yet.
+        connection must be in autocommit mode, so a missing table does not abort a transaction.
+    """
+    values = []
+    for query, params in (("SELECT version_num FROM alembic_version", []),
+                          ("SELECT value FROM deployment_state WHERE name = %s", [SEED_STATE])):
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(query, params)
+            except psycopg2.ProgrammingError:
+                values.append(None)
+                continue
+            row = cursor.fetchone()
+            values.append(row[0] if row else None)
+    with connection.cursor() as cursor:
+        values.append(list_partitions(cursor))
+    return DatabaseState(*values)
+
+
+def pending_steps(state: DatabaseState, heads: Set[str], version: str, policy: PartitionPolicy = PartitionPolicy(),
+                  today: Optional[datetime.date] = None) -> Tuple[str, ...]:
+    """
+        Returns the steps that bring a database to the latest migration, the seed file's version
+        and the partitions of the policy.
+    """
+    steps = ()
+    if state.revision not in heads:
+        steps += (UPGRADE,)
+    if state.seeded_version != version:
+        steps += (SEED,)
+
+    today = today or datetime.date.today()
+    if missing_months(state.partitions, policy.months_ahead, today) or \
+            expired_partitions(state.partitions, policy.retention_months, today):
+        steps += (PARTITIONS,)
+    return steps
+
+
+def upgrade_database() -> None:
+    """
+        Applies the missing migrations, importing the application only now that they are needed.
+    """
+    from flask_migrate import upgrade
+
+    from app import app
+
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIRECTORY)
+
+
+def seed_database(path: str) -> dict:
+    """
+        Loads the seed file in upsert mode, so documents stored by an earlier seeding are updated in place.
+    """
+    from hello.app import app
+
+    with app.app_context():
+        return bulk_seed(path, upsert=True)
+
+
+def maintain_partitions(connection, policy: PartitionPolicy) -> dict:
+    """
+        Creates the missing visitor partitions and applies the retention policy in one transaction.
+    """
+    connection.autocommit = False
+    try:
+        # the connection's context commits the transaction, or rolls it back on an error
+        with connection, connection.cursor() as cursor:
+            created = ensure_partitions(cursor, policy.months_ahead)
+            expired = apply_retention(cursor, policy.retention_months, policy.action)
+    finally:
+        connection.autocommit = True
+    return {'created': created, 'expired': expired}
+
+
+def record_seed_version(connection, version: str) -> None:
+    """
+        Records the version of the seed file that was just loaded.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO deployment_state (name, value, updated_at) VALUES (%s, %s, NOW())
+                ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+        """, [SEED_STATE, version])
+
+
+def run_startup(database_url: str, seed_path: str, wait: bool = True, lock_timeout_seconds: int = 600,
+                policy: PartitionPolicy = PartitionPolicy()) -> str:
+    """
+        Migrates, seeds and partitions the database when needed and returns what was done:
+        current when there was nothing to do, skipped when another instance held the lock and wait is off,
+        or the steps that ran.
+    """
+    heads = head_revisions()
+    version = seed_version(seed_path)
+    connection = psycopg2.connect(database_dsn(database_url))
+    connection.autocommit = True
+    try:
+        if not pending_steps(read_state(connection), heads, version, policy):
+            return 'current'
+
+        with connection.cursor() as cursor:
+            if wait:
+                cursor.execute("SELECT set_config('lock_timeout', %s, false)", [f"{lock_timeout_seconds}s"])
+                cursor.execute("SELECT pg_advisory_lock(%s)", [STARTUP_LOCK_KEY])
+            else:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", [STARTUP_LOCK_KEY])
+                if not cursor.fetchone()[0]:
+                    return 'skipped'
+
+        # the instance that held the lock before this one may have done everything already
+        steps = pending_steps(read_state(connection), heads, version, policy)
+        done = steps
+        if UPGRADE in steps:
+            logger.info("Upgrading the database to %s", ', '.join(sorted(heads)))
+            upgrade_database()
+            # the migrations may have created partitions, or the partitioned table itself
+            steps = pending_steps(read_state(connection), heads, version, policy)
+            done = (UPGRADE,) + steps
+        if SEED in steps:
+            counts = seed_database(seed_path)
+            record_seed_version(connection, version)
+            logger.info("Seeded %s: inserted %d, updated %d, skipped %d malformed rows",
+                        seed_path, counts['inserted'], counts['updated'], counts['malformed'])
+        if PARTITIONS in steps:
+            result = maintain_partitions(connection, policy)
+            logger.info("Created partitions: %s, expired partitions: %s",
+                        ', '.join(result['created']) or 'none', ', '.join(result['expired']) or 'none')
+        return ', '.join(done) or 'current'
+    finally:
+        # closing the session releases the advisory lock
+        connection.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''),
+                        help='Defaults to DATABASE_URL, then to the PGCONNECTIONSTRING Key Vault secret.')
+    parser.add_argument('--seed-file', default=SEED_FILE)
+    parser.add_argument('--no-wait', dest='wait', action='store_false',
+                        help='Start without migrating while another instance holds the startup lock.')
+    parser.add_argument('--lock-timeout', type=int, default=600,
+                        help='Seconds to wait for the startup lock before failing.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    database_url = args.database_url
+    if not database_url:
+        from hello.secrets import get_key_vault_secret
+
+        database_url = get_key_vault_secret('PGCONNECTIONSTRING')
+
+    result = run_startup(database_url, args.seed_file, args.wait, args.lock_timeout)
+    logger.info("Database startup step: %s", result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+    Browser and operating system of visitors, parsed from their User-Agent header.
+    werkzeug parses a User-Agent with a series of regular expressions, yet the visitors of a site
+    send a few hundred distinct strings between them. The escaped (browser, operating system) of
+    every string is kept in a bounded LRU cache, so a repeated User-Agent costs a dictionary lookup.
+"""
+
+import html
+from functools import lru_cache
+from typing import Tuple
+
+from werkzeug.useragents import UserAgent
+
+# Stored when a User-Agent names no browser or operating system
+UNKNOWN = "N/A"
+
+# Longer User-Agent strings are cut before parsing and caching, real ones are a few hundred characters
+MAX_LENGTH = 512
+
+
+class UserAgentParser:
+    """
+        Parses User-Agent strings into the escaped browser with its version and the operating system.
+    """
+
+    def __init__(self, cache_size: int = 4096) -> None:
+        self.configure(cache_size)
+
+    def configure(self, cache_size: int) -> None:
+        """
+            Applies the cache size, dropping anything cached so far.
+        """
+        self._cached_parse = lru_cache(maxsize=cache_size)(self._parse_uncached)
+
+    def init_app(self, flask_app) -> None:
+        """
+            Configures the cache from the Flask configuration.
+        """
+        self.configure(flask_app.config.get('USER_AGENT_CACHE_SIZE', 4096))
+        flask_app.extensions['user_agents'] = self
+
+    def parse(self, user_agent: str) -> Tuple[str, str]:
+        """
+            Returns the escaped browser and operating system of a User-Agent string.
+        """
+        return self._cached_parse((user_agent or '')[:MAX_LENGTH])
+
+    def cache_info(self):
+        """
+            Returns the hit and miss counters of the cache.
+        """
+        return self._cached_parse.cache_info()
+
+    @staticmethod
+    def _parse_uncached(user_agent: str) -> Tuple[str, str]:
+        parsed = UserAgent(user_agent)
+        browser = UNKNOWN
+        if parsed.browser and parsed.version:
+            browser = parsed.browser + parsed.version
+        operating_system = parsed.platform if parsed.platform else UNKNOWN
+
+        # escape data going to be stored in the database
+        return html.escape(browser), html.escape(operating_system)
+
+
+# The process wide User-Agent parser, configured in register_extensions.
+user_agents = UserAgentParser()
@@ -1,21 +1,32 @@
 """
 Module contains a simple header validator used to check for allowed characters in header inputs.
+The allowed characters are precompiled into regular expressions, so a header is checked in a single
+C level pass without building per character lists. Both str and bytes headers are supported.
 """
 
+import re
+
+# Characters allowed in a header name: 0-9, A-Z, a-z and ! # $ % & ' * + - . ^ _ ` | ~
+_NAME_CHARACTERS = "!#$%&'*+\\-.^_`|~0-9A-Za-z"
+
+# Characters allowed in a header value: tab and every character from 32 to 255 except DEL (127)
+_VALUE_CHARACTERS = "\t\x20-\x7e\x80-\xff"
+
+_NAME = re.compile(f"[{_NAME_CHARACTERS}]*")
+_VALUE = re.compile(f"[{_VALUE_CHARACTERS}]*")
+_NAME_BYTES = re.compile(f"[{_NAME_CHARACTERS}]*".encode('latin-1'))
+_VALUE_BYTES = re.compile(f"[{_VALUE_CHARACTERS}]*".encode('latin-1'))
+
+
 class HeaderValidator:
     """
         Validates if a header has valid Name:Value values for the data presented from the browser.
     """
 
     def __init__(self):
-        self.allowed_header_name_chars = []
-        self.allowed_header_name_chars.extend(list(range(48, 58)))  # 0-9
-        self.allowed_header_name_chars.extend(list(range(65, 91)))  # a-z
-        self.allowed_header_name_chars.extend(list(range(97, 123)))  # A-Z
-        self.allowed_header_name_chars.extend(
-            [94, 95, 96, 124, 126])  # ^, _, `, |, ~
-        self.allowed_header_name_chars.extend(
-            [33, 35, 36, 37, 38, 39, 42, 43, 45, 46])  # !, #, $, %, &, ', *, +, -, .,
+        self.allowed_header_name_chars = frozenset(
+            ord(char) for char in "!#$%&'*+-.^_`|~0123456789"
+            "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
 
     def is_valid_value_character(self, char):
         """ Checks whether a header value character is valid """
@@ -29,24 +40,18 @@ class HeaderValidator:
 
     def is_valid_header_value(self, value):
         """ Checks whether a header value is valid """
-        characters = [ord(char) for char in value]
-        for char in characters:
-            if not self.is_valid_value_character(char):
-                return False
-        return True
+        pattern = _VALUE_BYTES if isinstance(value, bytes) else _VALUE
+        return pattern.fullmatch(value) is not None
 
     def is_valid_header_name(self, name):
         """ Checks whether a header name is valid """
-        characters = [ord(char) for char in name]
-        for char in characters:
-            if char not in self.allowed_header_name_chars:
-                return False
-        return True
+        pattern = _NAME_BYTES if isinstance(name, bytes) else _NAME
+        return pattern.fullmatch(name) is not None
 
     def is_valid(self, header):
         """ Validates a header string """
         try:
-            name, value = header.split(':', 1)
+            name, value = header.split(b':' if isinstance(header, bytes) else ':', 1)
             name, value = name.strip(), value.strip()
 
             if name and value:
@@ -57,3 +62,31 @@ class HeaderValidator:
             print("Error unpacking header values")
 
         return False
+
+    def validate_many(self, headers):
+        """
+            Validates every header line of a request's header block.
+            headers is a str or bytes block of lines separated by CRLF, or an iterable of header lines.
+            Returns one boolean per header line, blank lines, like the one ending a header block, are skipped.
+        """
+        if isinstance(headers, bytes):
+            lines = headers.split(b'\n')
+        elif isinstance(headers, str):
+            lines = headers.split('\n')
+        else:
+            lines = headers
+
+        return [self._is_valid_line(line) for line in lines if line.strip()]
+
+    @staticmethod
+    def _is_valid_line(line):
+        if isinstance(line, bytes):
+            separator, name_pattern, value_pattern = b':', _NAME_BYTES, _VALUE_BYTES
+        else:
+            separator, name_pattern, value_pattern = ':', _NAME, _VALUE
+
+        name, found, value = line.partition(separator)
+        name, value = name.strip(), value.strip()
+        return (bool(found and name and value)
+                and name_pattern.fullmatch(name) is not None
+                and value_pattern.fullmatch(value) is not None)
@@ -0,0 +1,277 @@
+"""
+    Write-behind queue for website visitor rows.
+    Page views submit Visitor records into a bounded in-process buffer and a
+    background flusher thread writes them to the database in batches, every
+    VISITOR_QUEUE_BATCH_SIZE records or VISITOR_QUEUE_FLUSH_INTERVAL_MS milliseconds.
+    The queue is attached to the Flask application in the same way as the SQLAlchemy
+    extension, by calling init_app in register_extensions.
+"""
+
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+from timeit import default_timer
+
+logger = logging.getLogger(__name__)
+
+# What submit does when the buffer is full
+BACKPRESSURE_BLOCK = 'block'
+BACKPRESSURE_DROP = 'drop'
+BACKPRESSURE_SYNC = 'sync'
+BACKPRESSURE_POLICIES = (BACKPRESSURE_BLOCK, BACKPRESSURE_DROP, BACKPRESSURE_SYNC)
+
+# Placed on the queue to wake the flusher thread up when the queue is closed
+_STOP = object()
+
+
+class VisitorWriteQueue:
+    """
+        Buffers visitors in memory and writes them in batches from a background thread.
+        writer is called with a list of visitors and must persist all of them,
+        when used through init_app it is Visitor.save_many_ inside an application context.
+        backpressure decides what happens when the buffer is full:
+            block   wait up to block_timeout_ms for room, then drop the visitor
+            drop    drop the visitor immediately
+            sync    write the visitor on the calling thread
+        With autostart the first submit starts the flusher thread, without it the buffer is only
+        written by start, flush or close, e.g. in tests.
+    """
+
+    def __init__(self, writer=None, max_size: int = 10000, batch_size: int = 500,
+                 flush_interval_ms: int = 1000, backpressure: str = BACKPRESSURE_SYNC,
+                 block_timeout_ms: int = 100, autostart: bool = True) -> None:
+        self.writer = writer
+        self.autostart = autostart
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = threading.Event()
+        self.configure(max_size, batch_size, flush_interval_ms, backpressure, block_timeout_ms)
+        self._reset_counters()
+
+    def configure(self, max_size: int, batch_size: int, flush_interval_ms: int,
+                  backpressure: str, block_timeout_ms: int) -> None:
+        """
+            Applies the buffer settings, must be called before the first submit.
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                f"Unknown backpressure policy {backpressure!r}, expected one of {BACKPRESSURE_POLICIES}")
+
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout_ms / 1000
+        self._queue = queue.Queue(maxsize=max_size)
+
+    def init_app(self, flask_app) -> None:
+        """
+            Configures the queue from the Flask configuration and writes visitors
+            with Visitor.save_many_ inside the application's context.
+            Remaining visitors are flushed when the worker process exits.
+        """
+        # imported here to avoid a circular import between the models and the queue
+        from hello.models import Visitor
+
+        self.configure(
+            flask_app.config.get('VISITOR_QUEUE_MAX_SIZE', 10000),
+            flask_app.config.get('VISITOR_QUEUE_BATCH_SIZE', 500),
+            flask_app.config.get('VISITOR_QUEUE_FLUSH_INTERVAL_MS', 1000),
+            flask_app.config.get('VISITOR_QUEUE_BACKPRESSURE', BACKPRESSURE_SYNC),
+            flask_app.config.get('VISITOR_QUEUE_BLOCK_TIMEOUT_MS', 100))
+
+        def write_visitors(visitors):
+            with flask_app.app_context():
+                Visitor.save_many_(visitors)
+
+        self.writer = write_visitors
+        flask_app.extensions['visitor_queue'] = self
+        atexit.register(self.close)
+
+    def submit(self, visitor) -> bool:
+        """
+            Buffers a visitor to be written by the flusher thread.
+            Returns False when the visitor was dropped because of backpressure.
+        """
+        if visitor.date_visited is None:
+            # keep the time of the page view rather than the time of the flush
+            visitor.date_visited = datetime.datetime.utcnow()
+
+        if self._closed.is_set():
+            return self._write_sync(visitor)
+
+        if self.autostart:
+            self.start()
+
+        try:
+            if self.backpressure == BACKPRESSURE_BLOCK:
+                self._queue.put(visitor, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(visitor)
+        except queue.Full:
+            if self.backpressure == BACKPRESSURE_SYNC:
+                return self._write_sync(visitor)
+            with self._lock:
+                self._counters['dropped'] += 1
+            return False
+
+        with self._lock:
+            self._counters['enqueued'] += 1
+        return True
+
+    def start(self) -> None:
+        """
+            Starts the flusher thread, once per process.
+        """
+        # the thread is started lazily so that importing the app does not spawn threads
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='visitor-queue-flusher', daemon=True)
+                self._thread.start()
+
+    def flush(self) -> int:
+        """
+            Writes every buffered visitor on the calling thread, in batches, and returns how many were taken.
+        """
+        taken = 0
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    visitor = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if visitor is not _STOP:
+                    batch.append(visitor)
+            if not batch:
+                return taken
+            self._flush(batch)
+            taken += len(batch)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+            Stops accepting new visitors, flushes everything that is buffered and stops the thread.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            # the flusher checks the closed flag after every batch
+            pass
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+        else:
+            self.flush()
+
+    def stats(self) -> dict:
+        """
+            Returns the queue counters: current depth, rows written and flush latencies in seconds.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats['depth'] = self._queue.qsize()
+        stats['average_flush_seconds'] = (
+            stats['flush_seconds_total'] / stats['flushes'] if stats['flushes'] else 0.0)
+        return stats
+
+    def _reset_counters(self) -> None:
+        self._counters = {
+            'enqueued': 0,
+            'dropped': 0,
+            'sync_writes': 0,
+            'written': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+            'flush_seconds_total': 0.0,
+        }
+
+    def reset_after_fork(self) -> None:
+        """
+            Forgets the flusher thread and buffer inherited from the parent process, e.g. gunicorn's preloading master.
+        """
+        self._lock = threading.Lock()
+        self._thread = None
+        self._queue = queue.Queue(maxsize=self.max_size)
+
+    def _write_sync(self, visitor) -> bool:
+        self.writer([visitor])
+        with self._lock:
+            self._counters['sync_writes'] += 1
+        return True
+
+    def _next_batch(self) -> list:
+        """
+            Waits for the first visitor, then collects more until the batch
+            is full or the flush interval has passed since the first one arrived.
+        """
+        batch = []
+        deadline = None
+
+        while len(batch) < self.batch_size:
+            if self._closed.is_set():
+                timeout = 0
+            elif deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - default_timer()
+
+            try:
+                if timeout > 0:
+                    visitor = self._queue.get(timeout=timeout)
+                else:
+                    visitor = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if visitor is _STOP:
+                continue
+
+            batch.append(visitor)
+            if deadline is None:
+                deadline = default_timer() + self.flush_interval
+
+        return batch
+
+    def _flush(self, batch: list) -> None:
+        flush_start = default_timer()
+        try:
+            self.writer(batch)
+        except Exception:
+            logger.exception("Failed to write %d buffered visitors", len(batch))
+            with self._lock:
+                self._counters['flush_errors'] += 1
+                self._counters['dropped'] += len(batch)
+            return
+
+        elapsed = default_timer() - flush_start
+        with self._lock:
+            self._counters['written'] += len(batch)
+            self._counters['flushes'] += 1
+            self._counters['last_flush_seconds'] = elapsed
+            self._counters['flush_seconds_total'] += elapsed
+            self._counters['max_flush_seconds'] = max(self._counters['max_flush_seconds'], elapsed)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            elif self._closed.is_set():
+                return
+
+
+# The process wide visitor queue, bound to the Flask application in register_extensions.
+visitor_queue = VisitorWriteQueue()
+os.register_at_fork(after_in_child=visitor_queue.reset_after_fork)
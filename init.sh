@@ -13,15 +13,18 @@ export LANG=C.UTF-8
 # set the flask app module in the environment variables
 export FLASK_APP=app.py
 
-# run database migrations
-flask db migrate
-
-flask db upgrade
-
-# seeds the database in the app main function
-python3 app.py
+# apply missing migrations, seed the database when the seed file changed and create the coming months'
+# visitor partitions, see hello/startup.py
+# exits right away when the database is current, one instance at a time does the work
+python3 -m hello.startup || exit 1
 
 HOST="0.0.0.0:${PORT}"
 
-# runs the WSGI server that serves the web application
-gunicorn -w 4 -b $HOST app:app
\ No newline at end of file
+# runs the server that serves the web application
+# the application is preloaded in gunicorn's master and shared with the workers, see gunicorn.conf.py
+# SERVER_MODE=asgi serves the async entry point in hello/asgi.py, the default is the Flask WSGI app
+if [ "$SERVER_MODE" = "asgi" ]; then
+    gunicorn -c gunicorn.conf.py -w 4 -k uvicorn.workers.UvicornWorker -b $HOST hello.asgi:application
+else
+    gunicorn -c gunicorn.conf.py -w 4 -b $HOST app:app
+fi
\ No newline at end of file
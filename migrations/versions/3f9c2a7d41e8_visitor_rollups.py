@@ -0,0 +1,47 @@
+"""visitor rollup tables
+
+Revision ID: 3f9c2a7d41e8
+Revises: 60b1a64591b6
+Create Date: 2026-10-17 09:12:44.318021
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a7d41e8'
+down_revision = '60b1a64591b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('visitor_hourly_rollup',
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('country', sa.String(length=100), nullable=False),
+    sa.Column('browser', sa.Text(), nullable=False),
+    sa.Column('operating_system', sa.Text(), nullable=False),
+    sa.Column('visits', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('bucket', 'country', 'browser', 'operating_system')
+    )
+    op.create_table('visitor_daily_rollup',
+    sa.Column('bucket', sa.Date(), nullable=False),
+    sa.Column('country', sa.String(length=100), nullable=False),
+    sa.Column('browser', sa.Text(), nullable=False),
+    sa.Column('operating_system', sa.Text(), nullable=False),
+    sa.Column('visits', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('bucket', 'country', 'browser', 'operating_system')
+    )
+    op.create_table('rollup_watermark',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('last_pk', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('rollup_watermark')
+    op.drop_table('visitor_daily_rollup')
+    op.drop_table('visitor_hourly_rollup')
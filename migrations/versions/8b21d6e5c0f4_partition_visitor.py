@@ -0,0 +1,94 @@
+"""partition visitor by month on date_visited
+
+Revision ID: 8b21d6e5c0f4
+Revises: 3f9c2a7d41e8
+Create Date: 2026-10-17 11:40:02.551873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b21d6e5c0f4'
+down_revision = '3f9c2a7d41e8'
+branch_labels = None
+depends_on = None
+
+# Monthly partitions created past the current month, flask partitions keeps creating them afterwards
+MONTHS_AHEAD = 3
+
+
+def upgrade():
+    # the existing rows are copied into the partitioned table and the old table dropped,
+    # the pk sequence is kept so visitor keys and the rollup watermark stay valid
+    op.execute("ALTER TABLE visitor RENAME TO visitor_unpartitioned")
+    op.execute("ALTER TABLE visitor_unpartitioned RENAME CONSTRAINT visitor_pkey TO visitor_unpartitioned_pkey")
+    op.execute("ALTER SEQUENCE visitor_pk_seq OWNED BY NONE")
+
+    # the partition key must be part of the primary key and cannot be null
+    op.execute("""
+        CREATE TABLE visitor (
+            pk INTEGER NOT NULL DEFAULT nextval('visitor_pk_seq'),
+            country VARCHAR(100),
+            browser TEXT,
+            operating_system TEXT,
+            date_visited TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+            CONSTRAINT visitor_pkey PRIMARY KEY (pk, date_visited)
+        ) PARTITION BY RANGE (date_visited)
+    """)
+    op.execute("ALTER SEQUENCE visitor_pk_seq OWNED BY visitor.pk")
+
+    # one partition per month from the oldest visit to MONTHS_AHEAD months from now
+    op.execute(f"""
+        DO $$
+        DECLARE
+            month DATE;
+        BEGIN
+            FOR month IN
+                SELECT generate_series(
+                    date_trunc('month', COALESCE(oldest, NOW())),
+                    date_trunc('month', NOW()) + INTERVAL '{MONTHS_AHEAD} months',
+                    INTERVAL '1 month')::date
+                  FROM (SELECT MIN(date_visited) AS oldest FROM visitor_unpartitioned) AS bounds
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF visitor FOR VALUES FROM (%L) TO (%L)',
+                    to_char(month, '"visitor_y"YYYY"m"MM'), month, month + INTERVAL '1 month');
+            END LOOP;
+        END
+        $$
+    """)
+    op.execute("CREATE TABLE visitor_default PARTITION OF visitor DEFAULT")
+
+    op.execute("""
+        INSERT INTO visitor (pk, country, browser, operating_system, date_visited)
+        SELECT pk, country, browser, operating_system, COALESCE(date_visited, NOW())
+          FROM visitor_unpartitioned
+    """)
+    op.execute("DROP TABLE visitor_unpartitioned")
+
+    # visits are appended in date order, so a block range index answers date range queries
+    # at a fraction of the size of a btree
+    op.create_index('ix_visitor_date_visited_brin', 'visitor', ['date_visited'], postgresql_using='brin')
+
+
+def downgrade():
+    op.execute("ALTER TABLE visitor RENAME TO visitor_partitioned")
+    op.execute("ALTER TABLE visitor_partitioned RENAME CONSTRAINT visitor_pkey TO visitor_partitioned_pkey")
+    op.execute("ALTER SEQUENCE visitor_pk_seq OWNED BY NONE")
+    op.create_table('visitor',
+    sa.Column('pk', sa.Integer(), server_default=sa.text("nextval('visitor_pk_seq')"), nullable=False),
+    sa.Column('country', sa.String(length=100), nullable=True),
+    sa.Column('browser', sa.Text(), nullable=True),
+    sa.Column('operating_system', sa.Text(), nullable=True),
+    sa.Column('date_visited', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('pk')
+    )
+    op.execute("ALTER SEQUENCE visitor_pk_seq OWNED BY visitor.pk")
+    op.execute("""
+        INSERT INTO visitor (pk, country, browser, operating_system, date_visited)
+        SELECT pk, country, browser, operating_system, date_visited FROM visitor_partitioned
+    """)
+    # dropping the partitioned table drops every attached partition with it
+    op.execute("DROP TABLE visitor_partitioned")
@@ -0,0 +1,31 @@
+"""server-side http sessions
+
+Revision ID: a4b8e2f61c07
+Revises: d57e0a3c9b12
+Create Date: 2026-10-17 14:21:09.117356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4b8e2f61c07'
+down_revision = 'd57e0a3c9b12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('http_session',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_http_session_expires_at'), 'http_session', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_http_session_expires_at'), table_name='http_session')
+    op.drop_table('http_session')
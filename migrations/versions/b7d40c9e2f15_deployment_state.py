@@ -0,0 +1,29 @@
+"""deployment state recorded by the startup step
+
+Revision ID: b7d40c9e2f15
+Revises: e6f2b8d13a94
+Create Date: 2026-10-17 18:40:12.530118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d40c9e2f15'
+down_revision = 'e6f2b8d13a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('deployment_state',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('value', sa.Text(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('deployment_state')
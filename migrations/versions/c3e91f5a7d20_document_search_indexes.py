@@ -0,0 +1,29 @@
+"""index azure_document for category filtering and title search
+
+Revision ID: c3e91f5a7d20
+Revises: a4b8e2f61c07
+Create Date: 2026-10-17 15:42:18.530961
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e91f5a7d20'
+down_revision = 'a4b8e2f61c07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a category's documents in pk order, the keyset pages of /api/documents?category=
+    op.create_index('ix_azure_document_category_pk', 'azure_document', ['category', 'pk'], unique=False)
+    # must match the expression AzureDocument.query_rows searches, or the planner cannot use it
+    op.execute("CREATE INDEX ix_azure_document_title_search ON azure_document "
+               "USING gin (to_tsvector('english', coalesce(title, '')))")
+
+
+def downgrade():
+    op.drop_index('ix_azure_document_title_search', table_name='azure_document')
+    op.drop_index('ix_azure_document_category_pk', table_name='azure_document')
@@ -0,0 +1,25 @@
+"""index azure_document by url for the catalog sync
+
+Revision ID: d57e0a3c9b12
+Revises: 8b21d6e5c0f4
+Create Date: 2026-10-17 13:05:37.904112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd57e0a3c9b12'
+down_revision = '8b21d6e5c0f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # not unique, catalogs seeded before the sync may hold a url twice, the sync deletes the extra copies
+    op.create_index(op.f('ix_azure_document_url'), 'azure_document', ['url'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_azure_document_url'), table_name='azure_document')
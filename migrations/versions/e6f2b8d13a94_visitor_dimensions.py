@@ -0,0 +1,136 @@
+"""move visitor country, browser and operating system into dimension tables
+
+Revision ID: e6f2b8d13a94
+Revises: c3e91f5a7d20
+Create Date: 2026-10-17 16:58:44.207315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f2b8d13a94'
+down_revision = 'c3e91f5a7d20'
+branch_labels = None
+depends_on = None
+
+# Visitor column, dimension table and id type of each dimension
+DIMENSIONS = [
+    ('country', 'visitor_country', sa.SmallInteger(), sa.String(length=100)),
+    ('browser', 'visitor_browser', sa.Integer(), sa.Text()),
+    ('operating_system', 'visitor_operating_system', sa.SmallInteger(), sa.Text()),
+]
+
+# The stored functions of scripts/functions.sql that write visitors, kept in step with it
+VISITOR_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION visitor_dimension_id(dimension TEXT, value TEXT) RETURNS INTEGER AS $$
+DECLARE
+    key INTEGER;
+BEGIN
+    IF value IS NULL THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('SELECT id FROM %I WHERE name = $1', dimension) INTO key USING value;
+    IF key IS NULL THEN
+        EXECUTE format('INSERT INTO %I (name) VALUES ($1) ON CONFLICT (name) DO NOTHING RETURNING id', dimension)
+            INTO key USING value;
+    END IF;
+    IF key IS NULL THEN
+        -- inserted by a concurrent transaction that committed first
+        EXECUTE format('SELECT id FROM %I WHERE name = $1', dimension) INTO key USING value;
+    END IF;
+    RETURN key;
+END;
+$$ LANGUAGE PLPGSQL;
+
+CREATE OR REPLACE FUNCTION insert_visitor_ids(country_id SMALLINT, browser_id INTEGER, operating_system_id SMALLINT) RETURNS void AS $$
+BEGIN
+    INSERT INTO visitor(
+        country_id,
+        browser_id,
+        operating_system_id,
+        date_visited)
+    VALUES (
+        insert_visitor_ids.country_id,
+        insert_visitor_ids.browser_id,
+        insert_visitor_ids.operating_system_id,
+        NOW()
+    );
+END;
+$$ LANGUAGE PLPGSQL;
+
+CREATE OR REPLACE FUNCTION insert_visitor(country VARCHAR(40), browser VARCHAR(40), operating_system VARCHAR(40)) RETURNS void AS $$
+BEGIN
+    PERFORM insert_visitor_ids(
+        visitor_dimension_id('visitor_country', country)::SMALLINT,
+        visitor_dimension_id('visitor_browser', browser),
+        visitor_dimension_id('visitor_operating_system', operating_system)::SMALLINT);
+END;
+$$ LANGUAGE PLPGSQL;
+"""
+
+# insert_visitor as it was before the dimension tables
+PREVIOUS_INSERT_VISITOR = """
+CREATE OR REPLACE FUNCTION insert_visitor(country VARCHAR(40), browser VARCHAR(40), operating_system VARCHAR(40)) RETURNS void AS $$
+BEGIN
+    INSERT INTO visitor(
+        country,
+        browser,
+        operating_system,
+        date_visited)
+    VALUES (
+        country,
+        browser,
+        operating_system,
+        NOW()
+    );
+END;
+$$ LANGUAGE PLPGSQL;
+"""
+
+
+def upgrade():
+    for column, table, id_type, name_type in DIMENSIONS:
+        op.create_table(table,
+        sa.Column('id', id_type, nullable=False),
+        sa.Column('name', name_type, nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+        )
+        op.execute(f"INSERT INTO {table} (name) SELECT DISTINCT {column} FROM visitor WHERE {column} IS NOT NULL")
+        op.add_column('visitor', sa.Column(f'{column}_id', id_type, nullable=True))
+
+    # rewrites every visitor row once, the ids are looked up through the unique indexes on name
+    op.execute("""
+        UPDATE visitor
+           SET country_id = (SELECT id FROM visitor_country WHERE name = visitor.country),
+               browser_id = (SELECT id FROM visitor_browser WHERE name = visitor.browser),
+               operating_system_id = (SELECT id FROM visitor_operating_system WHERE name = visitor.operating_system)
+    """)
+
+    for column, table, _, _ in DIMENSIONS:
+        op.create_foreign_key(f'visitor_{column}_id_fkey', 'visitor', table, [f'{column}_id'], ['id'])
+        op.drop_column('visitor', column)
+
+    op.execute(VISITOR_FUNCTIONS)
+
+
+def downgrade():
+    op.execute(PREVIOUS_INSERT_VISITOR)
+    op.execute("DROP FUNCTION insert_visitor_ids(SMALLINT, INTEGER, SMALLINT)")
+    op.execute("DROP FUNCTION visitor_dimension_id(TEXT, TEXT)")
+
+    for column, _, _, name_type in DIMENSIONS:
+        op.add_column('visitor', sa.Column(column, name_type, nullable=True))
+    op.execute("""
+        UPDATE visitor
+           SET country = (SELECT name FROM visitor_country WHERE id = visitor.country_id),
+               browser = (SELECT name FROM visitor_browser WHERE id = visitor.browser_id),
+               operating_system = (SELECT name FROM visitor_operating_system WHERE id = visitor.operating_system_id)
+    """)
+
+    for column, table, _, _ in DIMENSIONS:
+        op.drop_constraint(f'visitor_{column}_id_fkey', 'visitor', type_='foreignkey')
+        op.drop_column('visitor', f'{column}_id')
+        op.drop_table(table)
@@ -1,19 +1,48 @@
-CREATE OR REPLACE FUNCTION insert_visitor(country VARCHAR(40), browser VARCHAR(40), operating_system VARCHAR(40)) RETURNS void AS $$
+CREATE OR REPLACE FUNCTION visitor_dimension_id(dimension TEXT, value TEXT) RETURNS INTEGER AS $$
+DECLARE
+    key INTEGER;
+BEGIN
+    IF value IS NULL THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('SELECT id FROM %I WHERE name = $1', dimension) INTO key USING value;
+    IF key IS NULL THEN
+        EXECUTE format('INSERT INTO %I (name) VALUES ($1) ON CONFLICT (name) DO NOTHING RETURNING id', dimension)
+            INTO key USING value;
+    END IF;
+    IF key IS NULL THEN
+        -- inserted by a concurrent transaction that committed first
+        EXECUTE format('SELECT id FROM %I WHERE name = $1', dimension) INTO key USING value;
+    END IF;
+    RETURN key;
+END;
+$$ LANGUAGE PLPGSQL;
+
+CREATE OR REPLACE FUNCTION insert_visitor_ids(country_id SMALLINT, browser_id INTEGER, operating_system_id SMALLINT) RETURNS void AS $$
 BEGIN
     INSERT INTO visitor(
-        country,
-        browser,
-        operating_system,
-        date_visited) 
+        country_id,
+        browser_id,
+        operating_system_id,
+        date_visited)
     VALUES (
-        country,
-        browser,
-        operating_system,
+        insert_visitor_ids.country_id,
+        insert_visitor_ids.browser_id,
+        insert_visitor_ids.operating_system_id,
         NOW()
     );
 END;
 $$ LANGUAGE PLPGSQL;
 
+CREATE OR REPLACE FUNCTION insert_visitor(country VARCHAR(40), browser VARCHAR(40), operating_system VARCHAR(40)) RETURNS void AS $$
+BEGIN
+    PERFORM insert_visitor_ids(
+        visitor_dimension_id('visitor_country', country)::SMALLINT,
+        visitor_dimension_id('visitor_browser', browser),
+        visitor_dimension_id('visitor_operating_system', operating_system)::SMALLINT);
+END;
+$$ LANGUAGE PLPGSQL;
+
 
 CREATE OR REPLACE FUNCTION insert_azure_document(title VARCHAR(40), url VARCHAR(100), category VARCHAR(40)) RETURNS void AS $$
 BEGIN